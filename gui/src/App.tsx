@@ -13,6 +13,7 @@ interface ModelList {
 interface DocResult {
   filename: string;
   markdown?: string;
+  markdown_url?: string;
   json?: any;
   error?: string;
 }
@@ -382,11 +383,16 @@ function App() {
           } else if (part.startsWith("event: error")) {
             const data = part.substring(part.indexOf("data: ") + 6).trim();
             setError(data);
-          } else if (part.startsWith("event: result")) {
+          } else if (part.startsWith("event: file_result")) {
+            // One event per finished file; large documents are sent by reference
             const data = part.substring(part.indexOf("data: ") + 6).trim();
             try {
-              const parsed = JSON.parse(data);
-              setResults(parsed.results || []);
+              const parsed: DocResult = JSON.parse(data);
+              if (parsed.markdown === undefined && parsed.markdown_url) {
+                const res = await fetch(parsed.markdown_url);
+                parsed.markdown = (await res.json()).markdown;
+              }
+              setResults(prev => [...prev, parsed]);
               setActiveTab(0);
             } catch (e) {
               console.error("JSON parse error", e);
@@ -0,0 +1,387 @@
+import asyncio
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+import psutil
+try:
+    import pynvml
+    nvml_available = True
+except ImportError:
+    nvml_available = False
+
+from clarion.tracing import span
+
+# Memory pressure (host RAM use, in percent) at which new windows and jobs are held back, and at
+# which they are admitted again
+HOLD_HIGH, HOLD_LOW = 92.0, 85.0
+# Memory pressure at which auto-sized contexts are capped at TIGHT_MAX_CTX, and released again
+TIGHT_HIGH, TIGHT_LOW = 80.0, 70.0
+TIGHT_MAX_CTX = 8192
+# The same for VRAM pressure: GPU memory taken by anything but the model server's resident models
+VRAM_HOLD_HIGH, VRAM_HOLD_LOW = 50.0, 40.0
+VRAM_TIGHT_HIGH, VRAM_TIGHT_LOW = 30.0, 20.0
+# Swap traffic (bytes/s in + out) at which concurrent LLM calls drop to SWAP_CONCURRENCY
+SWAP_HIGH, SWAP_LOW = 4 * 1024 * 1024, 512 * 1024
+SWAP_CONCURRENCY = 1
+# Samples are reused for this long; waiters check again at the same pace
+SAMPLE_INTERVAL = 1.0
+# How often the model server is asked which models it holds in VRAM
+RESIDENT_INTERVAL = 5.0
+
+
+class ResourceSample:
+    """
+    One reading of the host: RAM, VRAM (None without a GPU), the share of VRAM held by the model
+    server's resident models (None when unknown) and swap traffic.
+    """
+    def __init__(
+        self,
+        ram_percent: float,
+        vram_percent: Optional[float] = None,
+        swap_rate: float = 0.0,
+        cpu_percent: Optional[float] = None,
+        vram_resident_percent: Optional[float] = None
+    ):
+        self.ram_percent = ram_percent
+        self.vram_percent = vram_percent
+        self.swap_rate = swap_rate
+        self.cpu_percent = cpu_percent
+        self.vram_resident_percent = vram_resident_percent
+
+    @property
+    def memory_pressure(self) -> float:
+        return self.ram_percent
+
+    @property
+    def vram_pressure(self) -> Optional[float]:
+        """
+        VRAM in use by anything but the resident models, in percent: what the model server cannot
+        get back when it reloads a model at a larger context or loads another one. Resident models
+        count as free, since keeping them loaded is the normal state. None without a GPU or while
+        the resident models are unknown.
+        """
+        if self.vram_percent is None or self.vram_resident_percent is None:
+            return None
+        return max(0.0, self.vram_percent - self.vram_resident_percent)
+
+
+class MetricSource(ABC):
+    """
+    Where the admission controller reads host resources from.
+    """
+    @abstractmethod
+    def sample(self) -> ResourceSample:
+        pass
+
+
+# NVML handles do not survive a fork: every worker initializes its own on first use
+_nvml_init: Dict[int, bool] = {}
+
+def _nvml_ready() -> bool:
+    if not nvml_available:
+        return False
+    pid = os.getpid()
+    if pid not in _nvml_init:
+        try:
+            pynvml.nvmlInit()
+            _nvml_init[pid] = True
+        except Exception:
+            _nvml_init[pid] = False
+    return _nvml_init[pid]
+
+
+class ResidentModels:
+    """
+    VRAM held by the models Ollama has loaded (sum of size_vram in /api/ps), polled in a
+    background thread so samples never wait on HTTP. None until the first answer, and while
+    Ollama is unreachable.
+    """
+    def __init__(self, base_url: Optional[str] = None, interval: float = RESIDENT_INTERVAL):
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        self.interval = interval
+        self.vram_bytes: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    def _poll(self):
+        with httpx.Client(timeout=5.0) as client:
+            while True:
+                try:
+                    resp = client.get(f"{self.base_url}/api/ps")
+                    resp.raise_for_status()
+                    self.vram_bytes = sum(m.get("size_vram") or 0 for m in resp.json().get("models", []))
+                except Exception:
+                    self.vram_bytes = None
+                time.sleep(self.interval)
+
+    def get(self) -> Optional[int]:
+        # Threads do not survive a fork: every worker starts its own poller on first use
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.vram_bytes = None
+            threading.Thread(target=self._poll, name="clarion-resident-models", daemon=True).start()
+        return self.vram_bytes
+
+
+# One poller per process, shared by every host source
+_resident_models = ResidentModels()
+
+
+class HostMetricSource(MetricSource):
+    """
+    Reads this host through psutil and, when available, the first GPU through NVML, which is
+    assumed to be the GPU the local model server runs on. Swap traffic is the rate since the
+    previous sample (0 on the first one).
+    """
+    def __init__(self, resident: Optional[ResidentModels] = None):
+        self._last_swap: Optional[tuple] = None
+        self.resident = resident or _resident_models
+
+    def sample(self) -> ResourceSample:
+        swap = psutil.swap_memory()
+        now = time.monotonic()
+        swapped = swap.sin + swap.sout
+        swap_rate = 0.0
+        if self._last_swap is not None:
+            last_swapped, last_at = self._last_swap
+            swap_rate = max(0.0, (swapped - last_swapped) / max(now - last_at, 1e-6))
+        self._last_swap = (swapped, now)
+
+        vram_percent = vram_resident_percent = None
+        if _nvml_ready():
+            try:
+                handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+                info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                # Memory utilized / memory total
+                vram_percent = (info.used / info.total) * 100
+                resident = self.resident.get()
+                if resident is not None:
+                    vram_resident_percent = min(100.0, resident / info.total * 100)
+            except Exception:
+                pass
+
+        return ResourceSample(
+            ram_percent=psutil.virtual_memory().percent,
+            vram_percent=vram_percent,
+            swap_rate=swap_rate,
+            cpu_percent=psutil.cpu_percent(),
+            vram_resident_percent=vram_resident_percent
+        )
+
+
+class SimulatedMetricSource(MetricSource):
+    """
+    Replays given samples, then keeps returning the last one; set() replaces the current reading.
+    For exercising admission decisions without loading the host.
+    """
+    def __init__(self, samples: Optional[List[ResourceSample]] = None):
+        self._samples = list(samples or [ResourceSample(ram_percent=0.0)])
+
+    def set(
+        self,
+        ram_percent: float,
+        vram_percent: Optional[float] = None,
+        swap_rate: float = 0.0,
+        vram_resident_percent: Optional[float] = None
+    ):
+        self._samples = [ResourceSample(ram_percent, vram_percent, swap_rate, vram_resident_percent=vram_resident_percent)]
+
+    def sample(self) -> ResourceSample:
+        if len(self._samples) > 1:
+            return self._samples.pop(0)
+        return self._samples[0]
+
+
+class Hysteresis:
+    """
+    A flag that turns on at or above `high` and only turns off again at or below `low`,
+    so a reading hovering around one threshold does not flip decisions back and forth.
+    """
+    def __init__(self, high: float, low: float):
+        self.high = high
+        self.low = low
+        self.on = False
+
+    def update(self, value: float) -> bool:
+        if self.on and value <= self.low:
+            self.on = False
+        elif not self.on and value >= self.high:
+            self.on = True
+        return self.on
+
+
+class AdmissionController:
+    """
+    Acts on host memory and swap signals before the model server runs out of memory:
+
+    - hold: RAM or VRAM pressure is high; new jobs and windows wait until it eases. One window
+      and one job are always admitted when nothing else is running here, so work still
+      progresses when the pressure comes from other processes.
+    - tight: RAM or VRAM is getting scarce; auto-sized contexts are capped at tight_max_ctx, so
+      windows are cut smaller and the model's KV cache shrinks.
+    - swapping: the host is paging; concurrent LLM calls drop to swap_concurrency.
+
+    RAM and VRAM have separate thresholds. Each condition has separate on/off thresholds
+    (hysteresis), so decisions do not flap.
+    """
+    def __init__(
+        self,
+        source: Optional[MetricSource] = None,
+        hold: tuple = (HOLD_HIGH, HOLD_LOW),
+        tight: tuple = (TIGHT_HIGH, TIGHT_LOW),
+        vram_hold: tuple = (VRAM_HOLD_HIGH, VRAM_HOLD_LOW),
+        vram_tight: tuple = (VRAM_TIGHT_HIGH, VRAM_TIGHT_LOW),
+        swap: tuple = (SWAP_HIGH, SWAP_LOW),
+        tight_max_ctx: int = TIGHT_MAX_CTX,
+        swap_concurrency: int = SWAP_CONCURRENCY,
+        sample_interval: float = SAMPLE_INTERVAL
+    ):
+        self.source = source or HostMetricSource()
+        self.hold = Hysteresis(*hold)
+        self.tight = Hysteresis(*tight)
+        self.vram_hold = Hysteresis(*vram_hold)
+        self.vram_tight = Hysteresis(*vram_tight)
+        self.swapping = Hysteresis(*swap)
+        self.tight_max_ctx = tight_max_ctx
+        self.swap_concurrency = max(1, swap_concurrency)
+        self.sample_interval = sample_interval
+        self.active = {"job": 0, "window": 0, "call": 0}
+        # Currently waiting for admission, and waits since start
+        self.waiting = {"job": 0, "window": 0, "call": 0}
+        self.waits = {"job": 0, "window": 0, "call": 0}
+        self.last: Optional[ResourceSample] = None
+        self._sampled_at = 0.0
+
+    def refresh(self, force: bool = False) -> ResourceSample:
+        """
+        Takes a new sample if the last one is older than sample_interval, and updates the flags.
+        """
+        now = time.monotonic()
+        if self.last is not None and not force and now - self._sampled_at < self.sample_interval:
+            return self.last
+        sample = self.source.sample()
+        self.last, self._sampled_at = sample, now
+        flags = self._flags()
+        self.hold.update(sample.memory_pressure)
+        self.tight.update(sample.memory_pressure)
+        # Without a reading (no GPU, resident models unknown) VRAM flags keep their state
+        if sample.vram_pressure is not None:
+            self.vram_hold.update(sample.vram_pressure)
+            self.vram_tight.update(sample.vram_pressure)
+        self.swapping.update(sample.swap_rate)
+        if flags != self._flags():
+            vram = f"{sample.vram_pressure:.0f}%" if sample.vram_pressure is not None else "n/a"
+            print(
+                f"Admission: memory {sample.memory_pressure:.0f}%, VRAM outside resident models {vram}, "
+                f"swap {sample.swap_rate / 1024:.0f} KiB/s -> hold={self.holding}, tight={self.tightening}, "
+                f"swapping={self.swapping.on}"
+            )
+        return sample
+
+    def _flags(self) -> tuple:
+        return (self.hold.on, self.tight.on, self.vram_hold.on, self.vram_tight.on, self.swapping.on)
+
+    @property
+    def holding(self) -> bool:
+        return self.hold.on or self.vram_hold.on
+
+    @property
+    def tightening(self) -> bool:
+        return self.tight.on or self.vram_tight.on
+
+    def try_acquire(self, kind: str) -> bool:
+        """
+        Admits one job, window or LLM call if the current state allows it.
+        """
+        self.refresh()
+        if kind == "call":
+            allowed = not self.swapping.on or self.active["call"] < self.swap_concurrency
+        elif kind == "job":
+            allowed = not self.holding or self.active["job"] == 0
+        else:
+            allowed = not self.holding or self.active["window"] == 0
+        if allowed:
+            self.active[kind] += 1
+        return allowed
+
+    def release(self, kind: str):
+        self.active[kind] -= 1
+
+    async def acquire(self, kind: str):
+        if self.try_acquire(kind):
+            return
+        self.waits[kind] += 1
+        self.waiting[kind] += 1
+        try:
+            with span("admission.wait", kind=kind):
+                while not self.try_acquire(kind):
+                    await asyncio.sleep(self.sample_interval)
+        finally:
+            self.waiting[kind] -= 1
+
+    @asynccontextmanager
+    async def admitted(self, kind: str) -> AsyncIterator[None]:
+        await self.acquire(kind)
+        try:
+            yield
+        finally:
+            self.release(kind)
+
+    def cap_ctx(self, ceiling: int) -> int:
+        """
+        Largest context to size calls with under the current memory state.
+        """
+        self.refresh()
+        return min(ceiling, self.tight_max_ctx) if self.tightening else ceiling
+
+    def status(self) -> dict:
+        sample = self.refresh()
+        return {
+            "memory_pressure": sample.memory_pressure,
+            "vram_percent": sample.vram_percent,
+            "vram_pressure": sample.vram_pressure,
+            "swap_rate": sample.swap_rate,
+            "hold": self.holding,
+            "tight": self.tightening,
+            "ram_hold": self.hold.on,
+            "ram_tight": self.tight.on,
+            "vram_hold": self.vram_hold.on,
+            "vram_tight": self.vram_tight.on,
+            "swapping": self.swapping.on,
+            "active": dict(self.active),
+            "waiting": dict(self.waiting),
+            "waits_total": dict(self.waits)
+        }
+
+
+# Admission control of this process, if enabled (opt-in for the CLI and the server)
+_active_controller: Optional[AdmissionController] = None
+
+
+def activate(controller: Optional[AdmissionController]):
+    global _active_controller
+    _active_controller = controller
+
+
+def active_controller() -> Optional[AdmissionController]:
+    return _active_controller
+
+
+@asynccontextmanager
+async def admitted(kind: str) -> AsyncIterator[None]:
+    """
+    Waits for admission of a job, window or LLM call when admission control is active; a no-op otherwise.
+    """
+    if _active_controller is None:
+        yield
+        return
+    async with _active_controller.admitted(kind):
+        yield
+
+
+def cap_ctx(ceiling: int) -> int:
+    return _active_controller.cap_ctx(ceiling) if _active_controller else ceiling
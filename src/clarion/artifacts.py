@@ -0,0 +1,51 @@
+import re
+from typing import Dict, Iterable, Sequence
+
+from clarion.schemas import ActionItem, Artifacts, Claim, FlexDoc, GlossaryTerm
+
+_CONFIDENCE_RANK = {"low": 0, "medium": 1, "high": 2}
+
+
+def _key(text: str) -> str:
+    # Same item across windows: case, punctuation and spacing differ, the words do not
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+def merge_artifacts(docs: Iterable[FlexDoc], kinds: Sequence[str]) -> Artifacts:
+    """
+    Merges the artifacts of every window into one set, in order of first appearance.
+    Only the requested kinds are kept, whatever else the model filled in.
+    Duplicates (same words, ignoring case and punctuation) are merged: a glossary term keeps
+    its longest definition, a claim its highest confidence, and an action item the owner and
+    due date from whichever window stated them.
+    """
+    glossary: Dict[str, GlossaryTerm] = {}
+    claims: Dict[str, Claim] = {}
+    actions: Dict[str, ActionItem] = {}
+    for doc in docs:
+        for term in getattr(doc, "glossary", []) if "glossary" in kinds else []:
+            key = _key(term.term)
+            if not key:
+                continue
+            kept = glossary.get(key)
+            if kept is None or len(term.definition) > len(kept.definition):
+                glossary[key] = GlossaryTerm(term=kept.term if kept else term.term, definition=term.definition)
+        for claim in getattr(doc, "claims", []) if "claims" in kinds else []:
+            key = _key(claim.claim)
+            if not key:
+                continue
+            kept = claims.get(key)
+            if kept is None or _CONFIDENCE_RANK[claim.confidence] > _CONFIDENCE_RANK[kept.confidence]:
+                claims[key] = Claim(claim=kept.claim if kept else claim.claim, confidence=claim.confidence)
+        for action in getattr(doc, "action_items", []) if "action_items" in kinds else []:
+            key = _key(action.action)
+            if not key:
+                continue
+            kept = actions.get(key)
+            if kept is None:
+                actions[key] = action.model_copy()
+            else:
+                kept.owner = kept.owner or action.owner
+                kept.due_date = kept.due_date or action.due_date
+    return Artifacts(glossary=list(glossary.values()), claims=list(claims.values()), action_items=list(actions.values()))
+
@@ -0,0 +1,160 @@
+import json
+from typing import Optional, Type
+
+from pydantic import BaseModel
+
+from clarion.schemas import GenerationConfig
+from clarion.prompt_loader import render_prompt, schema_example
+
+# Per-call context sizes are powers of two from MIN_CTX_BUCKET up. Ollama reloads the runner
+# whenever num_ctx changes, so draft and review calls (which run concurrently) and windows of
+# different sizes must land on the same few values to keep the loaded model and its KV cache.
+MIN_CTX_BUCKET = 4096
+# Context warm models are loaded at (CLARION_WARM_CTX): the bucket of a one-shot document
+# with the default 2000-word budget
+DEFAULT_WARM_CTX = 8192
+# Tokens reserved for the 'thought_process' field of every structured response.
+THOUGHT_ALLOWANCE = 256
+# Safety margin on top of the char/4 estimate (repair prompt, tokenizer drift).
+CTX_MARGIN = 256
+MIN_PREDICT = 512
+# Average tokens per English word, plus slack for JSON string escaping and
+# for models that overshoot the requested length a little.
+TOKENS_PER_WORD = 1.35
+BUDGET_SLACK = 1.35
+# Smallest per-window word budget, so short tail windows still get a usable answer.
+MIN_WINDOW_WORDS = 150
+# Share of a window's character budget reserved for overlap with the previous window.
+OVERLAP_SHARE = 0.1
+
+# Output/input ratios keyed by instruction keywords (first match wins).
+_RATIO_HINTS = [
+    (("brief", "concise", "short", "tl;dr", "abstract", "key points", "action items", "list"), 0.35),
+    (("summar",), 0.6),
+]
+DEFAULT_OUTPUT_RATIO = 1.0
+REVIEW_OUTPUT_RATIO = 1.15
+# Extra output per requested artifact kind (glossary, claims, action items), relative to input
+ARTIFACT_OUTPUT_RATIO = 0.15
+
+
+def estimate_tokens(text: str) -> int:
+    # Simple token estimator (char / 4)
+    return len(text) // 4
+
+
+def output_ratio(instruction: Optional[str]) -> float:
+    """
+    Expected output/input token ratio for an instruction.
+    """
+    text = (instruction or "").lower()
+    for keywords, ratio in _RATIO_HINTS:
+        if any(k in text for k in keywords):
+            return ratio
+    return DEFAULT_OUTPUT_RATIO
+
+
+def wrapper_tokens(schema: Type[BaseModel]) -> int:
+    """
+    Tokens added by the JSON enforcement wrapper around every prompt.
+    """
+    wrapped = render_prompt(
+        "json_enforcement.j2",
+        prompt="",
+        schema_json=json.dumps(schema.model_json_schema()),
+        example_json=schema_example(schema)
+    )
+    return estimate_tokens(wrapped)
+
+
+def context_ceiling(config: GenerationConfig, model_max: Optional[int]) -> int:
+    """
+    Largest context a single call may use.
+    Manual mode uses num_ctx as-is; auto mode uses the model maximum, bounded by max_ctx.
+    """
+    if not config.auto_ctx:
+        return config.num_ctx
+    ceiling = model_max or config.num_ctx
+    if config.max_ctx:
+        ceiling = min(ceiling, config.max_ctx)
+    return ceiling
+
+
+def max_input_tokens(ceiling: int, overhead: int, ratio: float, config: GenerationConfig) -> int:
+    """
+    Largest input (in tokens) that fits one call together with its expected output.
+    """
+    if not config.auto_ctx:
+        # Legacy behaviour: fixed reserve for prompt and output
+        return max(1000, ceiling - 2000)
+
+    room = ceiling - overhead - THOUGHT_ALLOWANCE - CTX_MARGIN
+    # Output grows with input until it hits max_predict
+    proportional = int(room / (1 + ratio))
+    capped = room - config.max_predict
+    return max(1000, proportional, capped)
+
+
+def size_num_predict(input_tokens: int, ratio: float, config: GenerationConfig) -> int:
+    """
+    Output budget for a call derived from its input size.
+    """
+    if not config.auto_ctx:
+        return config.num_predict
+    expected = int(input_tokens * ratio) + THOUGHT_ALLOWANCE
+    return max(MIN_PREDICT, min(expected, config.max_predict))
+
+
+def expected_output_tokens(input_tokens: int, ratio: float, num_predict: int) -> int:
+    """
+    Likely output length of a call (used for planning): proportional to input, capped by num_predict.
+    """
+    return min(num_predict, int(input_tokens * ratio) + THOUGHT_ALLOWANCE)
+
+
+def window_word_budget(word_budget: Optional[int], window_chars: int, chunk_chars: int) -> Optional[int]:
+    """
+    Per-window share of word_budget, proportional to the window's size relative to a full window.
+    """
+    if not word_budget:
+        return None
+    if chunk_chars <= 0 or window_chars >= chunk_chars:
+        return word_budget
+    return max(MIN_WINDOW_WORDS, min(word_budget, round(word_budget * window_chars / chunk_chars)))
+
+
+def budget_to_tokens(words: int) -> int:
+    """
+    num_predict needed for a response of `words` words (including thought_process and JSON framing).
+    """
+    return int(words * TOKENS_PER_WORD * BUDGET_SLACK) + THOUGHT_ALLOWANCE
+
+
+def cap_num_predict(num_predict: int, word_budget: Optional[int]) -> int:
+    """
+    Caps num_predict by the output budget so runaway generations stop early.
+    """
+    if not word_budget:
+        return num_predict
+    return min(num_predict, budget_to_tokens(word_budget))
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def ctx_bucket(tokens: int) -> int:
+    """
+    Smallest context bucket (a power of two, at least MIN_CTX_BUCKET) holding `tokens`.
+    """
+    bucket = MIN_CTX_BUCKET
+    while bucket < tokens:
+        bucket *= 2
+    return bucket
+
+
+def fit_num_ctx(prompt_tokens: int, num_predict: int, ceiling: int) -> int:
+    """
+    Smallest context bucket that fits prompt and output, capped at ceiling.
+    """
+    return min(ctx_bucket(prompt_tokens + num_predict + CTX_MARGIN), ceiling)
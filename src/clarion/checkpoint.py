@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple, Type
+
+from clarion.schemas import FlexDoc, CallRecord, GenerationConfig
+from clarion.similarity import SimilarityIndex
+
+DEFAULT_CHECKPOINT_DIR = ".clarion/checkpoints"
+# Checkpoints untouched for this long are removed when a store is opened
+DEFAULT_MAX_AGE_DAYS = 7
+# Content-addressed index of window results, next to the per-input directories
+WINDOWS_DIR = "windows"
+# Near-duplicate (MinHash/LSH) index of window texts, one file per config hash
+SIMILAR_DIR = "similar"
+
+# Settings that change scheduling, batching or reuse but not what is asked of the model for a window
+_SCHEDULING_FIELDS = {
+    "draft_concurrency", "review_concurrency", "stage_queue_size", "pack", "pack_max_docs", "reuse_similar"
+}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def window_key(text: str, previous_context: str = "", word_budget: Optional[int] = None) -> str:
+    """
+    Content address of a window: everything in it that reaches the prompt.
+    """
+    return hash_text("\0".join([previous_context, text, str(word_budget)]))
+
+
+def config_hash(instruction: str, model: str, config: GenerationConfig) -> str:
+    """
+    Hash of everything that affects a window's output.
+    """
+    payload = {
+        "instruction": instruction,
+        "model": model,
+        "config": config.model_dump(exclude=_SCHEDULING_FIELDS),
+    }
+    return hash_text(json.dumps(payload, sort_keys=True, default=str))
+
+
+class CheckpointStore:
+    """
+    Local store of finished window results, keyed by input hash, config hash and window index.
+    Results are always written; they are only read back when `resume` is set.
+
+    Layout: <root>/<input_hash>/<config_hash>/window_<index>.json
+    Each result is also linked under <root>/windows/<config_hash>/<window_key>.json, so an
+    edited document can reuse the results of windows whose content did not change.
+    """
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        resume: bool = False,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS
+    ):
+        self.root = Path(root or os.getenv("CLARION_CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR))
+        self.resume = resume
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._prune(max_age_days)
+        self._similar: dict = {}
+
+    def _window_path(self, input_hash: str, cfg_hash: str, index: int) -> Path:
+        return self.root / input_hash / cfg_hash / f"window_{index}.json"
+
+    def _content_path(self, cfg_hash: str, key: str) -> Path:
+        return self.root / WINDOWS_DIR / cfg_hash / f"{key}.json"
+
+    def load(
+        self, input_hash: str, cfg_hash: str, index: int, window_text: str, key: Optional[str] = None,
+        schema: Type[FlexDoc] = FlexDoc
+    ) -> Optional[Tuple[FlexDoc, List[CallRecord]]]:
+        """
+        Returns the stored result for a window, or None if missing, stale or resume is off.
+        Falls back to a content-addressed lookup by `key` when given. `schema` is the document
+        model the window was generated with (a FlexDoc subclass keeps its extra fields).
+        """
+        if not self.resume:
+            return None
+        path = self._window_path(input_hash, cfg_hash, index)
+        data = self._read(path)
+        # Splitting depends on model limits; only reuse if the window itself is unchanged
+        if data is None or data.get("window_hash") != hash_text(window_text):
+            data = self._read(self._content_path(cfg_hash, key)) if key else None
+        return self._parse(data, schema, f"window {index}")
+
+    def load_content(
+        self, cfg_hash: str, key: str, schema: Type[FlexDoc] = FlexDoc
+    ) -> Optional[Tuple[FlexDoc, List[CallRecord]]]:
+        """
+        Returns the result stored under a window's content address, whether or not resume is on
+        (near-duplicate reuse is enabled separately).
+        """
+        return self._parse(self._read(self._content_path(cfg_hash, key)), schema, key)
+
+    def _parse(
+        self, data: Optional[dict], schema: Type[FlexDoc], label: str
+    ) -> Optional[Tuple[FlexDoc, List[CallRecord]]]:
+        if data is None:
+            return None
+        try:
+            doc = schema.model_validate(data["doc"])
+            calls = [CallRecord.model_validate(c) for c in data.get("calls", [])]
+            return doc, calls
+        except Exception as e:
+            print(f"Ignoring invalid checkpoint for {label}: {e}")
+            return None
+
+    def similar_index(self, cfg_hash: str) -> SimilarityIndex:
+        """
+        Near-duplicate index of the windows generated under cfg_hash (loaded once per store).
+        """
+        if cfg_hash not in self._similar:
+            self._similar[cfg_hash] = SimilarityIndex(self.root / SIMILAR_DIR / f"{cfg_hash}.jsonl")
+        return self._similar[cfg_hash]
+
+    def _read(self, path: Path) -> Optional[dict]:
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+
+    def save(
+        self, input_hash: str, cfg_hash: str, index: int, window_text: str,
+        doc: FlexDoc, calls: List[CallRecord], key: Optional[str] = None
+    ):
+        path = self._window_path(input_hash, cfg_hash, index)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "window_hash": hash_text(window_text),
+            "saved_at": time.time(),
+            "doc": doc.model_dump(),
+            "calls": [c.model_dump() for c in calls],
+        }
+        # Write-then-rename so a crash never leaves a half-written checkpoint
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        # Keep the document's directory fresh for age-based pruning
+        os.utime(self.root / input_hash)
+
+        if key:
+            content_path = self._content_path(cfg_hash, key)
+            content_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                if content_path.exists():
+                    content_path.unlink()
+                os.link(path, content_path)
+            except OSError:
+                # Filesystem without hard links
+                shutil.copyfile(path, content_path)
+
+    def _prune(self, max_age_days: float):
+        cutoff = time.time() - max_age_days * 86400
+        for input_dir in self.root.iterdir():
+            try:
+                if input_dir.name == WINDOWS_DIR:
+                    for path in input_dir.glob("*/*.json"):
+                        if path.stat().st_mtime < cutoff:
+                            path.unlink()
+                elif input_dir.name == SIMILAR_DIR:
+                    # Appending keeps an index fresh; entries whose window was pruned are skipped on lookup
+                    for path in input_dir.glob("*.jsonl"):
+                        if path.stat().st_mtime < cutoff:
+                            path.unlink()
+                elif input_dir.is_dir() and input_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(input_dir)
+            except OSError:
+                pass
@@ -2,22 +2,106 @@ import typer
 import asyncio
 import json
 import logging
+import shutil
+import tempfile
 from pathlib import Path
 from typing import List, Optional
 from clarion.schemas import InstructionConfig
-from clarion.pipeline import run_pipeline
+from clarion.pipeline import run_pipeline, batch_plan
+from clarion.packing import iter_units, run_unit, plan_unit
+from clarion.schemas import BatchPlan, ARTIFACT_KINDS, DEGENERATE_POLICIES
+from clarion.budget import DEFAULT_WARM_CTX
 from clarion.renderer import render_markdown
 from clarion.providers import OllamaProvider
+from clarion.checkpoint import CheckpointStore, hash_text
+from clarion.watcher import DirectoryWatcher
+from clarion.tracing import Tracer, CpuSampler, use_tracer, TRACE_FORMATS
+from clarion import admission
+from clarion.ingest import DEFAULT_INCLUDE, DEFAULT_MAX_ENTRY_BYTES, IngestReport, iter_archive, iter_directory
 
 
-import sys
 # ... imports
 app = typer.Typer(help="Clarion: Bio-scientific documentation generator.")
 
 
+def parse_stage_options(items: List[str]) -> dict:
+    """
+    Parses 'stage.option=value' strings into {stage: {option: value}}.
+    Values are read as JSON where possible (numbers, booleans), else kept as strings.
+    """
+    options: dict = {}
+    for item in items:
+        key, sep, raw = item.partition("=")
+        stage, dot, name = key.partition(".")
+        if not sep or not dot:
+            raise typer.BadParameter(f"Expected stage.option=value, got '{item}'")
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw
+        options.setdefault(stage.strip(), {})[name.strip()] = value
+    return options
+
+
+def write_output(input_path: Path, out_dir: Path, result) -> Path:
+    """
+    Renders a pipeline result to <out_dir>/<stem>_doc.md and returns the path.
+    Extracted artifacts, if any, go to <out_dir>/<stem>_artifacts.json.
+    """
+    md_content = render_markdown(result.final_doc)
+    out_path = out_dir / f"{input_path.stem}_doc.md"
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(md_content)
+    if result.artifacts is not None:
+        with open(out_dir / f"{input_path.stem}_artifacts.json", "w", encoding="utf-8") as f:
+            f.write(result.artifacts.model_dump_json(indent=2))
+    return out_path
+
+
+def format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{secs:02d}s" if hours else f"{minutes}m{secs:02d}s"
+
+
+def echo_plan(plan: BatchPlan):
+    """
+    Prints a dry-run plan as a per-file table with totals.
+    """
+    typer.echo(f"{'file':<40} {'strategy':<9} {'windows':>8} {'calls':>9} {'prompt tok':>11} {'output tok':>11} {'time':>10}")
+    for f in plan.files:
+        windows = f"{f.windows}" + (f" ({len(f.cached_windows)}c)" if f.cached_windows else "")
+        windows += f" ({len(f.similar_windows)}s)" if f.similar_windows else ""
+        typer.echo(
+            f"{Path(f.input_file).name[:40]:<40} {f.strategy:<9} {windows:>8} {f'{f.call_count}-{f.max_calls}':>9} "
+            f"{f.prompt_tokens:>11} {f.output_tokens:>11} {format_duration(f.predicted_seconds):>10}"
+        )
+    typer.echo(
+        f"{'TOTAL':<40} {'':<9} {sum(f.windows for f in plan.files):>8} {f'{plan.call_count}-{plan.max_calls}':>9} "
+        f"{plan.prompt_tokens:>11} {plan.output_tokens:>11} {format_duration(plan.predicted_seconds):>10}"
+    )
+    saved = sum(f.compaction.saved_tokens for f in plan.files if f.compaction)
+    if saved:
+        typer.echo(f"Compaction removes ~{saved} input tokens before windowing.")
+    packed = [f for f in plan.files if f.strategy == "packed"]
+    if packed:
+        typer.echo(f"{len(packed)} file(s) share packed calls, listed on the first file of each pack.")
+    similar = sum(len(f.similar_windows) for f in plan.files)
+    if similar:
+        typer.echo(f"{similar} window(s) marked (s) reuse the output of a near-identical earlier window.")
+    models = sorted({c.model for f in plan.files for c in f.calls if c.estimate_source == "default"})
+    if models:
+        typer.echo(f"No throughput history for {', '.join(models)}: times use default rates.")
+
+
+@app.command()
 def generate(
-    inputs: List[Path] = typer.Option(..., "--input", "-i", help="Input files"),
+    inputs: List[Path] = typer.Option([], "--input", "-i", help="Input files"),
     out_dir: Path = typer.Option(..., help="Output directory"),
+    # Bulk ingest
+    archive: Optional[Path] = typer.Option(None, help="Tar/zip archive or directory of inputs, processed entry by entry"),
+    include: List[str] = typer.Option(DEFAULT_INCLUDE, help="Glob(s) selecting archive entries"),
+    max_entry_bytes: int = typer.Option(DEFAULT_MAX_ENTRY_BYTES, help="Skip archive entries larger than this"),
     # ...
     instruction: str = typer.Option(None, help="Inline instruction text"),
     prompt_file: List[Path] = typer.Option([], help="Path to user prompt override file(s)"),
@@ -25,12 +109,48 @@ def generate(
     model: str = typer.Option("llama3.1", help="Ollama model name"),
     base_url: str = typer.Option("http://localhost:11434", help="Ollama base URL"),
     # Pipeline options
-    word_budget: int = typer.Option(2000, help="Word budget per chunk"),
-    overlap: int = typer.Option(2, help="Segment overlap count"),
+    word_budget: int = typer.Option(2000, help="Output word budget per chunk (0 disables)"),
+    overlap: int = typer.Option(2, help="Trailing segments of the previous chunk passed as context"),
     # Gen options
     temperature: float = typer.Option(0.2, help="LLM Temperature"),
     top_p: float = typer.Option(0.9, help="LLM Top P"),
-    num_ctx: int = typer.Option(4096, help="LLM Context Window Size")
+    num_ctx: int = typer.Option(4096, help="LLM Context Window Size (fallback when the model limit is unknown)"),
+    auto_ctx: bool = typer.Option(True, help="Size num_ctx/num_predict per call from prompt size and model limits"),
+    max_ctx: Optional[int] = typer.Option(None, help="Upper bound for auto-sized num_ctx (default: model maximum)"),
+    # Model cascade
+    draft_model: Optional[str] = typer.Option(None, help="Model for the draft pass (default: --model)"),
+    review_model: Optional[str] = typer.Option(None, help="Model for the review pass (default: --model)"),
+    repair_model: Optional[str] = typer.Option(None, help="Model for JSON repair retries (default: stage model)"),
+    stage_option: List[str] = typer.Option([], help="Per-stage Ollama option, e.g. review.temperature=0"),
+    escalate: bool = typer.Option(False, help="Re-run a stage on --model when a cheaper stage model's output fails validation"),
+    # Stage pipelining
+    draft_concurrency: int = typer.Option(1, help="Concurrent draft calls per document"),
+    review_concurrency: int = typer.Option(1, help="Concurrent review calls per document"),
+    stage_queue_size: int = typer.Option(2, help="Drafts buffered between the draft and review stages"),
+    # Packing
+    pack: bool = typer.Option(False, help="Process several small files per draft/review call"),
+    pack_max_docs: int = typer.Option(8, help="Most files sharing one packed call"),
+    # Compaction
+    compact: bool = typer.Option(False, help="Strip front matter, comments, embedded images, duplicates and extra whitespace before generation"),
+    compact_code_lines: Optional[int] = typer.Option(None, help="With --compact, keep this many head/tail lines of each code block"),
+    compact_table_rows: Optional[int] = typer.Option(None, help="With --compact, keep this many rows of each table"),
+    # Artifacts
+    artifact: List[str] = typer.Option([], help=f"Also extract this artifact in the same pass (repeatable): {', '.join(ARTIFACT_KINDS)}; written to <stem>_artifacts.json"),
+    # Degenerate output
+    degenerate_policy: Optional[str] = typer.Option(None, help="Stream calls and stop degenerate output (repetition loops, stalls, runaway length): retry (stronger penalties) or truncate (keep the output before the loop)"),
+    # Near-duplicate reuse
+    reuse_similar: Optional[float] = typer.Option(None, min=0.0, max=1.0, help="Reuse the output of an earlier window at least this similar (0-1, e.g. 0.9) instead of generating"),
+    # Admission control
+    admission_control: bool = typer.Option(False, "--admission", help="Hold back windows, shrink contexts and lower concurrency under host RAM or VRAM pressure"),
+    # Checkpointing
+    resume: bool = typer.Option(False, help="Reuse checkpointed window results from an earlier interrupted run"),
+    checkpoint_dir: Optional[Path] = typer.Option(None, help="Checkpoint directory (default: .clarion/checkpoints)"),
+    # Profiling
+    profile: bool = typer.Option(False, help="Record a trace of the run to <out-dir>/trace.json"),
+    trace_format: str = typer.Option("chrome", help="Trace format: chrome (trace-event) or otel (OTLP/JSON)"),
+    profile_cpu: bool = typer.Option(False, help="Also sample Python stacks to <out-dir>/cpu_profile.folded"),
+    # Dry run
+    plan: bool = typer.Option(False, help="Only plan: report windows, calls, tokens and predicted time per file, then exit")
 ):
     """
     Generate documentation from input files.
@@ -39,6 +159,16 @@ def generate(
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger("clarion")
     
+    if not inputs and archive is None:
+        raise typer.BadParameter("Pass --input and/or --archive")
+    if trace_format not in TRACE_FORMATS:
+        raise typer.BadParameter(f"--trace-format must be one of {', '.join(TRACE_FORMATS)}")
+    unknown_artifacts = [a for a in artifact if a not in ARTIFACT_KINDS]
+    if unknown_artifacts:
+        raise typer.BadParameter(f"--artifact must be one of {', '.join(ARTIFACT_KINDS)} (got {', '.join(unknown_artifacts)})")
+    if degenerate_policy not in (None, *DEGENERATE_POLICIES):
+        raise typer.BadParameter(f"--degenerate-policy must be one of {', '.join(DEGENERATE_POLICIES)}")
+    
     # Ensure output dir
     out_dir.mkdir(parents=True, exist_ok=True)
     
@@ -56,14 +186,81 @@ def generate(
     gen_config = GenerationConfig(
         temperature=temperature,
         top_p=top_p,
-        num_ctx=num_ctx
+        num_ctx=num_ctx,
+        auto_ctx=auto_ctx,
+        max_ctx=max_ctx,
+        word_budget=word_budget or None,
+        overlap=overlap,
+        draft_model=draft_model,
+        review_model=review_model,
+        repair_model=repair_model,
+        stage_options=parse_stage_options(stage_option),
+        escalate=escalate,
+        draft_concurrency=draft_concurrency,
+        review_concurrency=review_concurrency,
+        stage_queue_size=stage_queue_size,
+        pack=pack,
+        pack_max_docs=pack_max_docs,
+        compact=compact,
+        compact_code_lines=compact_code_lines,
+        compact_table_rows=compact_table_rows,
+        artifacts=artifact,
+        reuse_similar=reuse_similar,
+        degenerate_policy=degenerate_policy
     )
     
+    # Window results are always checkpointed, so a failed batch can be rerun with --resume
+    checkpoints = CheckpointStore(str(checkpoint_dir) if checkpoint_dir else None, resume=resume)
+    failures = []
+    processed = 0
+    report = IngestReport()
+    extract_dir = Path(tempfile.mkdtemp()) if archive is not None and archive.is_file() else None
+    
+    def input_paths():
+        yield from inputs
+        if archive is None:
+            return
+        # Entries are extracted one at a time, right before they are processed
+        if extract_dir is None:
+            yield from iter_directory(archive, include, max_entry_bytes, report)
+        else:
+            yield from iter_archive(archive, extract_dir, include, max_entry_bytes, report)
+    
     async def process_all():
-        for input_path in inputs:
-            logger.info(f"Processing {input_path}...")
+        nonlocal processed
+        async def paths():
+            for input_path in input_paths():
+                yield str(input_path)
+        # With --pack, small files are grouped so several share one draft and one review call
+        async for unit in iter_units(paths(), config, provider, gen_config, checkpoints):
+            processed += len(unit)
+            logger.info(f"Processing {', '.join(unit)}...")
             try:
-                result = await run_pipeline(config, str(input_path), provider, gen_config)
+                outcomes = await run_unit(config, unit, provider, gen_config, checkpoints=checkpoints)
+            except Exception as e:
+                # A failed unit fails its files, like a failed file; the batch goes on
+                outcomes = [(input_path, e) for input_path in unit]
+            for input_path, result in outcomes:
+                input_path = Path(input_path)
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to process {input_path}: {result}")
+                    # Keep going: finished windows are checkpointed and the rest of the batch is independent
+                    failures.append(input_path)
+                    continue
+                if result.resumed_windows:
+                    logger.info(f"Resumed {len(result.resumed_windows)} window(s) from checkpoints")
+                stops = [stop for c in result.calls for stop in c.early_stops]
+                if stops:
+                    logger.info(
+                        f"Stopped {len(stops)} degenerate stream(s) early, saving ~{sum(s.saved_tokens for s in stops)} tokens "
+                        f"(~{format_duration(sum(s.saved_seconds for s in stops))})"
+                    )
+                for warning in result.artifact_warnings:
+                    logger.warning(f"Artifacts incomplete. {warning}")
+                for reuse in result.reused_windows:
+                    logger.info(f"Window {reuse.window+1} reused window {reuse.source_window+1} of {reuse.source} (similarity {reuse.similarity:.2f})")
+                if result.compaction and result.compaction.saved_tokens:
+                    logger.info(f"Compaction saved ~{result.compaction.saved_tokens}/{result.compaction.original_tokens} input tokens")
                 
                 # Write Manifest
                 manifest_name = f"{input_path.stem}_manifest.json"
@@ -82,23 +279,196 @@ def generate(
                 # We will accept this gap for the "Skeleton" phase and refine if needed.
                 
                 # Render Markdown
-                md_content = render_markdown(result.final_doc)
-                out_name = f"{input_path.stem}_doc.md"
-                out_path = out_dir / out_name
-                
-                with open(out_path, "w", encoding="utf-8") as f:
-                    f.write(md_content)
-                    
+                try:
+                    out_path = write_output(input_path, out_dir, result)
+                except Exception as e:
+                    logger.error(f"Failed to write output for {input_path}: {e}")
+                    failures.append(input_path)
+                    continue
                 logger.info(f"Generated {out_path}")
-                
+
+    if plan:
+        async def plan_all():
+            order = []
+            async def paths():
+                for input_path in input_paths():
+                    order.append(str(input_path))
+                    yield str(input_path)
+            # Grouped like a real run, so --pack plans packed calls
+            plans = {}
+            async for unit in iter_units(paths(), config, provider, gen_config, checkpoints):
+                for file_plan in await plan_unit(config, unit, provider, gen_config, checkpoints):
+                    plans[file_plan.input_file] = file_plan
+            return [plans[path] for path in order]
+        try:
+            batch = batch_plan(asyncio.run(plan_all()))
+        finally:
+            if extract_dir is not None:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+        echo_plan(batch)
+        plan_path = out_dir / "plan.json"
+        plan_path.write_text(batch.model_dump_json(indent=2), encoding="utf-8")
+        logger.info(f"Plan written to {plan_path}")
+        return
+
+    tracer = Tracer() if profile else None
+    sampler = CpuSampler() if profile_cpu else None
+    if sampler:
+        sampler.start()
+    if admission_control:
+        admission.activate(admission.AdmissionController())
+    try:
+        # Tasks copy the active tracer from this context
+        with use_tracer(tracer):
+            asyncio.run(process_all())
+    except KeyboardInterrupt:
+        # asyncio.run cancels the pipeline on Ctrl-C, which also aborts the in-flight Ollama request
+        logger.warning("Cancelled. Finished windows are checkpointed; rerun with --resume to continue.")
+        raise typer.Exit(code=130)
+    finally:
+        if extract_dir is not None:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+        if tracer:
+            trace_path = out_dir / ("trace.otel.json" if trace_format == "otel" else "trace.json")
+            tracer.write(trace_path, trace_format)
+            for name, entry in list(tracer.summary().items())[:8]:
+                logger.info(f"  {name}: {entry['total_ms']:.0f} ms over {entry['count']} span(s)")
+            logger.info(f"Trace written to {trace_path}")
+        if sampler:
+            sampler.stop()
+            sampler.write_folded(out_dir / "cpu_profile.folded")
+            logger.info(f"CPU profile ({sampler.samples} samples) written to {out_dir / 'cpu_profile.folded'}")
+    
+    for name, reason in report.skipped:
+        logger.info(f"Skipped archive entry {name}: {reason}")
+    
+    if failures:
+        logger.error(f"{len(failures)} of {processed} file(s) failed. Rerun with --resume to continue from checkpoints.")
+        raise typer.Exit(code=1)
+
+@app.command()
+def watch(
+    input_dir: Path = typer.Option(Path("inputs"), help="Directory to watch"),
+    out_dir: Path = typer.Option(Path("outputs"), help="Output directory"),
+    pattern: List[str] = typer.Option(["*.md"], help="File name glob(s) to watch"),
+    debounce: float = typer.Option(1.0, help="Seconds of quiet before a burst of saves is processed"),
+    poll: bool = typer.Option(False, help="Poll for changes instead of using file-system notifications"),
+    poll_interval: float = typer.Option(1.0, help="Polling interval in seconds"),
+    initial: bool = typer.Option(True, help="Generate all matching files on startup"),
+    instruction: str = typer.Option(None, help="Inline instruction text"),
+    prompt_file: List[Path] = typer.Option([], help="Path to user prompt override file(s)"),
+    # Provider options
+    model: str = typer.Option("llama3.1", help="Ollama model name"),
+    base_url: str = typer.Option("http://localhost:11434", help="Ollama base URL"),
+    # Pipeline options
+    word_budget: int = typer.Option(2000, help="Output word budget per chunk (0 disables)"),
+    overlap: int = typer.Option(2, help="Trailing segments of the previous chunk passed as context"),
+    # Gen options
+    temperature: float = typer.Option(0.2, help="LLM Temperature"),
+    top_p: float = typer.Option(0.9, help="LLM Top P"),
+    num_ctx: int = typer.Option(4096, help="LLM Context Window Size (fallback when the model limit is unknown)"),
+    max_ctx: Optional[int] = typer.Option(None, help="Upper bound for auto-sized num_ctx (default: model maximum)"),
+    draft_model: Optional[str] = typer.Option(None, help="Model for the draft pass (default: --model)"),
+    review_model: Optional[str] = typer.Option(None, help="Model for the review pass (default: --model)"),
+    fast_mode: bool = typer.Option(False, help="Skip the review pass"),
+    checkpoint_dir: Optional[Path] = typer.Option(None, help="Checkpoint directory (default: .clarion/checkpoints)")
+):
+    """
+    Watch a directory and regenerate documentation for files as they change.
+    Only edited windows of a changed file are regenerated; the rest come from checkpoints.
+    """
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("clarion")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_root = out_dir.resolve()
+
+    config = InstructionConfig(
+        user_prompt_files=[str(p) for p in prompt_file],
+        inline_instruction=instruction
+    )
+    from clarion.schemas import GenerationConfig
+    gen_config = GenerationConfig(
+        temperature=temperature,
+        top_p=top_p,
+        num_ctx=num_ctx,
+        max_ctx=max_ctx,
+        word_budget=word_budget or None,
+        overlap=overlap,
+        draft_model=draft_model,
+        review_model=review_model,
+        fast_mode=fast_mode
+    )
+    # Provider (and its model metadata cache) and checkpoints stay warm for the daemon's lifetime
+    provider = OllamaProvider(model_name=model, base_url=base_url)
+    checkpoints = CheckpointStore(str(checkpoint_dir) if checkpoint_dir else None, resume=True)
+    watcher = DirectoryWatcher(input_dir, pattern, debounce=debounce, poll_interval=poll_interval, force_polling=poll)
+    # Content hash of each file when it was last generated, to skip saves that changed nothing
+    generated: dict = {}
+
+    async def regenerate(paths):
+        for input_path in sorted(paths):
+            if out_root in input_path.resolve().parents:
+                continue
+            try:
+                digest = hash_text(input_path.read_text(encoding="utf-8"))
+            except OSError as e:
+                logger.warning(f"Skipping {input_path}: {e}")
+                continue
+            if generated.get(input_path) == digest:
+                continue
+            logger.info(f"Regenerating {input_path}...")
+            try:
+                result = await run_pipeline(config, str(input_path), provider, gen_config, checkpoints=checkpoints)
+                out_path = write_output(input_path, out_dir, result)
+                generated[input_path] = digest
+                windows = len({c.window for c in result.calls})
+                logger.info(f"Generated {out_path} ({len(result.resumed_windows)}/{windows} windows reused)")
             except Exception as e:
                 logger.error(f"Failed to process {input_path}: {e}")
-                # continue or fail?
-                # fail for now
-                raise e
 
-    asyncio.run(process_all())
+    async def run():
+        mode = "polling" if not watcher.use_notify else "notifications"
+        logger.info(f"Watching {input_dir} for {', '.join(pattern)} ({mode})...")
+        if initial:
+            await regenerate(watcher.scan())
+        async for batch in watcher.changes():
+            await regenerate(batch)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", help="Bind address"),
+    port: int = typer.Option(8000, help="Port"),
+    workers: int = typer.Option(1, help="Worker processes (the JSON repair, rendering and SSE work of each runs on its own core)"),
+    ollama_concurrency: int = typer.Option(0, help="Concurrent Ollama calls across all workers (0 = unlimited)"),
+    state_db: Optional[Path] = typer.Option(None, help="Shared state database (default: .clarion/state.db)"),
+    admission_control: bool = typer.Option(True, "--admission/--no-admission", help="Hold back work and shrink contexts under host RAM or VRAM pressure"),
+    warm_model: List[str] = typer.Option([], help="Model to load at startup and keep loaded (repeatable); /v1/ready waits for them"),
+    keep_alive: Optional[str] = typer.Option(None, help="How long Ollama keeps a model loaded after a call: seconds (-1 = always) or a duration like 30m"),
+    warm_interval: float = typer.Option(60.0, help="Seconds between checks that warm models are still loaded"),
+    warm_ctx: int = typer.Option(DEFAULT_WARM_CTX, help="Context (num_ctx) warm models are loaded at; calls sized to another context bucket reload the model")
+):
+    """
+    Run the API server. Workers share the Ollama call budget, job index and metrics through a
+    SQLite database, so any worker can report on or cancel any job.
+    """
+    import os
+    import uvicorn
+    # Workers are separate processes: settings reach them through the environment
+    os.environ["CLARION_OLLAMA_CONCURRENCY"] = str(ollama_concurrency)
+    os.environ["CLARION_ADMISSION"] = "1" if admission_control else "0"
+    os.environ["CLARION_WARM_MODELS"] = ",".join(warm_model)
+    os.environ["CLARION_WARM_INTERVAL"] = str(warm_interval)
+    os.environ["CLARION_WARM_CTX"] = str(warm_ctx)
+    if keep_alive is not None:
+        os.environ["CLARION_KEEP_ALIVE"] = keep_alive
+    if state_db:
+        os.environ["CLARION_STATE_DB"] = str(state_db)
+    uvicorn.run("clarion.server:app", host=host, port=port, workers=workers)
 
 if __name__ == "__main__":
-    print(f"DEBUG: argv={sys.argv}")
-    typer.run(generate)
+    app()
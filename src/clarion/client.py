@@ -0,0 +1,195 @@
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
+
+from clarion.schemas import InstructionConfig, DocResult, GenerationConfig, FilePlan
+from clarion.pipeline import DirectPipeline
+from clarion.packing import iter_units, run_unit
+from clarion.providers import OllamaProvider
+from clarion.checkpoint import CheckpointStore
+from clarion.tracing import Tracer, use_tracer
+from clarion import admission
+
+# Documents amap accepts: a mapping of name -> text, or (name, text) pairs, or bare texts
+Documents = Union[Mapping[str, str], Iterable[Union[str, Tuple[str, str]]], AsyncIterable[Union[str, Tuple[str, str]]]]
+Outcome = Tuple[str, Union[DocResult, Exception]]
+
+
+class ClarionClient:
+    """
+    In-process entry point to the pipeline, for services that would otherwise call the HTTP API.
+    A client is long-lived: it owns the Ollama provider (and its model metadata cache), the
+    checkpoint store, and the limit on documents in flight, shared by every call made through it.
+    Runs use the same scheduling as the server (stage pipelining, packing, compaction, admission
+    control) and record spans to `tracer` when given.
+
+        async with ClarionClient(model="llama3.1", config=GenerationConfig(pack=True)) as client:
+            result = await client.generate(text, instruction="List the action items.")
+            async for name, outcome in client.amap({"a.md": a, "b.md": b}):
+                ...
+    """
+    def __init__(
+        self,
+        model: str = "llama3.1",
+        base_url: Optional[str] = None,
+        instruction: Optional[str] = None,
+        config: Optional[GenerationConfig] = None,
+        checkpoint_dir: Optional[str] = None,
+        resume: bool = True,
+        max_concurrent_docs: int = 2,
+        admission_control: bool = False,
+        tracer: Optional[Tracer] = None
+    ):
+        self.provider = OllamaProvider(model_name=model, base_url=base_url)
+        self.instruction = instruction
+        self.config = config or GenerationConfig()
+        self.checkpoints = CheckpointStore(checkpoint_dir, resume=resume)
+        self.tracer = tracer
+        self._limit = asyncio.Semaphore(max(1, max_concurrent_docs))
+        # Admission control is process-wide; only the client that turned it on turns it off
+        self._owns_admission = admission_control and admission.active_controller() is None
+        if self._owns_admission:
+            admission.activate(admission.AdmissionController())
+
+    async def __aenter__(self) -> "ClarionClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_admission:
+            admission.activate(None)
+            self._owns_admission = False
+
+    def _instruction_config(self, instruction: Optional[str]) -> InstructionConfig:
+        return InstructionConfig(inline_instruction=instruction or self.instruction)
+
+    async def generate(
+        self,
+        text: str,
+        instruction: Optional[str] = None,
+        config: Optional[GenerationConfig] = None,
+        name: str = "document.md",
+        status_callback: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> DocResult:
+        """
+        Generates one document from text. `name` labels it in results, traces and status messages.
+        Raises on failure; cancelling the awaiting task aborts the in-flight LLM request.
+        """
+        async with self._limit:
+            outcomes = await run_unit(
+                self._instruction_config(instruction), [name], self.provider, config or self.config,
+                status_callback, checkpoints=self.checkpoints, tracer=self.tracer, texts={name: text}
+            )
+        outcome = outcomes[0][1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def plan(
+        self,
+        text: str,
+        instruction: Optional[str] = None,
+        config: Optional[GenerationConfig] = None,
+        name: str = "document.md"
+    ) -> FilePlan:
+        """
+        Dry run of generate: windows, calls, tokens and predicted time, without generating.
+        """
+        with use_tracer(self.tracer):
+            pipeline = DirectPipeline(self.provider, self.checkpoints)
+            return await pipeline.plan(name, text, self._instruction_config(instruction), config or self.config)
+
+    async def amap(
+        self,
+        documents: Documents,
+        instruction: Optional[str] = None,
+        config: Optional[GenerationConfig] = None
+    ) -> AsyncIterator[Outcome]:
+        """
+        Generates every document and yields (name, DocResult or exception) in completion order.
+        Documents are started as they arrive (an async iterable may still be producing them), up to
+        the client's limit on documents in flight; with config.pack, small ones share calls.
+        Bare texts are named doc-1, doc-2, ... in input order. Closing the iterator early cancels
+        the documents still running. A text is released once its document has finished.
+        """
+        if isinstance(documents, (str, bytes)):
+            # Would otherwise be iterated character by character
+            raise TypeError("amap takes a collection of documents; wrap a single text in a list or call generate()")
+        config = config or self.config
+        instruction_config = self._instruction_config(instruction)
+        # Texts of the documents not yet finished; names of every document, to catch duplicates
+        texts: Dict[str, str] = {}
+        seen: Set[str] = set()
+        results: asyncio.Queue = asyncio.Queue()
+        tasks: Set[asyncio.Task] = set()
+
+        async def names() -> AsyncIterator[str]:
+            async for name, text in _iter_documents(documents):
+                if name in seen:
+                    raise ValueError(f"Duplicate document name: {name}")
+                seen.add(name)
+                texts[name] = text
+                yield name
+
+        async def run(unit: List[str]):
+            try:
+                async with self._limit:
+                    outcomes = await run_unit(
+                        instruction_config, unit, self.provider, config,
+                        checkpoints=self.checkpoints, tracer=self.tracer, texts=texts
+                    )
+            except Exception as e:
+                outcomes = [(name, e) for name in unit]
+            for name in unit:
+                texts.pop(name, None)
+            for outcome in outcomes:
+                await results.put(outcome)
+
+        async def schedule():
+            try:
+                async for unit in iter_units(names(), instruction_config, self.provider, config, self.checkpoints, texts):
+                    # Units wait for a free slot in run(), so every document is scheduled right away
+                    task = asyncio.create_task(run(unit))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(None)
+
+        scheduler = asyncio.create_task(schedule())
+        try:
+            while True:
+                outcome = await results.get()
+                if outcome is None:
+                    break
+                yield outcome
+            # Surfaces errors of the input iterable itself (duplicate names, a failing producer)
+            await scheduler
+        finally:
+            running = [scheduler, *tasks]
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _iter_documents(documents: Documents) -> AsyncIterator[Tuple[str, str]]:
+    if isinstance(documents, Mapping):
+        for name, text in documents.items():
+            yield name, text
+        return
+    i = 0
+    if isinstance(documents, AsyncIterable):
+        async for document in documents:
+            i += 1
+            yield _named(document, i)
+    else:
+        for document in documents:
+            i += 1
+            yield _named(document, i)
+
+
+def _named(document: Union[str, Tuple[str, str]], index: int) -> Tuple[str, str]:
+    if isinstance(document, str):
+        return f"doc-{index}", document
+    return document
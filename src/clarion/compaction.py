@@ -0,0 +1,249 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from clarion.budget import estimate_tokens
+from clarion.schemas import CompactionReport, GenerationConfig
+
+# Paragraphs and lines shorter than this are never treated as duplicates ("---", "Yes.", "TODO")
+MIN_DUPLICATE_CHARS = 40
+# A paragraph or line repeated in this many sections is boilerplate (page headers, footers, licenses)
+BOILERPLATE_MIN_SECTIONS = 3
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_INDENTED_CODE = re.compile(r"^(?: {4}| {0,3}\t)")
+_FRONT_MATTER = re.compile(r"\A(?:---|\+\+\+)[ \t]*\n.*?\n(?:---|\+\+\+|\.\.\.)[ \t]*(?:\n|\Z)", re.DOTALL)
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_DATA_IMAGE_MD = re.compile(r"!\[([^\]]*)\]\(\s*data:[^)]*\)")
+_DATA_IMAGE_HTML = re.compile(r"<img\b[^>]*\bsrc\s*=\s*[\"']data:[^\"']*[\"'][^>]*>", re.IGNORECASE)
+_HTML_ALT = re.compile(r"\balt\s*=\s*[\"']([^\"']*)[\"']", re.IGNORECASE)
+_INNER_SPACES = re.compile(r"(?<=\S)[ \t]{2,}(?=\S)")
+_TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+
+
+def compact_text(text: str, config: GenerationConfig) -> Tuple[str, CompactionReport]:
+    """
+    Deterministically removes content that costs prompt tokens without carrying meaning:
+    front matter, HTML comments, inline base64 images, repeated paragraphs and lines, and
+    redundant whitespace. Optionally shortens fenced code blocks (compact_code_lines) and
+    tables (compact_table_rows). Code blocks, fenced or indented, are otherwise left exactly
+    as they are.
+    """
+    removed: Dict[str, int] = {}
+
+    def count(rule: str, n: int = 1):
+        if n:
+            removed[rule] = removed.get(rule, 0) + n
+
+    body = text.replace("\r\n", "\n")
+    body, n = _FRONT_MATTER.subn("", body, count=1)
+    count("front_matter", n)
+
+    blocks: List[Tuple[bool, str]] = []
+    for is_code, block in _split_code(body):
+        if not is_code:
+            block, n = _HTML_COMMENT.subn("", block)
+            count("html_comments", n)
+            block, n = _DATA_IMAGE_MD.subn(lambda m: f"[image: {m.group(1).strip() or 'embedded'}]", block)
+            count("embedded_images", n)
+            block, n = _DATA_IMAGE_HTML.subn(_html_image_placeholder, block)
+            count("embedded_images", n)
+        blocks.append((is_code, block))
+
+    repeats = _Repeats([block for is_code, block in blocks if not is_code])
+    out: List[str] = []
+    for is_code, block in blocks:
+        if is_code:
+            # Only fenced blocks are shortened: an indented block has no fence lines to keep
+            out.append(_truncate_code(block, config.compact_code_lines, count) if _FENCE.match(block) else block)
+        else:
+            out.append(_compact_prose(block, repeats, config.compact_table_rows, count))
+
+    # Prose runs come back without surrounding blank lines; code blocks keep theirs
+    compacted = "\n\n".join(part for part in out if part.strip()).strip("\n") + "\n"
+    original_tokens = estimate_tokens(text)
+    compacted_tokens = estimate_tokens(compacted)
+    return compacted, CompactionReport(
+        original_tokens=original_tokens,
+        compacted_tokens=compacted_tokens,
+        saved_tokens=max(0, original_tokens - compacted_tokens),
+        removed=removed
+    )
+
+
+def _split_code(text: str) -> List[Tuple[bool, str]]:
+    """
+    Splits text into (is_code, block) runs. A fenced block includes its fence lines; an unclosed
+    fence runs to the end of the text, as in CommonMark. An indented block (4 spaces or a tab,
+    after a blank line) runs up to the next non-blank line with less indentation.
+    """
+    blocks: List[Tuple[bool, str]] = []
+    current: List[str] = []
+    fence: Optional[str] = None
+    indented = False
+
+    def end_indented():
+        # Blank lines after the block belong to the prose that follows
+        trailing = []
+        while current and not current[-1].strip():
+            trailing.insert(0, current.pop())
+        blocks.append((True, "\n".join(current)))
+        return trailing
+
+    for line in text.split("\n"):
+        if indented:
+            if not line.strip() or _INDENTED_CODE.match(line):
+                current.append(line)
+                continue
+            current = end_indented()
+            indented = False
+        match = _FENCE.match(line)
+        if fence is None and match:
+            if current:
+                blocks.append((False, "\n".join(current)))
+            current = [line]
+            fence = match.group(1)
+        elif fence is not None and match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) \
+                and not line.strip()[len(match.group(1)):].strip():
+            current.append(line)
+            blocks.append((True, "\n".join(current)))
+            current = []
+            fence = None
+        elif fence is None and line.strip() and _INDENTED_CODE.match(line) and (not current or not current[-1].strip()):
+            # Indented lines continue a paragraph; after a blank line they start a code block
+            if current:
+                blocks.append((False, "\n".join(current)))
+            current = [line]
+            indented = True
+        else:
+            current.append(line)
+    if indented:
+        end_indented()
+    elif current:
+        blocks.append((fence is not None, "\n".join(current)))
+    return blocks
+
+
+def _html_image_placeholder(match: re.Match) -> str:
+    alt = _HTML_ALT.search(match.group(0))
+    return f"[image: {alt.group(1).strip() if alt and alt.group(1).strip() else 'embedded'}]"
+
+
+def _truncate_code(block: str, keep: Optional[int], count) -> str:
+    lines = block.split("\n")
+    # Fence lines stay; an unclosed block has no closing fence
+    closed = len(lines) > 1 and _FENCE.match(lines[-1]) is not None
+    opening, body = lines[0], lines[1:-1] if closed else lines[1:]
+    if not keep or len(body) <= keep + 1:
+        return block
+    head = (keep + 1) // 2
+    tail = keep - head
+    omitted = len(body) - head - tail
+    count("code_lines", omitted)
+    kept = body[:head] + [f"... ({omitted} lines omitted) ..."] + (body[-tail:] if tail else [])
+    return "\n".join([opening] + kept + ([lines[-1]] if closed else []))
+
+
+def _paragraphs(block: str) -> List[List[str]]:
+    paragraphs = []
+    for paragraph in re.split(r"\n[ \t]*\n", block):
+        # Keep indentation (nested lists); collapse runs of spaces inside the line
+        lines = [_INNER_SPACES.sub(" ", line.rstrip()) for line in paragraph.split("\n")]
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            paragraphs.append(lines)
+    return paragraphs
+
+
+def _paragraph_key(lines: List[str]) -> Optional[str]:
+    key = " ".join(" ".join(lines).split())
+    return key if len(key) >= MIN_DUPLICATE_CHARS and not lines[0].lstrip().startswith("#") else None
+
+
+def _line_key(line: str) -> Optional[str]:
+    stripped = line.strip()
+    # Headings and table rows repeat legitimately; short lines are too ambiguous to drop
+    if len(stripped) < MIN_DUPLICATE_CHARS or stripped.startswith("#") or _TABLE_ROW.match(line):
+        return None
+    return stripped
+
+
+class _Repeats:
+    """
+    Decides which repeated paragraphs and lines are dropped: a repeat that immediately follows
+    the same paragraph or line, and boilerplate, found in at least BOILERPLATE_MIN_SECTIONS
+    sections (runs between headings, or paragraphs in a text without headings), of which the
+    first copy stays. Anything else repeated, like a bullet that applies to two sections,
+    carries meaning where it stands and is kept.
+    """
+    def __init__(self, prose_blocks: List[str]):
+        paragraphs = [p for block in prose_blocks for p in _paragraphs(block)]
+        by_heading = any(line.lstrip().startswith("#") for lines in paragraphs for line in lines)
+        self.sections: Dict[str, Dict[str, set]] = {"paragraph": {}, "line": {}}
+        self.seen: Dict[str, set] = {"paragraph": set(), "line": set()}
+        self.last: Dict[str, Optional[str]] = {"paragraph": None, "line": None}
+        section = 0
+        for index, lines in enumerate(paragraphs):
+            if not by_heading:
+                section = index
+            for line in lines:
+                if by_heading and line.lstrip().startswith("#"):
+                    section += 1
+                key = _line_key(line)
+                if key:
+                    self.sections["line"].setdefault(key, set()).add(section)
+            key = _paragraph_key(lines)
+            if key:
+                self.sections["paragraph"].setdefault(key, set()).add(section)
+
+    def drop(self, kind: str, key: Optional[str]) -> bool:
+        last, self.last[kind] = self.last[kind], key
+        if key is None:
+            return False
+        if key == last:
+            return True
+        if key in self.seen[kind]:
+            return len(self.sections[kind].get(key, ())) >= BOILERPLATE_MIN_SECTIONS
+        self.seen[kind].add(key)
+        return False
+
+
+def _compact_prose(block: str, repeats: _Repeats, table_rows: Optional[int], count) -> str:
+    paragraphs = []
+    for lines in _paragraphs(block):
+        if repeats.drop("paragraph", _paragraph_key(lines)):
+            count("duplicate_paragraphs")
+            continue
+        if table_rows is not None and _is_table(lines):
+            lines = _truncate_table(lines, table_rows, count)
+        else:
+            lines = _drop_repeated_lines(lines, repeats, count)
+        if lines:
+            paragraphs.append("\n".join(lines))
+    return "\n\n".join(paragraphs)
+
+
+def _drop_repeated_lines(lines: List[str], repeats: _Repeats, count) -> List[str]:
+    # Lines repeat "consecutively" only within a paragraph
+    repeats.last["line"] = None
+    kept = []
+    for line in lines:
+        if repeats.drop("line", _line_key(line)):
+            count("duplicate_lines")
+            continue
+        kept.append(line)
+    return kept
+
+
+def _is_table(lines: List[str]) -> bool:
+    return len(lines) >= 2 and _TABLE_ROW.match(lines[0]) is not None and _TABLE_RULE.match(lines[1]) is not None
+
+
+def _truncate_table(lines: List[str], keep: int, count) -> List[str]:
+    # Header and delimiter row, then the first `keep` body rows
+    rows = [line for line in lines[2:] if _TABLE_ROW.match(line)]
+    if len(rows) <= keep:
+        return lines
+    omitted = len(rows) - keep
+    count("table_rows", omitted)
+    return lines[:2] + rows[:keep] + [f"({omitted} more rows omitted)"]
@@ -0,0 +1,219 @@
+import asyncio
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+from clarion.schemas import EarlyStop
+from clarion.shared_state import active_state
+
+# Repetition: share of repeated word 4-grams among the last REPEAT_WINDOW words (checked from
+# REPEAT_MIN_WORDS on, for calls with small budgets). A loop with a period of P words in a window
+# of W scores about 1 - P/W, so paragraphs up to 200 words are caught; ordinary prose stays well below 0.1.
+REPEAT_NGRAM = 4
+REPEAT_WINDOW = 400
+REPEAT_MIN_WORDS = 100
+REPEAT_RATIO = 0.5
+# Repetition is checked every CHECK_EVERY streamed tokens
+CHECK_EVERY = 32
+# Stall: this many tokens in a row that only add whitespace (JSON mode can pad until num_predict)
+STALL_TOKENS = 200
+# Oversize: output this many times the size of the prompt, and at least OVERSIZE_MIN_CHARS
+OVERSIZE_RATIO = 3.0
+OVERSIZE_MIN_CHARS = 12000
+# Retry options: loops longer than repeat_last_n (Ollama default 64 tokens) are invisible to the penalty
+RETRY_REPEAT_LAST_N = 512
+RETRY_PENALTY_STEP = 0.15
+
+# JSON escapes are blanked to the same length, so word offsets stay offsets into the raw output
+_ESCAPE = re.compile(r'\\[nrt"\\/]')
+_WORD = re.compile(r"\w+")
+
+_collected: ContextVar[Optional[List[EarlyStop]]] = ContextVar("clarion_early_stops", default=None)
+
+
+class DegenerateOutput(Exception):
+    """
+    Raised from a streamed call the detector stopped; carries the output before the loop.
+    """
+    def __init__(self, reason: str, prefix: str, tokens: int, saved_tokens: int, saved_seconds: float):
+        super().__init__(f"Degenerate output ({reason}) after {tokens} tokens")
+        self.reason = reason
+        self.prefix = prefix
+        self.tokens = tokens
+        self.saved_tokens = saved_tokens
+        self.saved_seconds = saved_seconds
+
+
+class DegeneracyDetector:
+    """
+    Watches a streamed response token by token for repetition loops, whitespace stalls and
+    output far larger than the prompt.
+    """
+    def __init__(self, prompt_chars: int, num_predict: Optional[int] = None):
+        self.max_chars = max(OVERSIZE_MIN_CHARS, int(prompt_chars * OVERSIZE_RATIO))
+        self.num_predict = num_predict if num_predict and num_predict > 0 else None
+        self.parts: List[str] = []
+        self.chars = 0
+        self.tokens = 0
+        self.blank_run = 0
+        self.first_token_at: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, piece: str) -> Optional[str]:
+        """
+        Adds one streamed token; returns the reason to stop, or None.
+        """
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.parts.append(piece)
+        self.chars += len(piece)
+        self.tokens += 1
+        self.blank_run = self.blank_run + 1 if not piece.strip() else 0
+        if self.blank_run >= STALL_TOKENS:
+            return "stall"
+        if self.chars > self.max_chars:
+            return "oversize"
+        if self.tokens % CHECK_EVERY == 0 and self._repetition_ratio() >= REPEAT_RATIO:
+            return "repetition"
+        return None
+
+    def _repetition_ratio(self) -> float:
+        # Enough raw text for REPEAT_WINDOW words of any realistic length
+        tail = _ESCAPE.sub("  ", self.text[-REPEAT_WINDOW * 16:])
+        words = _WORD.findall(tail.casefold())[-REPEAT_WINDOW:]
+        if len(words) < REPEAT_MIN_WORDS:
+            return 0.0
+        grams = [tuple(words[i:i + REPEAT_NGRAM]) for i in range(len(words) - REPEAT_NGRAM + 1)]
+        return 1 - len(set(grams)) / len(grams)
+
+    def _loop_start(self, text: str) -> int:
+        """
+        Offset where the repetition began: the first word, going back from the checked window,
+        of the run of word n-grams that all occurred earlier. One copy of the repeated text is kept.
+        """
+        matches = list(_WORD.finditer(_ESCAPE.sub("  ", text).casefold()))
+        words = [m.group() for m in matches]
+        first_seen = {}
+        repeated = []
+        for i in range(len(words) - REPEAT_NGRAM + 1):
+            gram = tuple(words[i:i + REPEAT_NGRAM])
+            repeated.append(gram in first_seen)
+            first_seen.setdefault(gram, i)
+        start = next((i for i in range(max(0, len(repeated) - REPEAT_WINDOW), len(repeated)) if repeated[i]), None)
+        if start is None:
+            return len(text)
+        while start > 0 and repeated[start - 1]:
+            start -= 1
+        return matches[start].start()
+
+    def stop(self, reason: str) -> DegenerateOutput:
+        text = self.text
+        cut = self._loop_start(text) if reason == "repetition" else len(text)
+        saved_tokens = max(0, self.num_predict - self.tokens) if self.num_predict else 0
+        elapsed = time.perf_counter() - (self.first_token_at or time.perf_counter())
+        rate = (self.tokens - 1) / elapsed if elapsed > 0 and self.tokens > 1 else 0.0
+        saved_seconds = saved_tokens / rate if rate else 0.0
+        return DegenerateOutput(reason, close_json(text[:cut]), self.tokens, saved_tokens, saved_seconds)
+
+
+def close_json(prefix: str) -> str:
+    """
+    Closes a JSON document cut off part-way: ends an open string, completes a dangling key and
+    closes open objects and arrays, so the part before the cut can still be parsed.
+    """
+    stack: List[str] = []
+    expect_key: List[bool] = []  # Per open container: an object waiting for its next key
+    in_string = escaped = string_is_key = False
+    after_key = False  # A key string closed, its colon not yet seen
+    for ch in prefix:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                after_key = string_is_key
+            continue
+        if not ch.isspace():
+            after_key = False
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and expect_key[-1]
+            if string_is_key:
+                expect_key[-1] = False
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key.append(ch == "{")
+        elif ch in "}]" and stack:
+            stack.pop()
+            expect_key.pop()
+        elif ch == "," and stack:
+            expect_key[-1] = stack[-1] == "{"
+
+    closed = prefix
+    if in_string:
+        if escaped:
+            closed = closed[:-1]
+        closed += '"'
+        if string_is_key:
+            closed += ": null"
+    else:
+        closed = closed.rstrip()
+        if closed.endswith(","):
+            closed = closed[:-1]
+        elif closed.endswith(":"):
+            closed += " null"
+        elif after_key:
+            closed += ": null"
+    return closed + "".join("}" if frame == "{" else "]" for frame in reversed(stack))
+
+
+def penalized(options: dict) -> dict:
+    """
+    Options for retrying a call that looped: a stronger repetition penalty over a longer window.
+    """
+    return dict(
+        options,
+        repeat_penalty=max(options.get("repeat_penalty") or 1.0, 1.1) + RETRY_PENALTY_STEP,
+        repeat_last_n=max(options.get("repeat_last_n") or 64, RETRY_REPEAT_LAST_N)
+    )
+
+
+@contextmanager
+def collect_early_stops(into: List[EarlyStop]) -> Iterator[List[EarlyStop]]:
+    """
+    Collects the early stops of the calls made inside the block (in this task) into a list.
+    """
+    token = _collected.set(into)
+    try:
+        yield into
+    finally:
+        _collected.reset(token)
+
+
+async def report(stop: DegenerateOutput, action: str) -> EarlyStop:
+    """
+    Records an early stop with the collecting call and in the counters shared by server workers.
+    """
+    early_stop = EarlyStop(
+        reason=stop.reason, action=action, tokens=stop.tokens,
+        saved_tokens=stop.saved_tokens, saved_seconds=round(stop.saved_seconds, 2)
+    )
+    collected = _collected.get()
+    if collected is not None:
+        collected.append(early_stop)
+    state = active_state()
+    if state:
+        def count():
+            state.incr("early_stops")
+            state.incr(f"early_stops_{stop.reason}")
+            state.incr("early_stop_saved_tokens", stop.saved_tokens)
+            state.incr("early_stop_saved_seconds", stop.saved_seconds)
+        await asyncio.to_thread(count)
+    return early_stop
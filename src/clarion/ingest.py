@@ -0,0 +1,238 @@
+import asyncio
+import fnmatch
+import io
+import queue
+import re
+import tarfile
+import threading
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+DEFAULT_INCLUDE = ["*.md"]
+DEFAULT_MAX_ENTRY_BYTES = 10 * 1024 * 1024
+# Bytes buffered between the upload and the extraction thread (backpressure on the upload)
+_STREAM_BUFFER_CHUNKS = 16
+
+TAR_CONTENT_TYPES = (
+    "application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar",
+    "application/x-bzip2", "application/x-xz", "application/octet-stream"
+)
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+def is_zip_name(name: str) -> bool:
+    return name.lower().endswith(".zip")
+
+
+def entry_allowed(name: str, include: List[str]) -> bool:
+    """
+    Glob filter on the entry's path or base name (so '*.md' matches 'docs/a.md').
+    """
+    base = PurePosixPath(name).name
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(base, p) for p in include)
+
+
+def safe_name(name: str, seen: set) -> str:
+    """
+    Flattens an archive path into a unique file name without directory components,
+    so entries can never be written outside the extraction directory.
+    """
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("", ".", "..", "/")]
+    flat = re.sub(r"[^A-Za-z0-9._-]", "_", "__".join(parts)) or "entry"
+    candidate = flat
+    n = 1
+    while candidate in seen:
+        stem, dot, suffix = flat.rpartition(".")
+        candidate = f"{stem}_{n}.{suffix}" if dot else f"{flat}_{n}"
+        n += 1
+    seen.add(candidate)
+    return candidate
+
+
+class IngestReport:
+    """
+    Entries accepted and skipped while ingesting one archive or directory.
+    """
+    def __init__(self):
+        self.accepted: List[str] = []
+        self.skipped: List[Tuple[str, str]] = []  # (entry name, reason)
+
+    def skip(self, name: str, reason: str):
+        self.skipped.append((name, reason))
+
+
+def _write_member(src, dest: Path, name: str, size: int, max_entry_bytes: int, report: IngestReport, seen: set) -> Optional[Path]:
+    if size > max_entry_bytes:
+        report.skip(name, f"larger than {max_entry_bytes} bytes")
+        return None
+    out_path = dest / safe_name(name, seen)
+    with open(out_path, "wb") as f:
+        while True:
+            chunk = src.read(64 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+    report.accepted.append(name)
+    return out_path
+
+
+def iter_tar(fileobj, dest: Path, include: List[str], max_entry_bytes: int, report: IngestReport) -> Iterator[Path]:
+    """
+    Extracts matching regular files from a (possibly compressed) tar stream, yielding each as soon
+    as it is written. Reads strictly sequentially, so the source does not need to be seekable.
+    """
+    seen: set = set()
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if not entry_allowed(member.name, include):
+                report.skip(member.name, "filtered")
+                continue
+            src = tar.extractfile(member)
+            if src is None:
+                continue
+            path = _write_member(src, dest, member.name, member.size, max_entry_bytes, report, seen)
+            if path:
+                yield path
+
+
+def iter_zip(path: Path, dest: Path, include: List[str], max_entry_bytes: int, report: IngestReport) -> Iterator[Path]:
+    """
+    Extracts matching files from a zip archive. Zip keeps its index at the end, so the archive
+    must be complete (on disk) before extraction starts.
+    """
+    seen: set = set()
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if not entry_allowed(info.filename, include):
+                report.skip(info.filename, "filtered")
+                continue
+            with zf.open(info) as src:
+                out_path = _write_member(src, dest, info.filename, info.file_size, max_entry_bytes, report, seen)
+            if out_path:
+                yield out_path
+
+
+def iter_archive(path: Path, dest: Path, include: List[str], max_entry_bytes: int, report: IngestReport) -> Iterator[Path]:
+    if is_zip_name(path.name) or zipfile.is_zipfile(path):
+        yield from iter_zip(path, dest, include, max_entry_bytes, report)
+    else:
+        with open(path, "rb") as f:
+            yield from iter_tar(f, dest, include, max_entry_bytes, report)
+
+
+def iter_directory(root: Path, include: List[str], max_entry_bytes: int, report: IngestReport) -> Iterator[Path]:
+    """
+    Matching files under a directory, used in place (no copy).
+    """
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        rel = path.relative_to(root).as_posix()
+        if not entry_allowed(rel, include):
+            report.skip(rel, "filtered")
+            continue
+        if path.stat().st_size > max_entry_bytes:
+            report.skip(rel, f"larger than {max_entry_bytes} bytes")
+            continue
+        report.accepted.append(rel)
+        yield path
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Blocking file object fed with chunks from another thread; b"" marks the end of the stream.
+    """
+    def __init__(self):
+        self.chunks: queue.Queue = queue.Queue(maxsize=_STREAM_BUFFER_CHUNKS)
+        self.buffer = b""
+        self.eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer and not self.eof:
+            chunk = self.chunks.get()
+            if chunk == b"":
+                self.eof = True
+            self.buffer = chunk
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+async def stream_tar(
+    chunks: AsyncIterator[bytes],
+    dest: Path,
+    include: List[str],
+    max_entry_bytes: int,
+    report: IngestReport
+) -> AsyncIterator[Path]:
+    """
+    Extracts a tar stream while it is still arriving (e.g. a request body) and yields each
+    matching entry once written, so processing overlaps with upload and extraction.
+    """
+    loop = asyncio.get_running_loop()
+    reader = _ChunkReader()
+    extracted: asyncio.Queue = asyncio.Queue()
+    # Set once either side stops, so the other never blocks on the buffer forever
+    finished = threading.Event()
+    done = object()
+
+    def extract():
+        try:
+            # Unbuffered: a buffered reader would wait for full 10 KiB blocks before tarfile sees them
+            for path in iter_tar(reader, dest, include, max_entry_bytes, report):
+                loop.call_soon_threadsafe(extracted.put_nowait, path)
+            loop.call_soon_threadsafe(extracted.put_nowait, done)
+        except Exception as e:
+            loop.call_soon_threadsafe(extracted.put_nowait, e)
+        finally:
+            finished.set()
+
+    def put(chunk: bytes):
+        # Blocks (off the event loop) while the extractor is behind
+        while not finished.is_set():
+            try:
+                reader.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                if finished.is_set():
+                    # Extraction ended (e.g. tar padding after the last entry)
+                    break
+                if chunk:
+                    await loop.run_in_executor(None, put, chunk)
+        finally:
+            await loop.run_in_executor(None, put, b"")
+
+    thread = threading.Thread(target=extract, daemon=True)
+    thread.start()
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            item = await extracted.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        finished.set()
+        if not feeder.done():
+            feeder.cancel()
+        # Unblock an extractor still waiting for data
+        try:
+            reader.chunks.put_nowait(b"")
+        except queue.Full:
+            pass
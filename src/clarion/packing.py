@@ -0,0 +1,512 @@
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from clarion.schemas import InstructionConfig, FlexDoc, DocResult, GenerationConfig, PackedDocs, CompactionReport, FilePlan, PlannedCall
+from clarion.pipeline import DirectPipeline, RunContext, WindowJob, DEFAULT_INSTRUCTION, run_pipeline
+from clarion.providers import LLMProvider, OllamaProvider
+from clarion.prompt_loader import render_prompt
+from clarion.renderer import find_markdown_issues
+from clarion.compaction import compact_text
+from clarion.admission import admitted
+from clarion.checkpoint import CheckpointStore, hash_text, config_hash
+from clarion.tracing import Tracer, span, use_tracer
+from clarion.throughput import ThroughputStore, shared_throughput_store
+from clarion.budget import (
+    estimate_tokens, output_ratio, wrapper_tokens, max_input_tokens, size_num_predict,
+    count_words, expected_output_tokens, REVIEW_OUTPUT_RATIO, CTX_MARGIN
+)
+
+# Documents larger than this share of a pack's input room are processed on their own
+PACK_MAX_SHARE = 0.5
+# Partially filled packs kept open while inputs arrive; new documents go to the first one they fit (first-fit)
+OPEN_PACKS = 4
+# Per-document tokens for its header in the prompt and its entry framing in the response
+DOC_FRAMING_TOKENS = 16
+
+UnitResult = List[Tuple[str, Union[DocResult, Exception]]]
+
+
+def _read(path: str, texts: Optional[Dict[str, str]]) -> str:
+    # In-memory documents (texts) are keyed by the name that stands in for their path
+    if texts is not None:
+        return texts[path]
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class PackItem:
+    """
+    One small input of a pack. `id` identifies it in the packed prompt and response;
+    `text` is already compacted when compaction is enabled.
+    """
+    def __init__(self, path: str, text: str, id: str, compaction: Optional[CompactionReport] = None):
+        self.path = path
+        self.text = text
+        self.id = id
+        self.compaction = compaction
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+class PackingPipeline(DirectPipeline):
+    """
+    Drafts and reviews several small one-shot documents per LLM call, then splits the packed
+    response back into one result (and checkpoint) per document. Documents the packed response
+    misses or returns empty are processed on their own, so a bad packed answer costs extra calls,
+    not output.
+    """
+
+    async def capacity(self, instruction: str, generation_config: GenerationConfig) -> int:
+        """
+        Input tokens available for documents in one packed draft call.
+        """
+        ctx_limits, _ = await self._context_limits(generation_config)
+        overhead = (
+            estimate_tokens(self._render_packed_generation(instruction, [], generation_config.word_budget))
+            + wrapper_tokens(PackedDocs)
+        )
+        return max_input_tokens(ctx_limits["draft"], overhead, output_ratio(instruction), generation_config)
+
+    async def group(
+        self,
+        inputs: AsyncIterator[str],
+        instruction_config: InstructionConfig,
+        generation_config: GenerationConfig,
+        texts: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[List[str]]:
+        """
+        Groups input paths into packs as they arrive. A pack is yielded once it holds pack_max_docs
+        documents or has to make room for a new one; the rest are yielded at the end. Documents too
+        large to share a call, or already checkpointed, are yielded on their own straight away.
+        With texts, inputs are names of in-memory documents instead of paths.
+        """
+        instruction = instruction_config.inline_instruction or DEFAULT_INSTRUCTION
+        capacity = await self.capacity(instruction, generation_config)
+        cfg_hash = config_hash(instruction, self.provider.model_name, generation_config)
+        max_docs = max(1, generation_config.pack_max_docs)
+        open_packs: List[List[Tuple[str, int]]] = []  # (path, tokens) per document
+
+        async for path in inputs:
+            try:
+                text = _read(path, texts)
+            except Exception:
+                # Let the per-file run report the error
+                yield [path]
+                continue
+            if generation_config.compact:
+                text, _ = compact_text(text, generation_config)
+            tokens = estimate_tokens(text) + DOC_FRAMING_TOKENS
+            if tokens > capacity * PACK_MAX_SHARE or self._reusable(text, cfg_hash, generation_config):
+                yield [path]
+                continue
+
+            target = next((p for p in open_packs if sum(t for _, t in p) + tokens <= capacity), None)
+            if target is None:
+                if len(open_packs) >= OPEN_PACKS:
+                    fullest = max(open_packs, key=lambda p: sum(t for _, t in p))
+                    open_packs.remove(fullest)
+                    yield [p for p, _ in fullest]
+                target = []
+                open_packs.append(target)
+            target.append((path, tokens))
+            if len(target) >= max_docs:
+                open_packs.remove(target)
+                yield [p for p, _ in target]
+
+        for pack in open_packs:
+            yield [p for p, _ in pack]
+
+    def _reusable(self, text: str, cfg_hash: str, generation_config: GenerationConfig) -> bool:
+        # A resumable or near-duplicate document costs no calls on its own; packing it would redo it
+        if not self.checkpoints:
+            return False
+        job = WindowJob(0, text, "", generation_config.word_budget)
+        if self._similar_window(cfg_hash, generation_config, job) is not None:
+            return True
+        if not self.checkpoints.resume:
+            return False
+        return self.checkpoints.load(hash_text(text), cfg_hash, 0, text, key=job.key) is not None
+
+    async def run_pack(
+        self,
+        items: List[PackItem],
+        instruction_config: InstructionConfig,
+        generation_config: Optional[GenerationConfig] = None,
+        status_callback: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> UnitResult:
+        """
+        Runs one packed draft and one packed review call for all items.
+        Returns (path, DocResult or the exception that stopped it) per item, in input order.
+        """
+        generation_config = generation_config or GenerationConfig()
+        instruction = instruction_config.inline_instruction or DEFAULT_INSTRUCTION
+        ctx_limits, model_max = await self._context_limits(generation_config)
+        cfg_hash = config_hash(instruction, self.provider.model_name, generation_config)
+        # Calls shared by every document of the pack
+        ctx = RunContext(instruction, generation_config, status_callback, ctx_limits, [], cfg_hash=cfg_hash)
+
+        await self._notify(f"Strategy: Packed Processing ({len(items)} documents, ~{sum(i.tokens for i in items)} tokens).", status_callback)
+        async with admitted("window"):
+            drafts = await self._draft_pack(ctx, items)
+        reviews = await self._review_pack(ctx, [i for i in items if i.id in drafts], drafts)
+
+        outcomes: Dict[str, Union[DocResult, Exception]] = {}
+        fallback = [i for i in items if i.id not in drafts]
+        for item in items:
+            if item.id not in drafts:
+                continue
+            item_ctx = RunContext(
+                instruction, generation_config, status_callback, ctx_limits, [],
+                input_hash=hash_text(item.text), cfg_hash=cfg_hash
+            )
+            job = WindowJob(0, item.text, "", generation_config.word_budget)
+            try:
+                final_doc = reviews.get(item.id)
+                if final_doc is None:
+                    # Missing or invalid in the packed review: review this draft on its own
+                    final_doc = await self._review_block(item_ctx, job, drafts[item.id])
+            except Exception as e:
+                outcomes[item.id] = e
+                continue
+            calls = ctx.calls + item_ctx.calls
+            if self.checkpoints:
+                # Stored like a one-shot window, so unpacked runs resume from it too
+                with span("checkpoint.save", input=item.path):
+                    self.checkpoints.save(item_ctx.input_hash, cfg_hash, 0, item.text, final_doc, calls, key=job.key)
+                self._index_window(cfg_hash, generation_config, job, item.path)
+            outcomes[item.id] = DocResult(
+                input_file=item.path,
+                final_doc=final_doc,
+                manifest_path="",
+                model_max_ctx=model_max,
+                word_budget=generation_config.word_budget,
+                word_count=count_words(final_doc.content),
+                calls=calls,
+                packed_with=[i.path for i in items if i is not item],
+                compaction=item.compaction
+            )
+
+        if fallback:
+            await self._notify(f"Processing {len(fallback)} document(s) individually after packed validation failed.", status_callback)
+        for item in fallback:
+            try:
+                doc_result = await self.run(item.path, item.text, instruction_config, generation_config, status_callback)
+            except Exception as e:
+                outcomes[item.id] = e
+                continue
+            # The text was compacted before packing; compacting it again finds nothing
+            if item.compaction:
+                doc_result.compaction = item.compaction
+            outcomes[item.id] = doc_result
+
+        if not fallback:
+            # Per-file runs report their own completion
+            await self._notify("Complete.", status_callback)
+        return [(item.path, outcomes[item.id]) for item in items]
+
+    async def plan_pack(
+        self,
+        items: List[PackItem],
+        instruction_config: InstructionConfig,
+        generation_config: Optional[GenerationConfig] = None,
+        throughput: Optional[ThroughputStore] = None
+    ) -> List[FilePlan]:
+        """
+        Dry run of run_pack: sizes the packed draft and review calls. Returns one plan per item;
+        the shared calls are listed on the first item's plan, so batch totals count them once.
+        Assumes the packed response is accepted (no per-document fallback).
+        """
+        generation_config = generation_config or GenerationConfig()
+        throughput = throughput or shared_throughput_store()
+        instruction = instruction_config.inline_instruction or DEFAULT_INSTRUCTION
+        ctx_limits, model_max = await self._context_limits(generation_config)
+        records = []
+        planned: List[PlannedCall] = []
+        budget = self._pack_budget(generation_config.word_budget, len(items))
+
+        input_tokens = sum(i.tokens for i in items)
+        ratio = output_ratio(instruction)
+        draft_config, draft_record = self._size_call(
+            "draft", self._render_packed_generation(instruction, items, generation_config.word_budget),
+            input_tokens, ratio, generation_config, ctx_limits["draft"], records, 0, budget, schema=PackedDocs
+        )
+        draft_tokens = expected_output_tokens(input_tokens, ratio, draft_config.num_predict)
+        planned.append(self._planned_call(throughput, draft_config, draft_record, draft_tokens))
+
+        if not generation_config.fast_mode:
+            # The drafts are not known yet: render the template without them and count their expected size
+            review_prompt = render_prompt(
+                "packed_review.j2", documents=[{"id": i.id, "text": ""} for i in items], word_budget=generation_config.word_budget
+            )
+            needed = (
+                estimate_tokens(review_prompt) + wrapper_tokens(PackedDocs) + draft_tokens
+                + size_num_predict(draft_tokens, REVIEW_OUTPUT_RATIO, generation_config) + CTX_MARGIN
+            )
+            if not generation_config.auto_ctx or needed <= ctx_limits["review"]:
+                review_config, review_record = self._size_call(
+                    "review", review_prompt, draft_tokens, REVIEW_OUTPUT_RATIO, generation_config,
+                    ctx_limits["review"], records, 0, budget, extra_tokens=draft_tokens, schema=PackedDocs
+                )
+                planned.append(self._planned_call(
+                    throughput, review_config, review_record,
+                    expected_output_tokens(draft_tokens, REVIEW_OUTPUT_RATIO, review_config.num_predict)
+                ))
+            else:
+                # Drafts that exceed the review context are reviewed one by one
+                for item in items:
+                    item_draft = expected_output_tokens(item.tokens, ratio, draft_config.num_predict)
+                    review_config, review_record = self._size_call(
+                        "review", render_prompt("review.j2", draft_content="", word_budget=generation_config.word_budget),
+                        item_draft, REVIEW_OUTPUT_RATIO, generation_config, ctx_limits["review"], records, 0,
+                        generation_config.word_budget, extra_tokens=item_draft
+                    )
+                    planned.append(self._planned_call(
+                        throughput, review_config, review_record,
+                        expected_output_tokens(item_draft, REVIEW_OUTPUT_RATIO, review_config.num_predict)
+                    ))
+
+        return [
+            FilePlan(
+                input_file=item.path,
+                chars=len(item.text),
+                input_tokens=item.tokens,
+                strategy="packed",
+                windows=1,
+                packed_with=[i.path for i in items if i is not item],
+                model_max_ctx=model_max,
+                compaction=item.compaction,
+                **self._call_totals(planned if n == 0 else [], generation_config)
+            )
+            for n, item in enumerate(items)
+        ]
+
+    def _render_packed_generation(self, instruction: str, items: List[PackItem], word_budget: Optional[int]) -> str:
+        return render_prompt(
+            "packed_generation.j2",
+            instruction=instruction,
+            system_guidelines=render_prompt("system_guidelines.j2"),
+            documents=[{"id": i.id, "text": i.text} for i in items],
+            word_budget=word_budget
+        )
+
+    def _pack_budget(self, word_budget: Optional[int], docs: int) -> Optional[int]:
+        # Output cap for a packed call: every document gets its own budget
+        return word_budget * docs if word_budget else None
+
+    def _entries(self, packed: PackedDocs, items: List[PackItem]) -> Tuple[Dict[str, FlexDoc], List[str]]:
+        """
+        Splits a packed response into per-document results. Entries with an unknown or repeated id,
+        or empty content, are dropped and reported as issues.
+        """
+        expected = {i.id for i in items}
+        docs: Dict[str, FlexDoc] = {}
+        issues: List[str] = []
+        mixed_up = False
+        for entry in packed.documents:
+            doc_id = entry.id.strip()
+            if doc_id not in expected or doc_id in docs:
+                issues.append(f"Unexpected or repeated document id '{entry.id}'")
+                mixed_up = True
+            elif not entry.content.strip():
+                issues.append(f"Document {doc_id} has no content")
+            else:
+                docs[doc_id] = FlexDoc(content=entry.content)
+        # Unknown or repeated ids mean the model may have mixed documents up: trust none of them
+        if mixed_up:
+            return {}, issues
+        issues.extend(f"Document {i.id} is missing" for i in items if i.id not in docs)
+        return docs, issues
+
+    async def _draft_pack(self, ctx: RunContext, items: List[PackItem]) -> Dict[str, FlexDoc]:
+        config = ctx.config
+        with span("draft", docs=len(items)):
+            with span("render_prompt", template="packed_generation.j2"):
+                prompt = self._render_packed_generation(ctx.instruction, items, config.word_budget)
+            draft_config, draft_record = self._size_call(
+                "draft", prompt, sum(i.tokens for i in items), output_ratio(ctx.instruction),
+                config, ctx.ctx_limits["draft"], ctx.calls, 0, self._pack_budget(config.word_budget, len(items)),
+                schema=PackedDocs
+            )
+            await self._notify(f"Drafting {len(items)} packed documents with {draft_record.model} (num_ctx={draft_config.num_ctx}, num_predict={draft_config.num_predict})...", ctx.status_callback)
+
+            def validate(packed: PackedDocs) -> List[str]:
+                docs, issues = self._entries(packed, items)
+                return issues + [issue for doc in docs.values() for issue in find_markdown_issues(doc.content)]
+
+            try:
+                packed = await self._generate(
+                    "draft", prompt, draft_config, draft_record, ctx.status_callback, validate, schema=PackedDocs
+                )
+            except Exception as e:
+                # Invalid JSON, or a failed call (timeout, HTTP error): every document runs on its own
+                await self._notify(f"Packed draft failed: {e}", ctx.status_callback)
+                return {}
+            drafts, issues = self._entries(packed, items)
+            if issues:
+                await self._notify(f"Packed draft issues: {'; '.join(issues[:3])}", ctx.status_callback)
+            draft_record.output_words = sum(count_words(d.content) for d in drafts.values())
+            return drafts
+
+    async def _review_pack(self, ctx: RunContext, items: List[PackItem], drafts: Dict[str, FlexDoc]) -> Dict[str, FlexDoc]:
+        """
+        Reviews the drafts in one call. Returns the accepted reviews; the caller reviews the rest one by one.
+        """
+        config = ctx.config
+        if config.fast_mode:
+            await self._notify("Fast Mode: Skipping refinement pass.", ctx.status_callback)
+            return {i.id: drafts[i.id] for i in items}
+        # Tiny drafts are not worth reviewing (same rule as a single block)
+        passthrough = {i.id: drafts[i.id] for i in items if len(drafts[i.id].content) <= 10}
+        items = [i for i in items if i.id not in passthrough]
+        if len(items) < 2:
+            return passthrough
+
+        documents = [{"id": i.id, "text": drafts[i.id].content} for i in items]
+        draft_tokens = sum(estimate_tokens(d["text"]) for d in documents)
+        with span("review", docs=len(items)):
+            with span("render_prompt", template="packed_review.j2"):
+                review_prompt = render_prompt("packed_review.j2", documents=documents, word_budget=config.word_budget)
+            if config.auto_ctx:
+                # The review model may have a smaller context than the draft model
+                needed = (
+                    estimate_tokens(review_prompt) + wrapper_tokens(PackedDocs)
+                    + size_num_predict(draft_tokens, REVIEW_OUTPUT_RATIO, config) + CTX_MARGIN
+                )
+                if needed > ctx.ctx_limits["review"]:
+                    await self._notify("Packed drafts exceed the review context; reviewing them individually.", ctx.status_callback)
+                    return passthrough
+
+            review_config, review_record = self._size_call(
+                "review", review_prompt, draft_tokens, REVIEW_OUTPUT_RATIO,
+                config, ctx.ctx_limits["review"], ctx.calls, 0, self._pack_budget(config.word_budget, len(items)),
+                schema=PackedDocs
+            )
+            await self._notify(f"Reviewing {len(items)} packed documents with {review_record.model}...", ctx.status_callback)
+
+            def accepted(packed: PackedDocs) -> Tuple[Dict[str, FlexDoc], List[str]]:
+                docs, issues = self._entries(packed, items)
+                for doc_id, doc in list(docs.items()):
+                    retention = self._retention_issues(count_words(drafts[doc_id].content), doc)
+                    if retention:
+                        issues.extend(f"Document {doc_id}: {issue}" for issue in retention)
+                        del docs[doc_id]
+                return docs, issues
+
+            def validate(packed: PackedDocs) -> List[str]:
+                docs, issues = accepted(packed)
+                return issues + [issue for doc in docs.values() for issue in find_markdown_issues(doc.content)]
+
+            try:
+                packed = await self._generate(
+                    "review", review_prompt, review_config, review_record, ctx.status_callback, validate, schema=PackedDocs
+                )
+            except Exception as e:
+                # The drafts are kept; documents without an accepted review are reviewed one by one
+                await self._notify(f"Packed review failed: {e}", ctx.status_callback)
+                return passthrough
+            reviews, issues = accepted(packed)
+            if issues:
+                await self._notify(f"Packed review issues: {'; '.join(issues[:3])}", ctx.status_callback)
+            review_record.output_words = sum(count_words(d.content) for d in reviews.values())
+            reviews.update(passthrough)
+            return reviews
+
+
+async def iter_units(
+    inputs: AsyncIterator[str],
+    config: InstructionConfig,
+    provider: Optional[LLMProvider] = None,
+    generation_config: Optional[GenerationConfig] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    texts: Optional[Dict[str, str]] = None
+) -> AsyncIterator[List[str]]:
+    """
+    Groups input paths into units of work for run_unit: packs of small documents when
+    generation_config.pack is set, otherwise one path per unit. With texts, inputs are names
+    of in-memory documents, which must be in texts by the time they are yielded.
+    """
+    generation_config = generation_config or GenerationConfig()
+    # Packed responses carry no artifacts: documents that need them run on their own
+    if not generation_config.pack or generation_config.artifacts:
+        async for path in inputs:
+            yield [path]
+        return
+    pipeline = PackingPipeline(provider or OllamaProvider(), checkpoints)
+    async for unit in pipeline.group(inputs, config, generation_config, texts):
+        yield unit
+
+
+async def run_unit(
+    config: InstructionConfig,
+    input_paths: List[str],
+    provider: Optional[LLMProvider] = None,
+    generation_config: Optional[GenerationConfig] = None,
+    status_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    tracer: Optional[Tracer] = None,
+    texts: Optional[Dict[str, str]] = None
+) -> UnitResult:
+    """
+    Runs one unit from iter_units: a single document through run_pipeline, or a pack through
+    PackingPipeline. Per-document failures are returned, not raised.
+    """
+    if len(input_paths) == 1:
+        try:
+            doc_result = await run_pipeline(
+                config, input_paths[0], provider, generation_config, status_callback, checkpoints, tracer,
+                text=texts[input_paths[0]] if texts is not None else None
+            )
+        except Exception as e:
+            return [(input_paths[0], e)]
+        return [(input_paths[0], doc_result)]
+
+    with use_tracer(tracer), span("run_pack", inputs=len(input_paths)):
+        generation_config = generation_config or GenerationConfig()
+        items = []
+        results: UnitResult = [(path, None) for path in input_paths]
+        for i, path in enumerate(input_paths):
+            try:
+                text = _read(path, texts)
+            except Exception as e:
+                results[i] = (path, e)
+                continue
+            compaction = None
+            if generation_config.compact:
+                with span("compact", input=path):
+                    text, compaction = compact_text(text, generation_config)
+            items.append(PackItem(path, text, str(i + 1), compaction))
+        pipeline = PackingPipeline(provider or OllamaProvider(), checkpoints)
+        try:
+            outcomes = await pipeline.run_pack(items, config, generation_config, status_callback) if items else []
+        except Exception as e:
+            # Shared setup failed (e.g. model limits unreachable): report it for every document
+            outcomes = [(item.path, e) for item in items]
+        for item, outcome in zip(items, outcomes):
+            results[int(item.id) - 1] = outcome
+        return results
+
+
+async def plan_unit(
+    config: InstructionConfig,
+    input_paths: List[str],
+    provider: Optional[LLMProvider] = None,
+    generation_config: Optional[GenerationConfig] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    texts: Optional[Dict[str, str]] = None
+) -> List[FilePlan]:
+    """
+    Dry-run counterpart of run_unit: one plan per document of the unit, in order.
+    """
+    provider = provider or OllamaProvider()
+    generation_config = generation_config or GenerationConfig()
+    if len(input_paths) == 1:
+        pipeline = DirectPipeline(provider, checkpoints)
+        return [await pipeline.plan(input_paths[0], _read(input_paths[0], texts), config, generation_config)]
+    items = []
+    for i, path in enumerate(input_paths):
+        text, compaction = _read(path, texts), None
+        if generation_config.compact:
+            text, compaction = compact_text(text, generation_config)
+        items.append(PackItem(path, text, str(i + 1), compaction))
+    return await PackingPipeline(provider, checkpoints).plan_pack(items, config, generation_config)
@@ -1,20 +1,138 @@
 import asyncio
 import math
-from typing import List, Optional, Callable, Awaitable
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Callable, Awaitable, Tuple, Type
+from pydantic import BaseModel
 from clarion.schemas import (
-    InstructionConfig, FlexDoc, DocResult, GenerationConfig
+    InstructionConfig, FlexDoc, DocResult, GenerationConfig, CallRecord,
+    PlannedCall, FilePlan, BatchPlan, CompactionReport, ArtifactDoc, WindowReuse
 )
 
 from clarion.providers import LLMProvider, OllamaProvider
 from clarion.prompt_loader import render_prompt
+from clarion.renderer import find_markdown_issues
+from clarion.compaction import compact_text
+from clarion.artifacts import merge_artifacts
+from clarion.admission import admitted, cap_ctx
+from clarion.degeneracy import collect_early_stops
+from clarion.checkpoint import CheckpointStore, hash_text, config_hash, window_key
+from clarion.similarity import signature
+from clarion.tracing import Tracer, span, use_tracer
+from clarion.throughput import ThroughputStore, shared_throughput_store
+from clarion.budget import (
+    estimate_tokens, output_ratio, wrapper_tokens, context_ceiling,
+    max_input_tokens, size_num_predict, fit_num_ctx, window_word_budget,
+    cap_num_predict, count_words, expected_output_tokens, REVIEW_OUTPUT_RATIO, OVERLAP_SHARE,
+    ARTIFACT_OUTPUT_RATIO
+)
+
+# Minimum share of draft words a review pass must keep to count as valid
+MIN_REVIEW_RETENTION = 0.6
+DEFAULT_INSTRUCTION = "Summarize the following text in detail."
+
+class WindowJob:
+    """
+    One window of input flowing through the draft and review stages.
+    """
+    def __init__(self, index: int, text: str, previous_context: str = "", word_budget: Optional[int] = None):
+        self.index = index
+        self.text = text
+        self.previous_context = previous_context
+        self.word_budget = word_budget
+        self._signature: Optional[List[int]] = None
+
+    @property
+    def key(self) -> str:
+        return window_key(self.text, self.previous_context, self.word_budget)
+
+    @property
+    def signature(self) -> List[int]:
+        # MinHash of the window text alone: the previous context differs between near-duplicates
+        if self._signature is None:
+            self._signature = signature(self.text)
+        return self._signature
 
-# Simple token estimator (char / 4)
-def estimate_tokens(text: str) -> int:
-    return len(text) // 4
+class RunContext:
+    """
+    Per-run state shared by all windows of one document.
+    """
+    def __init__(
+        self,
+        instruction: str,
+        config: GenerationConfig,
+        status_callback: Optional[Callable],
+        ctx_limits: Dict[str, int],
+        calls: List[CallRecord],
+        input_hash: str = "",
+        cfg_hash: str = "",
+        input_path: str = ""
+    ):
+        self.instruction = instruction
+        self.config = config
+        self.status_callback = status_callback
+        self.ctx_limits = ctx_limits
+        self.calls = calls
+        # Checkpoint keys
+        self.input_hash = input_hash
+        self.cfg_hash = cfg_hash
+        self.resumed: List[int] = []
+        # Named as the source of this run's windows in the near-duplicate index
+        self.input_path = input_path
+        self.reused: List[WindowReuse] = []
+
+class Layout:
+    """
+    How a document will be processed: strategy, windows and per-stage context limits.
+    """
+    def __init__(
+        self,
+        strategy: str,
+        jobs: List["WindowJob"],
+        ctx_limits: Dict[str, int],
+        model_max: Optional[int],
+        total_budget: Optional[int],
+        input_tokens: int
+    ):
+        self.strategy = strategy
+        self.jobs = jobs
+        self.ctx_limits = ctx_limits
+        self.model_max = model_max
+        self.total_budget = total_budget
+        self.input_tokens = input_tokens
+
+class StageOccupancy:
+    """
+    Tracks busy workers per stage and the queue between them, for status reporting.
+    """
+    def __init__(self, limits: Dict[str, int], queue_size: int, total: int):
+        self.limits = limits
+        self.queue_size = queue_size
+        self.queued = 0
+        self.total = total
+        self.active = {stage: 0 for stage in limits}
+        self.done = {stage: 0 for stage in limits}
+
+    @asynccontextmanager
+    async def busy(self, stage: str):
+        self.active[stage] += 1
+        try:
+            yield
+            self.done[stage] += 1
+        finally:
+            self.active[stage] -= 1
+
+    def describe(self) -> str:
+        return (
+            f"Stages: draft {self.active['draft']}/{self.limits['draft']} busy ({self.done['draft']}/{self.total} done), "
+            f"queue {self.queued}/{self.queue_size}, "
+            f"review {self.active['review']}/{self.limits['review']} busy ({self.done['review']}/{self.total} done)"
+        )
 
 class DirectPipeline:
-    def __init__(self, provider: LLMProvider):
+    def __init__(self, provider: LLMProvider, checkpoints: Optional[CheckpointStore] = None):
         self.provider = provider
+        self.checkpoints = checkpoints
         
     async def _notify(self, msg: str, status_callback: Optional[Callable]):
         if status_callback:
@@ -31,109 +149,638 @@ class DirectPipeline:
         generation_config: Optional[GenerationConfig] = None,
         status_callback: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> DocResult:
+        """
+        Runs the full pipeline for one document.
+        Cancelling the awaiting task stops all stage workers and aborts their in-flight LLM requests;
+        windows finished before that are kept in the checkpoint store.
+        """
+        generation_config = generation_config or GenerationConfig()
+        calls: List[CallRecord] = []
+
+        # Purely user instruction. If empty, default to summarization.
+        user_instruction = instruction_config.inline_instruction or DEFAULT_INSTRUCTION
+        input_text_full, compaction = await self._compact(input_text_full, generation_config, status_callback)
+        layout = await self._layout(input_text_full, user_instruction, generation_config, status_callback)
+
+        # Draft and review run as separate stages, so window N is reviewed while N+1 is drafted
+        ctx = RunContext(
+            user_instruction, generation_config, status_callback, layout.ctx_limits, calls,
+            input_hash=hash_text(input_text_full),
+            cfg_hash=config_hash(user_instruction, self.provider.model_name, generation_config),
+            input_path=input_path
+        )
+        docs = await self._run_stages(ctx, layout.jobs)
+        total_budget = layout.total_budget
+        artifacts = None
+        artifact_warnings = []
+        if generation_config.artifacts:
+            with span("merge_artifacts", windows=len(docs)):
+                artifacts = merge_artifacts(docs, generation_config.artifacts)
+            artifact_warnings = [
+                f"Window {i + 1}: {warning}" for i, doc in enumerate(docs) for warning in getattr(doc, "artifact_warnings", [])
+            ]
+            for warning in artifact_warnings:
+                await self._notify(f"Artifacts incomplete. {warning}", status_callback)
+
+        if len(docs) == 1:
+            # Artifacts travel separately; the document itself is a plain FlexDoc
+            final_doc = FlexDoc(thought_process=docs[0].thought_process, content=docs[0].content)
+        else:
+            # Merge
+            await self._notify("Merging window results...", status_callback)
+            with span("merge", windows=len(docs)):
+                merged_doc = self._merge_docs(docs)
+            if total_budget:
+                await self._notify(f"Merged output: {count_words(merged_doc.content)} words (budget: ~{total_budget}).", status_callback)
+            
+            # Optional: Final Synthesis if it fits?
+            # For now, just return merged because "Reduce" with freeform instructions is ambiguous
+            # (e.g. if instruction was "List action items", merging is just concat. 
+            # If it was "Write a story", concat works too. 
+            # Re-summarizing might lose detail.)
+            final_doc = merged_doc
+
+        await self._notify("Complete.", status_callback)
+        calls.sort(key=lambda c: c.window)
         
+        return DocResult(
+            input_file=input_path,
+            final_doc=final_doc,
+            manifest_path="",
+            model_max_ctx=layout.model_max,
+            word_budget=total_budget,
+            word_count=count_words(final_doc.content),
+            calls=calls,
+            resumed_windows=sorted(ctx.resumed),
+            reused_windows=sorted(ctx.reused, key=lambda r: r.window),
+            compaction=compaction,
+            artifacts=artifacts,
+            artifact_warnings=artifact_warnings
+        )
+
+    async def plan(
+        self,
+        input_path: str,
+        input_text_full: str,
+        instruction_config: InstructionConfig,
+        generation_config: Optional[GenerationConfig] = None,
+        throughput: Optional[ThroughputStore] = None
+    ) -> FilePlan:
+        """
+        Dry run: splits and renders prompts exactly like run(), but sizes the calls instead of making them.
+        Output lengths are estimated from the instruction's output ratio; times from measured tokens/sec.
+        """
+        generation_config = generation_config or GenerationConfig()
+        throughput = throughput or shared_throughput_store()
+        user_instruction = instruction_config.inline_instruction or DEFAULT_INSTRUCTION
+        input_text_full, compaction = await self._compact(input_text_full, generation_config)
+        layout = await self._layout(input_text_full, user_instruction, generation_config)
+
+        ctx = RunContext(
+            user_instruction, generation_config, None, layout.ctx_limits, [],
+            input_hash=hash_text(input_text_full),
+            cfg_hash=config_hash(user_instruction, self.provider.model_name, generation_config)
+        )
+        remaining = self._restore_checkpoints(ctx, layout.jobs, [None] * len(layout.jobs))
+        # Only windows already indexed are found; duplicates within this document are not predicted
+        unmatched = []
+        for job in remaining:
+            found = self._similar_window(ctx.cfg_hash, generation_config, job)
+            if found is None:
+                unmatched.append(job)
+            else:
+                ctx.reused.append(found[1])
+        remaining = unmatched
+
+        planned: List[PlannedCall] = []
+
+        def add(sized: GenerationConfig, record: CallRecord, output_tokens: int):
+            planned.append(self._planned_call(throughput, sized, record, output_tokens))
+
+        ratio = self._draft_ratio(user_instruction, generation_config)
+        for job in remaining:
+            prompt = self._render_generation(
+                user_instruction, job.text, job.word_budget, job.previous_context, generation_config.artifacts
+            )
+            input_tokens = estimate_tokens(job.text)
+            draft_config, draft_record = self._size_call(
+                "draft", prompt, input_tokens, ratio, generation_config,
+                layout.ctx_limits["draft"], ctx.calls, job.index, job.word_budget,
+                schema=self._draft_schema(generation_config)
+            )
+            draft_tokens = expected_output_tokens(input_tokens, ratio, draft_config.num_predict)
+            add(draft_config, draft_record, draft_tokens)
+
+            if generation_config.fast_mode:
+                continue
+            # The draft is not known yet: render the template without it and count its expected size
+            review_prompt = render_prompt("review.j2", draft_content="", word_budget=job.word_budget)
+            review_config, review_record = self._size_call(
+                "review", review_prompt, draft_tokens, REVIEW_OUTPUT_RATIO, generation_config,
+                layout.ctx_limits["review"], ctx.calls, job.index, job.word_budget, extra_tokens=draft_tokens
+            )
+            add(review_config, review_record, expected_output_tokens(draft_tokens, REVIEW_OUTPUT_RATIO, review_config.num_predict))
+
+        return FilePlan(
+            input_file=input_path,
+            chars=len(input_text_full),
+            input_tokens=layout.input_tokens,
+            strategy=layout.strategy,
+            windows=len(layout.jobs),
+            cached_windows=sorted(ctx.resumed),
+            similar_windows=ctx.reused,
+            model_max_ctx=layout.model_max,
+            compaction=compaction,
+            **self._call_totals(planned, generation_config)
+        )
+
+    def _planned_call(
+        self, throughput: ThroughputStore, sized: GenerationConfig, record: CallRecord, output_tokens: int
+    ) -> PlannedCall:
+        backend = getattr(self.provider, "base_url", "")
+        seconds, source = throughput.predict(backend, record.model, record.prompt_tokens, output_tokens)
+        return PlannedCall(
+            stage=record.stage, window=record.window, model=record.model,
+            prompt_tokens=record.prompt_tokens, output_tokens=output_tokens,
+            num_ctx=sized.num_ctx, num_predict=sized.num_predict,
+            seconds=round(seconds, 2), estimate_source=source
+        )
+
+    def _call_totals(self, planned: List[PlannedCall], generation_config: GenerationConfig) -> dict:
+        """
+        FilePlan fields summing up planned calls.
+        """
+        # Each call may need one repair retry; with escalation, a cheaper stage model's call may be redone
+        attempts_per_call = 2
+        max_calls = 0
+        for call in planned:
+            escalates = generation_config.escalate and call.model != self.provider.model_name
+            max_calls += attempts_per_call * (2 if escalates else 1)
+        return {
+            "calls": planned,
+            "call_count": len(planned),
+            "max_calls": max_calls,
+            "prompt_tokens": sum(c.prompt_tokens for c in planned),
+            "output_tokens": sum(c.output_tokens for c in planned),
+            "predicted_seconds": round(sum(c.seconds for c in planned), 1)
+        }
+
+    async def _compact(
+        self,
+        input_text_full: str,
+        generation_config: GenerationConfig,
+        status_callback: Optional[Callable] = None
+    ) -> Tuple[str, Optional[CompactionReport]]:
+        """
+        Applies input compaction when enabled; the compacted text is what gets windowed, prompted and checkpointed.
+        """
+        if not generation_config.compact:
+            return input_text_full, None
+        with span("compact", chars=len(input_text_full)) as compact_span:
+            text, report = compact_text(input_text_full, generation_config)
+            compact_span.set(saved_tokens=report.saved_tokens)
+        if report.saved_tokens:
+            details = ", ".join(f"{n} {rule.replace('_', ' ')}" for rule, n in report.removed.items())
+            share = report.saved_tokens / max(1, report.original_tokens)
+            await self._notify(f"Compaction: saved ~{report.saved_tokens} tokens ({share:.0%}){': ' + details if details else ''}.", status_callback)
+        return text, report
+
+    async def _layout(
+        self,
+        input_text_full: str,
+        user_instruction: str,
+        generation_config: GenerationConfig,
+        status_callback: Optional[Callable] = None
+    ) -> "Layout":
+        """
+        Chooses the execution strategy and splits the input into windows (no generation).
+        """
         # 1. Analyze Input
         total_chars = len(input_text_full)
         est_tokens = estimate_tokens(input_text_full)
         
-        # Determine Context Limit
-        ctx_limit = generation_config.num_ctx if generation_config else 4096
-        safe_input_limit = max(1000, ctx_limit - 2000) 
-        
-        await self._notify(f"Analysis: Input is {total_chars} chars (~{est_tokens} tokens). Context limit: {ctx_limit}.", status_callback)
+        # Determine Context Limit per stage model (model metadata is cached by the provider)
+        ctx_limits, model_max = await self._context_limits(generation_config)
+        ctx_limit = ctx_limits["draft"]
+        overhead = (
+            estimate_tokens(self._render_generation(user_instruction, "", artifacts=generation_config.artifacts))
+            + wrapper_tokens(self._draft_schema(generation_config))
+        )
+        safe_input_limit = max_input_tokens(
+            ctx_limit, overhead, self._draft_ratio(user_instruction, generation_config), generation_config
+        )
         
-        # 2. Prepare Prompt
-        # Purely user instruction. If empty, default to summarization.
-        user_instruction = instruction_config.inline_instruction or "Summarize the following text in detail."
+        await self._notify(f"Analysis: Input is {total_chars} chars (~{est_tokens} tokens). Context limit: {ctx_limit} (model max: {model_max or 'unknown'}).", status_callback)
         
-        # 3. Execution Strategy
+        # 2. Execution Strategy
         if est_tokens <= safe_input_limit:
             # === STRATEGY A: ONE-SHOT ===
             await self._notify(f"Strategy: One-Shot Processing (fits in {ctx_limit} context).", status_callback)
-            
-            final_doc = await self._process_block(
-                input_text_full, 
-                user_instruction,
-                generation_config,
-                status_callback
-            )
+            strategy = "one-shot"
+            windows = [("", input_text_full)]
+            budgets = [generation_config.word_budget]
+            total_budget = generation_config.word_budget
             
         else:
             # === STRATEGY B: WINDOWED REDUCE ===
             await self._notify(f"Strategy: Large File Split ({est_tokens} > {safe_input_limit}). Using Semantic Splitter...", status_callback)
+            strategy = "split"
             
             from clarion.splitter import MarkdownSplitter
-            # Use safe_input_limit * 4 for approx chars, with some overlap
-            splitter = MarkdownSplitter(chunk_size=safe_input_limit * 4, overlap=500)
-            windows = splitter.split_text(input_text_full)
+            # Use safe_input_limit * 4 for approx chars. Overlapping segments of the
+            # previous window share that room, so reserve part of it for them.
+            window_chars = safe_input_limit * 4
+            overlap_chars = int(window_chars * OVERLAP_SHARE) if generation_config.overlap > 0 else 0
+            chunk_chars = window_chars - overlap_chars
+            splitter = MarkdownSplitter(
+                chunk_size=chunk_chars,
+                overlap=overlap_chars,
+                overlap_segments=generation_config.overlap
+            )
+            with span("split", chars=total_chars, chunk_chars=chunk_chars) as split_span:
+                windows = splitter.split_with_overlap(input_text_full)
+                split_span.set(windows=len(windows))
+            budgets = [window_word_budget(generation_config.word_budget, len(w), chunk_chars) for _, w in windows]
+            total_budget = sum(budgets) if generation_config.word_budget else None
             
             await self._notify(f"Split into {len(windows)} semantic blocks.", status_callback)
-            
-            # Process each window
-            docs: List[FlexDoc] = []
-            for i, window in enumerate(windows):
-                await self._notify(f"Processing window {i+1}/{len(windows)}...", status_callback)
-                d = await self._process_block(
-                    window, 
-                    user_instruction,
-                    generation_config,
-                    status_callback
-                )
-                docs.append(d)
-                
-            # Merge
-            await self._notify("Merging window results...", status_callback)
-            merged_doc = self._merge_docs(docs)
-            
-            # Optional: Final Synthesis if it fits?
-            # For now, just return merged because "Reduce" with freeform instructions is ambiguous
-            # (e.g. if instruction was "List action items", merging is just concat. 
-            # If it was "Write a story", concat works too. 
-            # Re-summarizing might lose detail.)
-            final_doc = merged_doc
 
-        await self._notify("Complete.", status_callback)
-        
-        return DocResult(
-            input_file=input_path,
-            final_doc=final_doc,
-            manifest_path=""
+        jobs = [
+            WindowJob(i, text, previous_context, budgets[i])
+            for i, (previous_context, text) in enumerate(windows)
+        ]
+        return Layout(strategy, jobs, ctx_limits, model_max, total_budget, est_tokens)
+
+    async def _context_limits(self, generation_config: GenerationConfig) -> Tuple[Dict[str, int], Optional[int]]:
+        """
+        Largest context per stage, and the draft model's maximum (None if unknown or auto_ctx is off).
+        Under memory pressure (admission control), auto-sized contexts are capped lower.
+        """
+        model_max = review_max = None
+        if generation_config.auto_ctx:
+            with span("model_limits"):
+                model_max = await self.provider.get_context_length(self._stage_model("draft", generation_config))
+                review_max = await self.provider.get_context_length(self._stage_model("review", generation_config))
+        ctx_limits = {
+            "draft": context_ceiling(generation_config, model_max),
+            "review": context_ceiling(generation_config, review_max)
+        }
+        if generation_config.auto_ctx:
+            ctx_limits = {stage: cap_ctx(limit) for stage, limit in ctx_limits.items()}
+        return ctx_limits, model_max
+
+    async def _run_stages(self, ctx: "RunContext", jobs: List["WindowJob"]) -> List[FlexDoc]:
+        """
+        Runs windows through the draft and review stages.
+        Each stage has its own worker pool (draft_concurrency / review_concurrency); drafts wait in
+        a bounded queue (stage_queue_size) and drafting blocks when the queue is full (backpressure).
+        Returns the final documents in window order.
+        """
+        config = ctx.config
+        results: List[Optional[FlexDoc]] = [None] * len(jobs)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, config.stage_queue_size))
+        with span("checkpoint.restore", windows=len(jobs)) as restore_span:
+            remaining = self._restore_checkpoints(ctx, jobs, results)
+            restore_span.set(resumed=len(ctx.resumed))
+        if ctx.resumed:
+            await self._notify(f"Resumed {len(ctx.resumed)}/{len(jobs)} windows from checkpoints.", ctx.status_callback)
+        occupancy = StageOccupancy(
+            {"draft": max(1, config.draft_concurrency), "review": max(1, config.review_concurrency)},
+            queue.maxsize,
+            len(remaining)
         )
+        pending = iter(remaining)
+
+        async def draft_worker():
+            # Workers share one iterator; next() never awaits, so each job is taken exactly once
+            for job in pending:
+                # Looked up when the window starts, so it also finds windows finished earlier in this run
+                found = self._similar_window(ctx.cfg_hash, config, job)
+                if found is not None:
+                    results[job.index], reuse = found
+                    ctx.reused.append(reuse)
+                    occupancy.done["draft"] += 1
+                    occupancy.done["review"] += 1
+                    await self._notify(
+                        f"Window {job.index+1}/{len(jobs)} reuses window {reuse.source_window+1} of {reuse.source} (similarity {reuse.similarity:.2f}).",
+                        ctx.status_callback
+                    )
+                    continue
+                budget_note = f" (budget: ~{job.word_budget} words)" if job.word_budget else ""
+                await self._notify(f"Processing window {job.index+1}/{len(jobs)}{budget_note}...", ctx.status_callback)
+                # Under memory pressure, new windows wait here for admission
+                async with admitted("window"), occupancy.busy("draft"):
+                    draft = await self._draft_block(ctx, job)
+                await queue.put((job, draft))
+                occupancy.queued += 1
+                await self._notify(occupancy.describe(), ctx.status_callback)
+
+        async def review_worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                job, draft = item
+                occupancy.queued -= 1
+                async with occupancy.busy("review"):
+                    results[job.index] = await self._review_block(ctx, job, draft)
+                if self.checkpoints:
+                    window_calls = [c for c in ctx.calls if c.window == job.index]
+                    with span("checkpoint.save", window=job.index):
+                        self.checkpoints.save(
+                            ctx.input_hash, ctx.cfg_hash, job.index, job.text,
+                            results[job.index], window_calls, key=job.key
+                        )
+                    self._index_window(ctx.cfg_hash, ctx.config, job, ctx.input_path)
+                await self._notify(occupancy.describe(), ctx.status_callback)
+
+        async def close_queue(drafters):
+            await asyncio.gather(*drafters)
+            for _ in range(occupancy.limits["review"]):
+                await queue.put(None)
 
-    async def _process_block(self, text: str, instruction: str, config: GenerationConfig, status_callback: Optional[Callable] = None) -> FlexDoc:
+        try:
+            async with asyncio.TaskGroup() as tg:
+                drafters = [tg.create_task(draft_worker()) for _ in range(occupancy.limits["draft"])]
+                for _ in range(occupancy.limits["review"]):
+                    tg.create_task(review_worker())
+                tg.create_task(close_queue(drafters))
+        except ExceptionGroup as eg:
+            # Surface the first failure as-is, like the sequential loop did
+            raise eg.exceptions[0]
+        except asyncio.CancelledError:
+            # TaskGroup has already cancelled every worker and its in-flight request
+            done = len(jobs) - results.count(None)
+            print(f"Pipeline cancelled with {done}/{len(jobs)} windows finished.")
+            raise
+
+        return results
+
+    def _render_generation(
+        self,
+        instruction: str,
+        text: str,
+        word_budget: Optional[int] = None,
+        previous_context: str = "",
+        artifacts: List[str] = ()
+    ) -> str:
         # Load system guidelines
         system_guidelines = render_prompt("system_guidelines.j2")
 
         # Render main prompt
-        prompt = render_prompt(
+        return render_prompt(
             "generation.j2",
             instruction=instruction,
             system_guidelines=system_guidelines,
-            context=text
+            context=text,
+            word_budget=word_budget,
+            previous_context=previous_context,
+            artifacts=list(artifacts)
         )
-        
-        # 1. Draft
-        await self._notify("Drafting content with Ollama...", status_callback)
-        draft_doc = await self.provider.generate_json(prompt, FlexDoc, config)
-        
+
+    def _draft_schema(self, config: GenerationConfig) -> Type[FlexDoc]:
+        # Requested artifacts come back from the draft call, next to the document
+        return ArtifactDoc if config.artifacts else FlexDoc
+
+    def _draft_ratio(self, instruction: str, config: GenerationConfig) -> float:
+        return output_ratio(instruction) + ARTIFACT_OUTPUT_RATIO * len(config.artifacts)
+
+    def _size_call(
+        self,
+        stage: str,
+        prompt: str,
+        input_tokens: int,
+        ratio: float,
+        config: GenerationConfig,
+        ctx_limit: int,
+        calls: List[CallRecord],
+        window_index: int,
+        word_budget: Optional[int] = None,
+        extra_tokens: int = 0,
+        schema: Type[BaseModel] = FlexDoc
+    ) -> Tuple[GenerationConfig, CallRecord]:
+        """
+        Returns a copy of config with num_ctx/num_predict sized for this call and records the choice.
+        extra_tokens counts prompt content not rendered into `prompt` (when planning, the draft a review would see).
+        """
+        model = self._stage_model(stage, config)
+        prompt_tokens = estimate_tokens(prompt) + wrapper_tokens(schema) + extra_tokens
+        num_predict = cap_num_predict(size_num_predict(input_tokens, ratio, config), word_budget)
+        if config.auto_ctx:
+            num_ctx = fit_num_ctx(prompt_tokens, num_predict, ctx_limit)
+            # Never ask for more output than the context can hold
+            num_predict = max(1, min(num_predict, num_ctx - prompt_tokens))
+        else:
+            num_ctx = config.num_ctx
+        sized = config.model_copy(update={"num_ctx": num_ctx, "num_predict": num_predict})
+
+        record = CallRecord(
+            stage=stage,
+            window=window_index,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            num_ctx=sized.num_ctx,
+            num_predict=sized.num_predict,
+            word_budget=word_budget
+        )
+        calls.append(record)
+        return sized, record
+
+    def _restore_checkpoints(
+        self, ctx: "RunContext", jobs: List["WindowJob"], results: List[Optional[FlexDoc]]
+    ) -> List["WindowJob"]:
+        """
+        Fills results from checkpoints where available and returns the jobs still to run.
+        """
+        if not self.checkpoints:
+            return jobs
+        remaining = []
+        for job in jobs:
+            stored = self.checkpoints.load(
+                ctx.input_hash, ctx.cfg_hash, job.index, job.text, key=job.key, schema=self._draft_schema(ctx.config)
+            )
+            if stored is None:
+                remaining.append(job)
+                continue
+            results[job.index], window_calls = stored
+            ctx.calls.extend(window_calls)
+            ctx.resumed.append(job.index)
+        return remaining
+
+    def _similar_window(
+        self, cfg_hash: str, config: GenerationConfig, job: "WindowJob"
+    ) -> Optional[Tuple[FlexDoc, WindowReuse]]:
+        """
+        With config.reuse_similar, finds the most similar window generated earlier under the same
+        config hash and word budget and returns its result. Only generated windows are indexed,
+        so a reused result is always one step from a real generation.
+        """
+        if not self.checkpoints or config.reuse_similar is None:
+            return None
+        with span("similar.lookup", window=job.index) as lookup_span:
+            index = self.checkpoints.similar_index(cfg_hash)
+            for entry, score in index.query(job.signature, job.word_budget, config.reuse_similar):
+                stored = self.checkpoints.load_content(cfg_hash, entry["key"], schema=self._draft_schema(config))
+                if stored is None:
+                    # Pruned since it was indexed
+                    continue
+                lookup_span.set(similarity=score, source=entry["source"])
+                return stored[0], WindowReuse(
+                    window=job.index, similarity=round(score, 3), source=entry["source"],
+                    source_window=entry["window"], source_key=entry["key"]
+                )
+        return None
+
+    def _index_window(self, cfg_hash: str, config: GenerationConfig, job: "WindowJob", input_path: str):
+        # Called after the window's checkpoint is saved, so every indexed key can be loaded
+        if self.checkpoints and config.reuse_similar is not None:
+            self.checkpoints.similar_index(cfg_hash).add(
+                job.key, job.signature, job.word_budget, os.path.basename(input_path), job.index
+            )
+
+    async def _process_block(
+        self,
+        text: str,
+        instruction: str,
+        config: GenerationConfig,
+        status_callback: Optional[Callable] = None,
+        ctx_limits: Optional[Dict[str, int]] = None,
+        calls: Optional[List[CallRecord]] = None,
+        window_index: int = 0,
+        word_budget: Optional[int] = None,
+        previous_context: str = ""
+    ) -> FlexDoc:
+        """
+        Drafts and reviews a single block sequentially (no stage pipelining).
+        """
+        ctx = RunContext(instruction, config, status_callback, ctx_limits or {}, calls if calls is not None else [])
+        job = WindowJob(window_index, text, previous_context, word_budget)
+        with span("process_block", window=window_index):
+            draft_doc = await self._draft_block(ctx, job)
+            return await self._review_block(ctx, job, draft_doc)
+
+    async def _draft_block(self, ctx: "RunContext", job: "WindowJob") -> FlexDoc:
+        with span("draft", window=job.index):
+            config = ctx.config
+            with span("render_prompt", template="generation.j2"):
+                prompt = self._render_generation(
+                    ctx.instruction, job.text, job.word_budget, job.previous_context, config.artifacts
+                )
+            schema = self._draft_schema(config)
+            
+            # 1. Draft
+            draft_config, draft_record = self._size_call(
+                "draft", prompt, estimate_tokens(job.text), self._draft_ratio(ctx.instruction, config),
+                config, ctx.ctx_limits.get("draft", config.num_ctx), ctx.calls, job.index, job.word_budget,
+                schema=schema
+            )
+            await self._notify(f"Drafting content with {draft_record.model} (num_ctx={draft_config.num_ctx}, num_predict={draft_config.num_predict})...", ctx.status_callback)
+            draft_doc = await self._generate(
+                "draft", prompt, draft_config, draft_record, ctx.status_callback,
+                lambda doc: find_markdown_issues(doc.content), schema=schema
+            )
+            draft_record.output_words = count_words(draft_doc.content)
+            return draft_doc
+
+    async def _review_block(self, ctx: "RunContext", job: "WindowJob", draft_doc: FlexDoc) -> FlexDoc:
+        config = ctx.config
+
         # 2. Reflection / Review Loop (Skip if fast_mode is enabled)
         if config and config.fast_mode:
-            await self._notify("Fast Mode: Skipping refinement pass.", status_callback)
+            await self._notify("Fast Mode: Skipping refinement pass.", ctx.status_callback)
             return draft_doc
 
         # We only run this if we have content to review
         if draft_doc.content and len(draft_doc.content) > 10:
-            review_prompt = render_prompt(
-                "review.j2",
-                draft_content=draft_doc.content
-            )
-            # Pass 2: The model acts as editor
-            await self._notify("Reviewing and refining output...", status_callback)
-            final_doc = await self.provider.generate_json(review_prompt, FlexDoc, config)
-            return final_doc
+            with span("review", window=job.index):
+                with span("render_prompt", template="review.j2"):
+                    review_prompt = render_prompt(
+                        "review.j2",
+                        draft_content=draft_doc.content,
+                        word_budget=job.word_budget
+                    )
+                # Pass 2: The model acts as editor
+                review_config, review_record = self._size_call(
+                    "review", review_prompt, estimate_tokens(draft_doc.content), REVIEW_OUTPUT_RATIO,
+                    config, ctx.ctx_limits.get("review", config.num_ctx), ctx.calls, job.index, job.word_budget
+                )
+                await self._notify(f"Reviewing and refining output with {review_record.model}...", ctx.status_callback)
+                draft_words = count_words(draft_doc.content)
+                final_doc = await self._generate(
+                    "review", review_prompt, review_config, review_record, ctx.status_callback,
+                    lambda doc: find_markdown_issues(doc.content) + self._retention_issues(draft_words, doc)
+                )
+                review_record.output_words = count_words(final_doc.content)
+                # The review pass edits the document only; the draft's artifacts stay with it
+                return draft_doc.model_copy(update={"thought_process": final_doc.thought_process, "content": final_doc.content})
             
         return draft_doc
 
+    def _stage_model(self, stage: str, config: GenerationConfig) -> str:
+        return getattr(config, f"{stage}_model", None) or self.provider.model_name
+
+    def _retention_issues(self, draft_words: int, doc: FlexDoc) -> List[str]:
+        # The review pass must fix structure, not drop content
+        words = count_words(doc.content)
+        if draft_words and words < draft_words * MIN_REVIEW_RETENTION:
+            return [f"Review kept only {words}/{draft_words} words"]
+        return []
+
+    async def _generate(
+        self,
+        stage: str,
+        prompt: str,
+        config: GenerationConfig,
+        record: CallRecord,
+        status_callback: Optional[Callable],
+        validate: Callable[[BaseModel], List[str]],
+        schema: Type[BaseModel] = FlexDoc
+    ) -> BaseModel:
+        """
+        Runs one stage on its configured model. With escalation enabled and a stage model
+        other than the primary one, output that fails validation is regenerated on the primary model.
+        Degenerate streams stopped along the way are listed on the record.
+        """
+        seen = len(record.early_stops)
+        with collect_early_stops(record.early_stops):
+            doc = await self._generate_stage(stage, prompt, config, record, status_callback, validate, schema)
+        for stop in record.early_stops[seen:]:
+            await self._notify(
+                f"Stopped degenerate {stage} output ({stop.reason}) after {stop.tokens} tokens and {stop.action} it; ~{stop.saved_tokens} tokens saved.",
+                status_callback
+            )
+        return doc
+
+    async def _generate_stage(
+        self,
+        stage: str,
+        prompt: str,
+        config: GenerationConfig,
+        record: CallRecord,
+        status_callback: Optional[Callable],
+        validate: Callable[[BaseModel], List[str]],
+        schema: Type[BaseModel]
+    ) -> BaseModel:
+        model = self._stage_model(stage, config)
+        if not config.escalate or model == self.provider.model_name:
+            return await self.provider.generate_json(prompt, schema, config, model=model, stage=stage)
+
+        try:
+            doc = await self.provider.generate_json(prompt, schema, config, model=model, stage=stage, strict=True)
+            issues = validate(doc)
+        except ValueError as e:
+            # JSON and schema validation errors
+            issues = [f"Invalid JSON: {e}"]
+
+        if not issues:
+            return doc
+
+        await self._notify(f"Escalating {stage} from {model} to {self.provider.model_name}: {'; '.join(issues[:3])}", status_callback)
+        record.model = self.provider.model_name
+        record.escalated = True
+        with span("escalate", stage=stage, from_model=model, to_model=self.provider.model_name):
+            return await self.provider.generate_json(prompt, schema, config, stage=stage)
+
     def _merge_docs(self, docs: List[FlexDoc]) -> FlexDoc:
         if not docs:
             return FlexDoc(content="")
@@ -142,18 +789,53 @@ class DirectPipeline:
         full_content = "\n\n".join([d.content for d in docs])
         return FlexDoc(content=full_content)
 
+async def plan_pipeline(
+    config: InstructionConfig,
+    input_path: str,
+    provider: Optional[LLMProvider] = None,
+    generation_config: Optional[GenerationConfig] = None,
+    checkpoints: Optional[CheckpointStore] = None
+) -> FilePlan:
+    """
+    Dry-run counterpart of run_pipeline: no generation calls are made.
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    pipeline = DirectPipeline(provider or OllamaProvider(), checkpoints)
+    return await pipeline.plan(input_path, text, config, generation_config)
+
+def batch_plan(files: List[FilePlan]) -> BatchPlan:
+    return BatchPlan(
+        files=files,
+        call_count=sum(f.call_count for f in files),
+        max_calls=sum(f.max_calls for f in files),
+        prompt_tokens=sum(f.prompt_tokens for f in files),
+        output_tokens=sum(f.output_tokens for f in files),
+        predicted_seconds=round(sum(f.predicted_seconds for f in files), 1)
+    )
+
 async def run_pipeline(
     config: InstructionConfig, 
     input_path: str,
     provider: Optional[LLMProvider] = None,
     generation_config: Optional[GenerationConfig] = None,
-    status_callback: Optional[Callable[[str], Awaitable[None]]] = None
+    status_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    tracer: Optional[Tracer] = None,
+    text: Optional[str] = None
 ) -> DocResult:
-    
-    # Read full text
-    with open(input_path, "r", encoding="utf-8") as f:
-        text = f.read()
-        
-    prov = provider or OllamaProvider()
-    pipeline = DirectPipeline(prov)
-    return await pipeline.run(input_path, text, config, generation_config, status_callback)
+    """
+    tracer records spans for this run; without it, spans go to the tracer active in the caller's context (if any).
+    text is the document when it is already in memory; input_path then only names it.
+    """
+    with use_tracer(tracer), span("run_pipeline", input=input_path) as run_span:
+        # Read full text
+        if text is None:
+            with span("read_input"):
+                with open(input_path, "r", encoding="utf-8") as f:
+                    text = f.read()
+        run_span.set(chars=len(text))
+            
+        prov = provider or OllamaProvider()
+        pipeline = DirectPipeline(prov, checkpoints)
+        return await pipeline.run(input_path, text, config, generation_config, status_callback)
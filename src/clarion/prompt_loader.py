@@ -1,6 +1,7 @@
+import json
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 class PromptLoader:
@@ -24,6 +25,16 @@ class PromptLoader:
             lstrip_blocks=True
         )
     
+    def preload(self) -> int:
+        """
+        Compiles every template up front. Called by the server at import, so no request pays for
+        parsing; workers share the compiled code only if the app is imported before they fork.
+        """
+        names = self.env.list_templates(extensions=["j2"])
+        for name in names:
+            self.env.get_template(name)
+        return len(names)
+
     def render(self, template_name: str, **kwargs: Any) -> str:
         """
         Renders a Jinja2 template with the given context.
@@ -36,3 +47,11 @@ loader = PromptLoader()
 
 def render_prompt(template_name: str, **kwargs: Any) -> str:
     return loader.render(template_name, **kwargs)
+
+def schema_example(schema: Any) -> Optional[str]:
+    """
+    Example instance declared on a response schema (json_schema_extra), shown in place of the default example.
+    """
+    extra = schema.model_config.get("json_schema_extra") or {}
+    examples = extra.get("examples") if isinstance(extra, dict) else None
+    return json.dumps(examples[0], indent=2) if examples else None
@@ -1,42 +1,77 @@
+import asyncio
 import json
+import time
 import httpx
 from abc import ABC, abstractmethod
-from typing import Type, TypeVar, Any, List, Optional
+from typing import Type, TypeVar, Any, Dict, List, Optional, Tuple, Union
 from pydantic import BaseModel, ValidationError
 
 # Use string forward reference to avoid circular import if necessary, 
 # but import if possible. 
-from clarion.schemas import GenerationConfig
-from clarion.prompt_loader import render_prompt
+from clarion.schemas import ArtifactDoc, GenerationConfig
+from clarion.prompt_loader import render_prompt, schema_example
+from clarion.tracing import current_tracer, span
+from clarion.throughput import shared_throughput_store
+from clarion.shared_state import active_state, ollama_slot
+from clarion.admission import admitted
+from clarion.degeneracy import DegeneracyDetector, DegenerateOutput, penalized, report
 
 T = TypeVar("T", bound=BaseModel)
 
+def parse_keep_alive(value: Optional[str]) -> Optional[Union[int, str]]:
+    """
+    Ollama keep_alive from a setting: seconds ("300", "-1" = keep loaded), a duration ("30m"),
+    or None to leave Ollama's default (5 minutes).
+    """
+    if value is None or not value.strip():
+        return None
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
 class LLMProvider(ABC):
+    # Primary model; per-stage overrides in GenerationConfig fall back to it
+    model_name: str = ""
+
     @abstractmethod
-    async def generate_json(self, prompt: str, schema: Type[T], config: Optional[GenerationConfig] = None) -> T:
+    async def generate_json(
+        self,
+        prompt: str,
+        schema: Type[T],
+        config: Optional[GenerationConfig] = None,
+        model: Optional[str] = None,
+        stage: str = "draft",
+        strict: bool = False
+    ) -> T:
+        """
+        model overrides the provider's default model for this call; stage selects
+        per-stage option overrides; strict disables the lenient content fallback.
+        """
         pass
 
     async def list_models(self) -> List[str]:
         return []
 
+    async def get_context_length(self, model: Optional[str] = None) -> Optional[int]:
+        """
+        Maximum context length of the model, or None if unknown.
+        """
+        return None
+
 class OllamaProvider(LLMProvider):
+    # Model metadata from /api/show, shared by all instances: (base_url, model) -> context length
+    _context_cache: Dict[Tuple[str, str], Optional[int]] = {}
+
     def __init__(self, model_name: str = "llama3.1", base_url: Optional[str] = None):
         import os
         self.model_name = model_name
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        # How long Ollama keeps a model loaded after each call (server keep-alive policy)
+        self.keep_alive = parse_keep_alive(os.getenv("CLARION_KEEP_ALIVE"))
 
-    async def generate_json(self, prompt: str, schema: Type[T], config: Optional[GenerationConfig] = None) -> T:
-        """
-        Generates a JSON response matching the schema.
-        """
-        schema_json = json.dumps(schema.model_json_schema())
-        
-        pydantic_prompt = render_prompt(
-            "json_enforcement.j2",
-            prompt=prompt,
-            schema_json=schema_json
-        )
-        
+    def _build_options(self, config: Optional[GenerationConfig], stage: str) -> dict:
         # Merge defaults
         options = {
             "temperature": 0.2,
@@ -52,31 +87,80 @@ class OllamaProvider(LLMProvider):
             options["frequency_penalty"] = config.frequency_penalty
             options["repeat_penalty"] = config.repeat_penalty
             options["top_k"] = config.top_k
-            
+            options.update(config.stage_options.get(stage, {}))
+        return options
+
+    async def generate_json(
+        self,
+        prompt: str,
+        schema: Type[T],
+        config: Optional[GenerationConfig] = None,
+        model: Optional[str] = None,
+        stage: str = "draft",
+        strict: bool = False
+    ) -> T:
+        """
+        Generates a JSON response matching the schema.
+        """
+        with span("llm.generate_json", stage=stage, model=model or self.model_name, schema=schema.__name__):
+            return await self._generate_json(prompt, schema, config, model, stage, strict)
+
+    async def _generate_json(
+        self,
+        prompt: str,
+        schema: Type[T],
+        config: Optional[GenerationConfig],
+        model: Optional[str],
+        stage: str,
+        strict: bool
+    ) -> T:
+        schema_json = json.dumps(schema.model_json_schema())
+        example_json = schema_example(schema)
+        
+        with span("render_prompt", template="json_enforcement.j2"):
+            pydantic_prompt = render_prompt(
+                "json_enforcement.j2",
+                prompt=prompt,
+                schema_json=schema_json,
+                example_json=example_json
+            )
+        
+        policy = config.degenerate_policy if config else None
         payload = {
-            "model": self.model_name,
+            "model": model or self.model_name,
             "messages": [{"role": "user", "content": pydantic_prompt}],
-            "stream": False,
+            # Streaming lets a degenerate generation be stopped as it happens
+            "stream": policy is not None,
             "format": "json", 
-            "options": options
+            "options": self._build_options(config, stage)
         }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
         
         try:
-            response = await self._call_api(payload)
-            return self._parse_and_validate(response, schema)
+            response = await self._chat(payload, policy)
+            with span("llm.parse"):
+                return self._parse_and_validate(response, schema)
         except (ValidationError, json.JSONDecodeError) as e:
             # Retry logic
             print(f"JSON validation failed: {e}. Retrying with repair prompt.")
             
-            repair_prompt = render_prompt("repair.j2", error=str(e))
+            repair_prompt = render_prompt("repair.j2", error=str(e), example_json=example_json)
             
             payload["messages"].append({"role": "user", "content": repair_prompt})
+            if config and config.repair_model:
+                payload["model"] = config.repair_model
+                payload["options"] = self._build_options(config, "repair")
             
             # Second attempt
-            response_text = await self._call_api(payload)
+            with span("llm.repair", model=payload["model"], error=type(e).__name__):
+                response_text = await self._chat(payload, policy)
             try:
-                return self._parse_and_validate(response_text, schema)
+                with span("llm.parse", attempt="repair"):
+                    return self._parse_and_validate(response_text, schema)
             except Exception as final_e:
+                if strict:
+                    raise final_e
                 # Fallback: If we just want content (FlexDoc), and the model gave us text, use it.
                 # This is a specific fallback for FlexDoc-like schemas that have a 'content' field.
                 if hasattr(schema, "model_fields") and "content" in schema.model_fields:
@@ -99,10 +183,13 @@ class OllamaProvider(LLMProvider):
                                 data = self._normalize_obj(data, schema)
                                 if "content" in data:
                                     print("Successfully extracted 'content' field from malformed/invalid JSON response.")
-                                    return schema(
+                                    # Other fields the schema knows (artifacts) are kept when they validate
+                                    extra = {k: v for k, v in data.items() if k in schema.model_fields and k not in ("thought_process", "content")}
+                                    return schema.model_validate(dict(
+                                        extra,
                                         thought_process=data.get("thought_process"),
                                         content=str(data["content"])
-                                    )
+                                    ))
                     except:
                         pass
 
@@ -116,7 +203,10 @@ class OllamaProvider(LLMProvider):
                     if not safe_content:
                         raise final_e
                         
-                    return schema(content=safe_content)
+                    doc = schema(content=safe_content)
+                    if isinstance(doc, ArtifactDoc):
+                        doc.artifact_warnings.append("response was not valid JSON; all artifacts lost")
+                    return doc
                 
                 print(f"Retry failed: {final_e}. Checking for fallback candidates...")
                 raise final_e
@@ -135,7 +225,111 @@ class OllamaProvider(LLMProvider):
                 print(f"Failed to list models: {e}")
                 return []
 
+    async def load_model(self, model: Optional[str] = None, num_ctx: Optional[int] = None) -> float:
+        """
+        Loads the model into memory without generating (an empty /api/generate request) and
+        keeps it loaded for keep_alive. Returns the load time in seconds as reported by Ollama
+        (0 when it was already loaded). num_ctx should be the context calls will use: a call
+        with another num_ctx reloads the model.
+        """
+        model = model or self.model_name
+        payload: Dict[str, Any] = {"model": model}
+        if num_ctx:
+            payload["options"] = {"num_ctx": num_ctx}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        started = time.perf_counter()
+        with span("ollama.load", model=model):
+            # Loading a large model from disk can take minutes
+            async with httpx.AsyncClient(timeout=httpx.Timeout(1200.0, connect=10.0)) as client:
+                resp = await client.post(f"{self.base_url}/api/generate", json=payload)
+                resp.raise_for_status()
+                data = resp.json()
+        if "load_duration" in data:
+            return data["load_duration"] / 1e9
+        return time.perf_counter() - started
+
+    async def loaded_models(self) -> Optional[Dict[str, dict]]:
+        """
+        Models Ollama currently holds in memory (/api/ps), by name; None if Ollama is unreachable.
+        """
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            try:
+                resp = await client.get(f"{self.base_url}/api/ps")
+                resp.raise_for_status()
+                return {m["name"]: m for m in resp.json().get("models", [])}
+            except Exception as e:
+                print(f"Failed to list loaded models: {e}")
+                return None
+
+    async def get_context_length(self, model: Optional[str] = None) -> Optional[int]:
+        """
+        Reads the model's trained context length via /api/show. Cached per base URL and model,
+        across server workers when shared state is active.
+        """
+        model = model or self.model_name
+        key = (self.base_url, model)
+        if key in self._context_cache:
+            return self._context_cache[key]
+        state = active_state()
+        shared_key = f"context_length|{self.base_url}|{model}"
+        if state:
+            cached = await asyncio.to_thread(state.get_cached, shared_key)
+            if cached is not None:
+                self._context_cache[key] = json.loads(cached)
+                return self._context_cache[key]
+
+        context_length = None
+        with span("ollama.show", model=model):
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                try:
+                    resp = await client.post(f"{self.base_url}/api/show", json={"model": model})
+                    resp.raise_for_status()
+                    model_info = resp.json().get("model_info") or {}
+                    for k, v in model_info.items():
+                        if k.endswith(".context_length") and isinstance(v, int):
+                            context_length = v
+                            break
+                except Exception as e:
+                    print(f"Failed to read model info for {model}: {e}")
+                    # Do not cache transient failures
+                    return None
+
+        self._context_cache[key] = context_length
+        if state:
+            await asyncio.to_thread(state.set_cached, shared_key, json.dumps(context_length))
+        return context_length
+
+    async def _chat(self, payload: dict, policy: Optional[str]) -> str:
+        """
+        One chat call under the degeneracy policy. A stream stopped for degenerate output is
+        retried once with stronger repetition penalties ("retry"); otherwise, or if the retry
+        degenerates too, the output before the loop is returned as closed JSON ("truncate").
+        """
+        try:
+            return await self._call_api(payload)
+        except DegenerateOutput as e:
+            stop = e
+        if policy == "retry":
+            await report(stop, "retried")
+            print(f"Stopped degenerate output ({stop.reason}) after {stop.tokens} tokens (~{stop.saved_tokens} tokens, {stop.saved_seconds:.1f}s saved). Retrying with stronger repetition penalties.")
+            try:
+                return await self._call_api(dict(payload, options=penalized(payload["options"])))
+            except DegenerateOutput as e:
+                stop = e
+        await report(stop, "truncated")
+        print(f"Stopped degenerate output ({stop.reason}) after {stop.tokens} tokens (~{stop.saved_tokens} tokens, {stop.saved_seconds:.1f}s saved). Keeping the output before it.")
+        return stop.prefix
+
     async def _call_api(self, payload: dict) -> str:
+        options = payload.get("options", {})
+        # Waits here while the host is swapping (admission control) or while the host-wide
+        # Ollama budget is used up by other calls or server workers
+        async with admitted("call"), ollama_slot(payload["model"]):
+            with span("ollama.chat", model=payload["model"], num_ctx=options.get("num_ctx"), num_predict=options.get("num_predict")) as call_span:
+                return await self._post_chat(payload, call_span)
+
+    async def _post_chat(self, payload: dict, call_span) -> str:
         # Increase timeout to 20m for large model loading
         timeout = httpx.Timeout(1200.0, connect=10.0)
         async with httpx.AsyncClient(timeout=timeout) as client:
@@ -144,14 +338,23 @@ class OllamaProvider(LLMProvider):
             last_error = None
             
             for attempt in range(max_retries):
+                call_span.set(attempts=attempt + 1)
                 try:
+                    sent_ns = time.time_ns()
+                    if payload.get("stream"):
+                        # Busy and error statuses surface as HTTPStatusError below
+                        data = await self._stream_chat(client, payload, call_span)
+                        received_ns = time.time_ns()
+                        self._trace_timings(data, sent_ns, received_ns, call_span)
+                        await asyncio.to_thread(shared_throughput_store().record, self.base_url, payload["model"], data, received_ns - sent_ns)
+                        return data["message"]["content"]
+
                     resp = await client.post(f"{self.base_url}/api/chat", json=payload)
                     
                     if resp.status_code == 429 or resp.status_code == 503:
                         msg = resp.json().get("error", "Too Many Requests") if resp.status_code == 429 else "Service Unavailable"
                         delay = base_delay * (2 ** attempt)
                         print(f"Server busy ({resp.status_code}: {msg}). Retrying in {delay}s...")
-                        import asyncio
                         await asyncio.sleep(delay)
                         continue
                         
@@ -161,6 +364,10 @@ class OllamaProvider(LLMProvider):
                         
                     resp.raise_for_status()
                     data = resp.json()
+                    received_ns = time.time_ns()
+                    self._trace_timings(data, sent_ns, received_ns, call_span)
+                    # Feeds the planner's time predictions
+                    await asyncio.to_thread(shared_throughput_store().record, self.base_url, payload["model"], data, received_ns - sent_ns)
                     return data["message"]["content"]
                     
                 except httpx.HTTPStatusError as e:
@@ -177,21 +384,79 @@ class OllamaProvider(LLMProvider):
                         # Pass through to retry logic if raise_for_status triggered it
                         delay = base_delay * (2 ** attempt)
                         print(f"HTTP {e.response.status_code}. Retrying in {delay}s...")
-                        import asyncio
                         await asyncio.sleep(delay)
                         continue
                     raise e
+                except asyncio.CancelledError:
+                    # Leaving the client context closes the connection, which makes Ollama stop generating
+                    print("LLM request cancelled. Aborting in-flight call.")
+                    raise
                 except (httpx.ConnectError, httpx.ReadTimeout, httpx.WriteTimeout, httpx.PoolTimeout) as e:
                      last_error = e
                      # Also retry on connection errors/timeouts? Maybe safer.
                      print(f"Network error: {e}. Retrying...")
                      delay = base_delay * (2 ** attempt)
-                     import asyncio
                      await asyncio.sleep(delay)
                      continue
             
             raise Exception(f"Max retries exceeded for LLM API call. Last error: {last_error}")
             
+    async def _stream_chat(self, client: httpx.AsyncClient, payload: dict, call_span) -> dict:
+        """
+        Streams a chat call through a DegeneracyDetector. Returns Ollama's final chunk with the
+        whole message, like a non-streamed response, or raises DegenerateOutput; leaving the
+        stream early closes the connection, which makes Ollama stop generating.
+        """
+        options = payload.get("options", {})
+        detector = DegeneracyDetector(
+            sum(len(m["content"]) for m in payload["messages"]), options.get("num_predict")
+        )
+        async with client.stream("POST", f"{self.base_url}/api/chat", json=payload) as resp:
+            if resp.is_error:
+                await resp.aread()
+                resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise Exception(f"Ollama Server Error: {chunk['error']}")
+                if chunk.get("done"):
+                    chunk["message"] = {"role": "assistant", "content": detector.text + chunk.get("message", {}).get("content", "")}
+                    return chunk
+                reason = detector.feed(chunk.get("message", {}).get("content", ""))
+                if reason:
+                    call_span.set(early_stop=reason, eval_count=detector.tokens)
+                    raise detector.stop(reason)
+        raise Exception("Ollama stream ended before the response was complete")
+
+    def _trace_timings(self, data: dict, sent_ns: int, received_ns: int, call_span):
+        """
+        Splits a traced call into the phases Ollama reports (all in ns): time before the server
+        started on the request (queueing and transfer), model load, prompt eval and generation.
+        """
+        tracer = current_tracer()
+        if tracer is None or "total_duration" not in data:
+            return
+        load = data.get("load_duration", 0)
+        prompt_eval = data.get("prompt_eval_duration", 0)
+        eval_ = data.get("eval_duration", 0)
+        queued = max(0, received_ns - sent_ns - data["total_duration"])
+        call_span.set(
+            queue_ms=queued / 1e6,
+            load_ms=load / 1e6,
+            prompt_eval_ms=prompt_eval / 1e6,
+            eval_ms=eval_ / 1e6,
+            prompt_eval_count=data.get("prompt_eval_count", 0),
+            eval_count=data.get("eval_count", 0)
+        )
+        # Phases are laid out back to back, ending when the response arrived
+        end = received_ns
+        for name, duration in (("ollama.eval", eval_), ("ollama.prompt_eval", prompt_eval), ("ollama.load", load), ("ollama.queue", queued)):
+            if duration:
+                tracer.record(name, end - duration, end)
+                end -= duration
+
     def _parse_and_validate(self, content: str, schema: Type[T]) -> T:
         """
         Robustly extract and validate JSON from model output.
@@ -1,5 +1,13 @@
 import re
+from typing import List
 from clarion.schemas import FlexDoc
+from clarion.tracing import span
+
+MERMAID_DIAGRAM_TYPES = (
+    "graph", "flowchart", "sequenceDiagram", "classDiagram", "stateDiagram",
+    "erDiagram", "gantt", "pie", "journey", "mindmap", "timeline"
+)
+MERMAID_RESERVED_IDS = ("end", "subgraph", "class", "style")
 
 def sanitize_mermaid(markdown: str) -> str:
     """
@@ -70,25 +78,51 @@ def sanitize_mermaid(markdown: str) -> str:
 
     return block_pattern.sub(fix_block, markdown)
 
+def find_markdown_issues(markdown: str) -> List[str]:
+    """
+    Cheap structural checks used to decide whether a generated document needs another pass.
+    Returns a list of human-readable issues (empty if none were found).
+    """
+    issues = []
+    if markdown.count("```") % 2 != 0:
+        issues.append("Unclosed code block")
+
+    for i, block in enumerate(re.findall(r"```mermaid\n(.*?)\n```", markdown, re.DOTALL)):
+        lines = [l.strip() for l in block.split("\n") if l.strip()]
+        if not lines or not lines[0].startswith(MERMAID_DIAGRAM_TYPES):
+            issues.append(f"Mermaid block {i+1}: missing diagram type")
+        for line in lines[1:]:
+            if re.search(r"-->\s*\|", line) or re.search(r"--\|", line):
+                issues.append(f"Mermaid block {i+1}: pipe edge label in '{line}'")
+            # Node IDs on either side of an edge ('end' alone on a line closes a subgraph and is fine)
+            node_ids = re.findall(r"([A-Za-z_][A-Za-z0-9_]*)\s*(?:-->|---|==>|-\.->|--\s|==\s|-\.\s)", line)
+            node_ids += re.findall(r"(?:-->|---|==>|\.->)\s*([A-Za-z_][A-Za-z0-9_]*)", line)
+            for node_id in node_ids:
+                if node_id in MERMAID_RESERVED_IDS:
+                    issues.append(f"Mermaid block {i+1}: reserved keyword '{node_id}' used as node ID")
+    return issues
+
 def render_markdown(doc: FlexDoc) -> str:
     """
     Renders FlexDoc content to markdown.
     Includes a failsafe to unwrap raw JSON if it was accidentally saved as content.
     """
-    content = doc.content.strip()
-    
-    # Failsafe: If content is a raw JSON string, try to extract the inner content
-    if content.startswith('{') and content.endswith('}'):
-        try:
-            import json
-            data = json.loads(content, strict=False)
-            if isinstance(data, dict):
-                # Check various common content keys
-                for key in ["content", "text", "markdown", "output"]:
-                    if key in data and isinstance(data[key], str):
-                        content = data[key]
-                        break
-        except:
-            pass
-            
-    return sanitize_mermaid(content)
+    with span("render_markdown", chars=len(doc.content)):
+        content = doc.content.strip()
+        
+        # Failsafe: If content is a raw JSON string, try to extract the inner content
+        if content.startswith('{') and content.endswith('}'):
+            try:
+                import json
+                data = json.loads(content, strict=False)
+                if isinstance(data, dict):
+                    # Check various common content keys
+                    for key in ["content", "text", "markdown", "output"]:
+                        if key in data and isinstance(data[key], str):
+                            content = data[key]
+                            break
+            except:
+                pass
+                
+        with span("sanitize_mermaid"):
+            return sanitize_mermaid(content)
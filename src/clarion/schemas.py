@@ -1,5 +1,11 @@
-from typing import List, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
+from pydantic.json_schema import SkipJsonSchema
+
+# Structured outputs the draft call can extract alongside the document
+ARTIFACT_KINDS = ("glossary", "claims", "action_items")
+# What happens to a call stopped for degenerate output
+DEGENERATE_POLICIES = ("retry", "truncate")
 
 class GenerationConfig(BaseModel):
     """
@@ -14,7 +20,39 @@ class GenerationConfig(BaseModel):
     repeat_penalty: float = 1.1
     top_k: int = 40
     fast_mode: bool = False
-    
+    # Per-call sizing: derive num_ctx/num_predict from prompt size and model limits
+    auto_ctx: bool = True
+    max_ctx: Optional[int] = None  # Upper bound for auto-sized num_ctx (default: model maximum)
+    max_predict: int = 8192  # Upper bound for auto-sized num_predict
+    # Output budget and window overlap
+    word_budget: Optional[int] = None  # Target output words per full-size window
+    overlap: int = 0  # Trailing segments of the previous window passed as context
+    # Model cascade: per-stage models (default: the provider's model) and Ollama option overrides
+    draft_model: Optional[str] = None
+    review_model: Optional[str] = None
+    repair_model: Optional[str] = None
+    stage_options: Dict[str, Dict[str, Any]] = Field(default_factory=dict)  # e.g. {"review": {"temperature": 0.0}}
+    escalate: bool = False  # Re-run a stage on the primary model if a cheaper model's output fails validation
+    # Stage pipelining: workers per stage and drafts buffered between draft and review
+    draft_concurrency: int = 1
+    review_concurrency: int = 1
+    stage_queue_size: int = 2
+    # Small-document packing: several one-shot inputs per LLM call
+    pack: bool = False
+    pack_max_docs: int = 8
+    # Input compaction before windowing (front matter, comments, embedded images, duplicates, whitespace)
+    compact: bool = False
+    compact_code_lines: Optional[int] = None  # Keep this many lines (head and tail) of each fenced code block
+    compact_table_rows: Optional[int] = None  # Keep this many body rows of each table
+    # Structured artifacts extracted by the draft call alongside the document (disables packing)
+    artifacts: List[Literal[ARTIFACT_KINDS]] = Field(default_factory=list)
+    # Reuse the output of an earlier window whose text is at least this similar (estimated Jaccard
+    # similarity of word shingles, 0-1; e.g. 0.9) instead of generating; None disables
+    reuse_similar: Optional[float] = Field(None, ge=0.0, le=1.0)
+    # Stream calls and stop output that degenerates (repetition loop, whitespace stall, runaway length):
+    # "retry" once with stronger repetition penalties, "truncate" keeps the output before the loop
+    degenerate_policy: Optional[Literal[DEGENERATE_POLICIES]] = None
+
 class InstructionConfig(BaseModel):
     """
     Configuration for prompt ingestion from user files and inline text.
@@ -34,6 +72,12 @@ class Claim(BaseModel):
     claim: str
     confidence: str = Field(..., pattern="^(high|medium|low)$")
 
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def _lowercase(cls, value: Any) -> Any:
+        # Models answer "High" or " medium " as often as "high"
+        return value.strip().lower() if isinstance(value, str) else value
+
 class ActionItem(BaseModel):
     action: str
     owner: Optional[str] = None
@@ -49,6 +93,134 @@ class FlexDoc(BaseModel):
     )
     content: str = Field(..., description="The main markdown content.")
 
+class Artifacts(BaseModel):
+    """
+    Structured items extracted from a document; per-window lists are merged and deduplicated.
+    """
+    glossary: List[GlossaryTerm] = Field(
+        default_factory=list, description="Domain terms the text defines or relies on, each with a one-sentence definition."
+    )
+    claims: List[Claim] = Field(
+        default_factory=list, description="Factual claims the text makes, with how firmly the text supports each one."
+    )
+    action_items: List[ActionItem] = Field(
+        default_factory=list, description="Tasks, follow-ups and next steps, with owner and due date when the text states them."
+    )
+
+_ARTIFACT_ITEMS = {"glossary": GlossaryTerm, "claims": Claim, "action_items": ActionItem}
+
+class ArtifactDoc(Artifacts, FlexDoc):
+    """
+    Document and its artifacts from a single generation.
+    """
+    # Artifact items that fail validation are dropped and noted here rather than failing the
+    # whole draft. Not part of the schema the model is asked to follow (the docstring is).
+    artifact_warnings: SkipJsonSchema[List[str]] = Field(default_factory=list)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _drop_invalid_items(cls, data: Any) -> Any:
+        if not isinstance(data, dict):
+            return data
+        data = dict(data)
+        warnings = list(data.get("artifact_warnings") or [])
+        for kind, item_model in _ARTIFACT_ITEMS.items():
+            items = data.get(kind)
+            if items is None:
+                continue
+            if not isinstance(items, list):
+                warnings.append(f"{kind} was not a list; dropped")
+                data[kind] = []
+                continue
+            valid = []
+            for item in items:
+                try:
+                    valid.append(item_model.model_validate(item))
+                except ValidationError:
+                    pass
+            if len(valid) < len(items):
+                warnings.append(f"dropped {len(items) - len(valid)} of {len(items)} invalid {kind} item(s)")
+            data[kind] = valid
+        data["artifact_warnings"] = warnings
+        return data
+
+    model_config = ConfigDict(json_schema_extra={"examples": [{
+        "thought_process": "The text explains the ELISA protocol and ends with open tasks.",
+        "content": "# ELISA Protocol\n\nThe assay measures...",
+        "glossary": [{"term": "ELISA", "definition": "Plate-based assay that detects antigens with enzyme-linked antibodies."}],
+        "claims": [{"claim": "Blocking for 2 hours reduces background signal.", "confidence": "medium"}],
+        "action_items": [{"action": "Order new detection antibody", "owner": "Maria", "due_date": None}]
+    }]})
+
+class PackedEntry(BaseModel):
+    """
+    One document's result inside a packed response.
+    """
+    id: str = Field(..., description="The document id, copied exactly from its header.")
+    content: str = Field(..., description="The main markdown content for this document.")
+
+class PackedDocs(BaseModel):
+    """
+    Response for several small documents processed in one call.
+    """
+    model_config = ConfigDict(json_schema_extra={"examples": [{
+        "thought_process": "Document 1 describes the assay setup; document 2 lists reagents.",
+        "documents": [
+            {"id": "1", "content": "# Assay Setup\n\nThis document describes..."},
+            {"id": "2", "content": "# Reagents\n\n- ..."}
+        ]
+    }]})
+
+    thought_process: Optional[str] = Field(
+        None,
+        description="Internal reasoning/planning block. Use this to analyze the request before generating content."
+    )
+    documents: List[PackedEntry] = Field(..., description="One entry per input document, in input order.")
+
+class EarlyStop(BaseModel):
+    """
+    A streamed LLM call stopped because its output degenerated (GenerationConfig.degenerate_policy).
+    """
+    reason: str  # repetition, stall or oversize
+    action: str  # retried (with stronger repetition penalties) or truncated (output before the loop kept)
+    tokens: int  # Tokens generated before the stop
+    saved_tokens: int  # Of num_predict, left ungenerated
+    saved_seconds: float  # saved_tokens at the call's own generation rate
+
+class CallRecord(BaseModel):
+    """
+    Options chosen for a single LLM call.
+    """
+    stage: str
+    window: int = 0
+    model: Optional[str] = None
+    escalated: bool = False
+    prompt_tokens: int
+    num_ctx: int
+    num_predict: int
+    word_budget: Optional[int] = None
+    output_words: Optional[int] = None
+    early_stops: List[EarlyStop] = Field(default_factory=list)  # Degenerate streams cut short for this call
+
+class CompactionReport(BaseModel):
+    """
+    What input compaction removed from one document.
+    """
+    original_tokens: int
+    compacted_tokens: int
+    saved_tokens: int
+    removed: Dict[str, int] = Field(default_factory=dict)  # Items removed per rule, e.g. {"html_comments": 3}
+
+class WindowReuse(BaseModel):
+    """
+    A window whose output was taken from an earlier, near-identical window instead of generated.
+    """
+    window: int
+    similarity: float  # Estimated Jaccard similarity of the two windows' word shingles
+    source: str  # Input the reused window came from
+    source_window: int
+    source_key: str  # Content address of the reused window's checkpoint
+
 class DocResult(BaseModel):
     """
     Final output structure.
@@ -56,3 +228,59 @@ class DocResult(BaseModel):
     input_file: str
     final_doc: FlexDoc
     manifest_path: str
+    model_max_ctx: Optional[int] = None
+    word_budget: Optional[int] = None  # Total budget across all windows
+    word_count: int = 0
+    calls: List[CallRecord] = Field(default_factory=list)
+    resumed_windows: List[int] = Field(default_factory=list)  # Windows restored from checkpoints
+    packed_with: List[str] = Field(default_factory=list)  # Other inputs that shared this document's LLM calls
+    compaction: Optional[CompactionReport] = None
+    artifacts: Optional[Artifacts] = None  # With GenerationConfig.artifacts
+    artifact_warnings: List[str] = Field(default_factory=list)  # Artifact items lost to invalid model output, per window
+    reused_windows: List[WindowReuse] = Field(default_factory=list)  # With GenerationConfig.reuse_similar
+
+class PlannedCall(BaseModel):
+    """
+    One LLM call a dry run expects to make.
+    """
+    stage: str
+    window: int = 0
+    model: str
+    prompt_tokens: int
+    output_tokens: int  # Expected, not the num_predict ceiling
+    num_ctx: int
+    num_predict: int
+    seconds: float
+    estimate_source: str = "default"  # "history" (measured tokens/sec) or "default"
+
+class FilePlan(BaseModel):
+    """
+    Dry-run result for one document: what a real run would do and roughly how long it would take.
+    """
+    input_file: str
+    chars: int
+    input_tokens: int
+    strategy: str  # "one-shot", "split" or "packed"
+    windows: int
+    cached_windows: List[int] = Field(default_factory=list)  # Would be restored from checkpoints
+    similar_windows: List[WindowReuse] = Field(default_factory=list)  # Would reuse a near-identical window
+    packed_with: List[str] = Field(default_factory=list)  # Other inputs sharing this document's calls
+    model_max_ctx: Optional[int] = None
+    compaction: Optional[CompactionReport] = None
+    calls: List[PlannedCall] = Field(default_factory=list)
+    call_count: int = 0
+    max_calls: int = 0  # Worst case: every call needs a JSON repair retry (and escalation, if enabled)
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    predicted_seconds: float = 0.0
+
+class BatchPlan(BaseModel):
+    """
+    Dry-run totals for a batch of documents (calls run one after another).
+    """
+    files: List[FilePlan] = Field(default_factory=list)
+    call_count: int = 0
+    max_calls: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    predicted_seconds: float = 0.0
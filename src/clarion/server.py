@@ -1,32 +1,85 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, FileResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
+from contextlib import asynccontextmanager
 import shutil
 import tempfile
 import os
 import json
+import uuid
+import gzip
+import re
 from pathlib import Path
 
-from clarion.schemas import InstructionConfig, DocResult
-from clarion.pipeline import run_pipeline
+from clarion.schemas import InstructionConfig, DocResult, GenerationConfig, ARTIFACT_KINDS, DEGENERATE_POLICIES
+from clarion.pipeline import batch_plan
+from clarion.packing import iter_units, run_unit, plan_unit
 from clarion.providers import OllamaProvider
 from clarion.renderer import render_markdown
-
-import psutil
-try:
-    import pynvml
-    pynvml.nvmlInit()
-    nvml_initialized = True
-except Exception:
-    nvml_initialized = False
+from clarion.checkpoint import CheckpointStore
+from clarion.prompt_loader import loader
+from clarion.shared_state import SharedState, activate
+from clarion.throughput import shared_throughput_store
+from clarion import admission
+from clarion.admission import AdmissionController, HostMetricSource
+from clarion.warmup import ModelWarmer
+from clarion.tracing import Tracer, CpuSampler, use_tracer, TRACE_FORMATS
+from clarion.ingest import (
+    DEFAULT_INCLUDE, DEFAULT_MAX_ENTRY_BYTES, TAR_CONTENT_TYPES, ZIP_CONTENT_TYPES,
+    IngestReport, iter_directory, iter_zip, stream_tar
+)
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import asyncio
 import time
 
-app = FastAPI(title="Clarion API", version="0.1.0")
+# Compile prompt templates at import, before the worker serves its first request. Workers only share
+# the compiled code under a pre-fork server (gunicorn --preload); clarion serve spawns its workers
+loader.preload()
+
+# Cross-worker state (Ollama budget, job index, metrics); one SQLite database per host
+_shared_state: Optional[SharedState] = None
+
+def get_shared_state() -> SharedState:
+    global _shared_state
+    if _shared_state is None:
+        _shared_state = SharedState()
+    return _shared_state
+
+# Models kept loaded in Ollama, behind /v1/ready
+_model_warmer: Optional[ModelWarmer] = None
+
+def get_model_warmer() -> ModelWarmer:
+    global _model_warmer
+    if _model_warmer is None:
+        _model_warmer = ModelWarmer.from_env()
+    return _model_warmer
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SQLite calls block (a write can wait on another worker's lock): keep them off the event loop
+    state = await asyncio.to_thread(get_shared_state)
+    activate(state)
+    await asyncio.to_thread(state.register_worker)
+    # Throughput history moves to the shared database, so /v1/plan predicts alike in every worker
+    throughput = await asyncio.to_thread(shared_throughput_store)
+    # Hold back work under memory pressure unless disabled (CLARION_ADMISSION=0)
+    if os.getenv("CLARION_ADMISSION", "1") == "1":
+        admission.activate(AdmissionController())
+    # Load the warm models (CLARION_WARM_MODELS) in the background; /v1/ready reports when they are
+    warmer_task = asyncio.create_task(get_model_warmer().run())
+    try:
+        yield
+    finally:
+        warmer_task.cancel()
+        admission.activate(None)
+        await asyncio.to_thread(throughput.flush)
+        await asyncio.to_thread(state.unregister_worker)
+        activate(None)
+
+app = FastAPI(title="Clarion API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,13 +89,261 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Window checkpoints; the server always resumes, so a restarted job only reruns missing windows
+_checkpoint_store: Optional[CheckpointStore] = None
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        _checkpoint_store = CheckpointStore(resume=True)
+    return _checkpoint_store
+
 class ProcessRequest(BaseModel):
     # For file uploads we usually form-data, so pydantic model for body is tricky
     # We will use simple form params in the endpoint
     pass
 
+# Jobs running in this worker: job_id -> cancel flag (set by the cancel endpoint).
+# Jobs of other workers are cancelled through the shared job index.
+_jobs: dict[str, asyncio.Event] = {}
+# How often a running job checks for client disconnect or cancellation
+STOP_POLL_INTERVAL = 0.5
+# Rendered documents up to this size are sent inline in file_result events
+INLINE_RESULT_BYTES = 64 * 1024
+# Output responses larger than this are gzip-compressed when the client accepts it
+COMPRESS_MIN_BYTES = 1024
+# Per-job traces and CPU profiles (trace=true / profile_cpu=true)
+TRACE_DIR = Path("outputs") / "traces"
+
+async def _drain_status(task: asyncio.Task, status_queue: asyncio.Queue, should_stop):
+    """
+    Yields queued status events until the task finishes, then flushes the rest.
+    Cancels the task (and with it the in-flight Ollama request) as soon as should_stop() returns True.
+    """
+    while not task.done():
+        getter = asyncio.ensure_future(status_queue.get())
+        await asyncio.wait({getter, task}, timeout=STOP_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        if getter.done():
+            yield getter.result()
+        else:
+            getter.cancel()
+        if not task.done() and await should_stop():
+            task.cancel()
+            break
+    # Let a cancelled task unwind before reporting
+    await asyncio.gather(task, return_exceptions=True)
+    while not status_queue.empty():
+        yield status_queue.get_nowait()
+
+async def _job_events(
+    job_id: str,
+    inputs: AsyncIterator[str],
+    total: Optional[int],
+    config: InstructionConfig,
+    gen_config: GenerationConfig,
+    provider: OllamaProvider,
+    should_stop,
+    report: Optional[IngestReport] = None,
+    tracer: Optional[Tracer] = None,
+    trace_format: str = "chrome",
+    sampler: Optional[CpuSampler] = None
+):
+    """
+    Runs the pipeline over each input path as it becomes available and yields SSE events:
+    status messages, one file_result per file and a final result (or cancelled) summary.
+    With a tracer (and sampler), the trace (and CPU profile) are saved under TRACE_DIR and linked from the summary.
+    """
+    start_time = time.time()
+    task = None
+    state = get_shared_state()
+    await asyncio.to_thread(state.start_job, job_id, total)
+    # Until the job reaches its end, leaving early means the client went away
+    status = "cancelled"
+    results = []
+    controller = admission.active_controller()
+    job_admitted = False
+    if sampler:
+        sampler.start()
+    try:
+        yield f"event: job\ndata: {json.dumps({'job_id': job_id})}\n\n"
+
+        if controller:
+            # Under memory pressure, a new job waits until it eases or nothing else runs here
+            job_admitted = controller.try_acquire("job")
+            if not job_admitted:
+                controller.waits["job"] += 1
+                controller.waiting["job"] += 1
+                try:
+                    yield "event: status\ndata: Waiting for memory pressure to ease before starting...\n\n"
+                    while not job_admitted and not await should_stop():
+                        await asyncio.sleep(controller.sample_interval)
+                        job_admitted = controller.try_acquire("job")
+                finally:
+                    controller.waiting["job"] -= 1
+
+        i = 0
+        async for unit in iter_units(inputs, config, provider, gen_config, get_checkpoint_store()):
+            if await should_stop():
+                break
+            names = [Path(p).name for p in unit]
+            label = names[0] if len(names) == 1 else f"{names[0]} +{len(names) - 1}"
+            of_total = f"/{total}" if total else ""
+            if len(unit) == 1:
+                yield f"event: status\ndata: Processing file {i + 1}{of_total}: {label}...\n\n"
+            else:
+                yield f"event: status\ndata: Processing files {i + 1}-{i + len(unit)}{of_total} in one pack: {', '.join(names)}...\n\n"
+            i += len(unit)
+            await asyncio.sleep(0.1) 
+            
+            # Callback for pipeline: messages are queued and streamed while the pipeline runs
+            status_queue: asyncio.Queue = asyncio.Queue()
+            async def progress_callback(msg: str, label=label, status_queue=status_queue):
+                clean_msg = msg.replace("\n", " ")
+                await status_queue.put(f"event: status\ndata: [{label}] {clean_msg}\n\n")
+            
+            # Run pipeline (a pack produces one outcome per file)
+            task = asyncio.create_task(run_unit(
+                config, unit, provider, gen_config, progress_callback,
+                checkpoints=get_checkpoint_store(), tracer=tracer
+            ))
+            async for event in _drain_status(task, status_queue, should_stop):
+                yield event
+            if task.cancelled():
+                break
+            try:
+                outcomes = task.result()
+            except Exception as e:
+                outcomes = [(p, e) for p in unit]
+
+            for input_path_str, outcome in outcomes:
+                filename = Path(input_path_str).name
+                if isinstance(outcome, Exception):
+                    import traceback
+                    print("".join(traceback.format_exception(outcome)))
+                    
+                    err_data = {
+                        "filename": filename,
+                        "error": str(outcome)
+                    }
+                    results.append(err_data)
+                    await asyncio.to_thread(state.incr, "files_failed")
+                    yield f"event: file_result\ndata: {json.dumps(err_data)}\n\n"
+                    yield f"event: error\ndata: Error processing {filename}: {str(outcome)}\n\n"
+                    continue
+                summary, file_event = _save_result(filename, outcome, tracer)
+                results.append(summary)
+                await asyncio.to_thread(state.incr, "files_processed")
+                yield f"event: file_result\ndata: {json.dumps(file_event)}\n\n"
+
+        end_time = time.time()
+        duration = end_time - start_time
+        summary = {"job_id": job_id, "results": results, "duration": duration}
+        if report is not None:
+            summary["skipped"] = [{"entry": name, "reason": reason} for name, reason in report.skipped]
+        summary.update(_save_profiles(job_id, tracer, trace_format, sampler))
+        if await should_stop():
+            # Finished windows are checkpointed; resubmitting the same files resumes from them
+            print(f"Job {job_id} cancelled after {duration:.2f}s")
+            yield f"event: cancelled\ndata: {json.dumps(summary)}\n\n"
+            return
+        yield f"event: status\ndata: Total generation time: {duration:.2f} seconds\n\n"
+
+        status = "completed"
+        # Final result: per-file summaries only (bodies were sent as file_result events)
+        del summary["job_id"]
+        yield f"event: result\ndata: {json.dumps(summary)}\n\n"
+        yield "event: complete\ndata: done\n\n"
+        
+    except Exception:
+        status = "failed"
+        raise
+    finally:
+        # Starlette cancels this generator when the client goes away; stop the pipeline with it
+        if task is not None and not task.done():
+            task.cancel()
+        if job_admitted:
+            controller.release("job")
+        if sampler:
+            sampler.stop()
+        await asyncio.shield(asyncio.to_thread(state.finish_job, job_id, status, {
+            "files": len(results),
+            "failed": sum(1 for r in results if "error" in r),
+            "duration": time.time() - start_time
+        }))
+
+def _save_result(filename: str, doc_result: DocResult, tracer: Optional[Tracer]) -> tuple:
+    """
+    Renders and persists one document; returns its summary and its file_result event payload.
+    """
+    # Render
+    with use_tracer(tracer):
+        md_output = render_markdown(doc_result.final_doc)
+    
+    # Persist to disk
+    output_dir = Path("outputs")
+    output_dir.mkdir(exist_ok=True)
+    
+    base_name = Path(filename).stem
+    out_md_path = output_dir / f"{base_name}_doc.md"
+    out_json_path = output_dir / f"{base_name}_doc.json"
+    
+    with open(out_md_path, "w", encoding="utf-8") as f:
+        f.write(md_output)
+    with open(out_json_path, "w", encoding="utf-8") as f:
+        f.write(doc_result.final_doc.model_dump_json(indent=2))
+    artifacts_url = None
+    if doc_result.artifacts is not None:
+        out_artifacts_path = output_dir / f"{base_name}_artifacts.json"
+        with open(out_artifacts_path, "w", encoding="utf-8") as f:
+            f.write(doc_result.artifacts.model_dump_json(indent=2))
+        artifacts_url = f"/v1/outputs/{out_artifacts_path.name}"
+    
+    # Only a small summary is kept for the whole batch; bodies are streamed per file
+    summary = {
+        "filename": filename,
+        "output": out_md_path.name,
+        "saved_to": str(out_md_path.absolute()),
+        "markdown_url": f"/v1/outputs/{out_md_path.name}",
+        "json_url": f"/v1/outputs/{out_json_path.name}",
+        "model_max_ctx": doc_result.model_max_ctx,
+        "word_budget": doc_result.word_budget,
+        "word_count": doc_result.word_count,
+        "calls": [c.model_dump() for c in doc_result.calls],
+        "resumed_windows": doc_result.resumed_windows,
+        "reused_windows": [r.model_dump() for r in doc_result.reused_windows],
+        "packed_with": [Path(p).name for p in doc_result.packed_with],
+        "compaction": doc_result.compaction.model_dump() if doc_result.compaction else None,
+        "artifacts_url": artifacts_url,
+        "artifact_warnings": doc_result.artifact_warnings
+    }
+    
+    file_event = dict(summary)
+    if doc_result.artifacts is not None:
+        file_event["artifacts"] = doc_result.artifacts.model_dump()
+    # Small documents travel inline; large ones are fetched (compressed) by reference
+    if len(md_output.encode("utf-8")) <= INLINE_RESULT_BYTES:
+        file_event["markdown"] = md_output
+    return summary, file_event
+
+def _save_profiles(job_id: str, tracer: Optional[Tracer], trace_format: str, sampler: Optional[CpuSampler]) -> dict:
+    """
+    Writes the job's trace and CPU profile; returns summary fields pointing at them.
+    """
+    fields = {}
+    if tracer:
+        suffix = ".otel.json" if trace_format == "otel" else ".json"
+        tracer.write(TRACE_DIR / f"{job_id}{suffix}", trace_format)
+        fields["trace_url"] = f"/v1/jobs/{job_id}/trace"
+        fields["trace_summary"] = dict(list(tracer.summary().items())[:10])
+    if sampler:
+        sampler.stop()
+        sampler.write_folded(TRACE_DIR / f"{job_id}.folded")
+        fields["cpu_profile_url"] = f"/v1/jobs/{job_id}/cpu_profile"
+    return fields
+
 @app.post("/v1/docgen")
 async def generate_doc(
+    request: Request,
     files: List[UploadFile] = File(...),
     instruction: Optional[str] = Form(None),
     prompt_files: List[UploadFile] = File(default=[]),
@@ -57,12 +358,52 @@ async def generate_doc(
     repeat_penalty: float = Form(1.1),
     top_k: int = Form(40),
     num_predict: int = Form(2048),
-    fast_mode: bool = Form(False)
+    fast_mode: bool = Form(False),
+    auto_ctx: bool = Form(True),
+    max_ctx: Optional[int] = Form(None),
+    draft_model: Optional[str] = Form(None),
+    review_model: Optional[str] = Form(None),
+    repair_model: Optional[str] = Form(None),
+    stage_options: Optional[str] = Form(None),
+    escalate: bool = Form(False),
+    draft_concurrency: int = Form(1),
+    review_concurrency: int = Form(1),
+    stage_queue_size: int = Form(2),
+    pack: bool = Form(False),
+    pack_max_docs: int = Form(8),
+    compact: bool = Form(False),
+    compact_code_lines: Optional[int] = Form(None),
+    compact_table_rows: Optional[int] = Form(None),
+    artifacts: Optional[str] = Form(None),
+    reuse_similar: Optional[float] = Form(None),
+    degenerate_policy: Optional[str] = Form(None),
+    trace: bool = Form(False),
+    trace_format: str = Form("chrome"),
+    profile_cpu: bool = Form(False)
 ):
     """
     Process uploaded markdown files with server-sent events for progress.
     """
     
+    # Per-stage option overrides arrive as a JSON object: {"review": {"temperature": 0}}
+    try:
+        parsed_stage_options = json.loads(stage_options) if stage_options else {}
+        if not isinstance(parsed_stage_options, dict):
+            raise ValueError("expected a JSON object")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid stage_options: {e}")
+    if trace_format not in TRACE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"trace_format must be one of {', '.join(TRACE_FORMATS)}")
+    # Artifacts arrive comma-separated: "glossary,action_items"
+    artifact_kinds = [a.strip() for a in (artifacts or "").split(",") if a.strip()]
+    unknown = [a for a in artifact_kinds if a not in ARTIFACT_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown artifacts {', '.join(unknown)}; expected {', '.join(ARTIFACT_KINDS)}")
+    if reuse_similar is not None and not 0.0 <= reuse_similar <= 1.0:
+        raise HTTPException(status_code=400, detail="reuse_similar must be between 0 and 1")
+    if degenerate_policy and degenerate_policy not in DEGENERATE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"degenerate_policy must be one of {', '.join(DEGENERATE_POLICIES)}")
+
     # 1. Create unique temp dir for this request
     # We must do this synchronously before returning to keep files open while we copy them
     request_temp_dir = tempfile.mkdtemp()
@@ -90,90 +431,69 @@ async def generate_doc(
         shutil.rmtree(request_temp_dir)
         raise HTTPException(status_code=500, detail=f"Failed to save uploaded files: {e}")
 
+    job_id = uuid.uuid4().hex
+    cancel_event = asyncio.Event()
+    _jobs[job_id] = cancel_event
+
+    async def should_stop() -> bool:
+        return (
+            cancel_event.is_set() or await asyncio.to_thread(get_shared_state().cancel_requested, job_id)
+            or await request.is_disconnected()
+        )
+
+    config = InstructionConfig(
+        user_prompt_files=saved_prompt_files,
+        inline_instruction=instruction
+    )
+    
+    gen_config = GenerationConfig(
+        temperature=temperature,
+        top_p=top_p,
+        num_ctx=num_ctx,
+        num_predict=num_predict,
+        presence_penalty=presence_penalty,
+        frequency_penalty=frequency_penalty,
+        repeat_penalty=repeat_penalty,
+        top_k=top_k,
+        fast_mode=fast_mode,
+        auto_ctx=auto_ctx,
+        max_ctx=max_ctx,
+        word_budget=word_budget or None,
+        overlap=overlap,
+        draft_model=draft_model or None,
+        review_model=review_model or None,
+        repair_model=repair_model or None,
+        stage_options=parsed_stage_options,
+        escalate=escalate,
+        draft_concurrency=draft_concurrency,
+        review_concurrency=review_concurrency,
+        stage_queue_size=stage_queue_size,
+        pack=pack,
+        pack_max_docs=pack_max_docs,
+        compact=compact,
+        compact_code_lines=compact_code_lines,
+        compact_table_rows=compact_table_rows,
+        artifacts=artifact_kinds,
+        reuse_similar=reuse_similar,
+        degenerate_policy=degenerate_policy or None
+    )
+
+    async def saved_inputs():
+        for path in saved_input_files:
+            yield path
+
     # 4. Define generator that uses these saved files
     async def event_generator():
-        start_time = time.time()
         try:
-            config = InstructionConfig(
-                user_prompt_files=saved_prompt_files,
-                inline_instruction=instruction
-            )
-            
-            from clarion.schemas import GenerationConfig
-            gen_config = GenerationConfig(
-                temperature=temperature,
-                top_p=top_p,
-                num_ctx=num_ctx,
-                num_predict=num_predict,
-                presence_penalty=presence_penalty,
-                frequency_penalty=frequency_penalty,
-                repeat_penalty=repeat_penalty,
-                top_k=top_k,
-                fast_mode=fast_mode
-            )
-            
-            provider = OllamaProvider(model_name=model)
-            
-            results = []
-            
-            for i, input_path_str in enumerate(saved_input_files):
-                filename = Path(input_path_str).name
-                yield f"event: status\ndata: Processing file {i+1}/{len(saved_input_files)}: {filename}...\n\n"
-                await asyncio.sleep(0.1) 
-                
-                # Callback for pipeline
-                async def progress_callback(msg: str):
-                    clean_msg = msg.replace("\n", " ")
-                    yield f"event: status\ndata: [{filename}] {clean_msg}\n\n"
-                
-                # Run pipeline
-                try:
-                    doc_result = await run_pipeline(config, input_path_str, provider, gen_config, progress_callback)
-                    
-                    # Render
-                    md_output = render_markdown(doc_result.final_doc)
-                    
-                    # Persist to disk
-                    output_dir = Path("outputs")
-                    output_dir.mkdir(exist_ok=True)
-                    
-                    base_name = Path(filename).stem
-                    out_md_path = output_dir / f"{base_name}_doc.md"
-                    out_json_path = output_dir / f"{base_name}_doc.json"
-                    
-                    with open(out_md_path, "w", encoding="utf-8") as f:
-                        f.write(md_output)
-                    with open(out_json_path, "w", encoding="utf-8") as f:
-                        f.write(doc_result.final_doc.model_dump_json(indent=2))
-                    
-                    res_data = {
-                        "filename": filename,
-                        "markdown": md_output,
-                        "json": doc_result.final_doc.model_dump(),
-                        "saved_to": str(out_md_path.absolute())
-                    }
-                    results.append(res_data)
-                    
-                except Exception as e:
-                    import traceback
-                    print(traceback.format_exc())
-                    
-                    err_data = {
-                        "filename": filename,
-                        "error": str(e)
-                    }
-                    results.append(err_data)
-                    yield f"event: error\ndata: Error processing {filename}: {str(e)}\n\n"
-
-            end_time = time.time()
-            duration = end_time - start_time
-            yield f"event: status\ndata: Total generation time: {duration:.2f} seconds\n\n"
-
-            # Final result
-            yield f"event: result\ndata: {json.dumps({'results': results, 'duration': duration})}\n\n"
-            yield "event: complete\ndata: done\n\n"
-            
+            async for event in _job_events(
+                job_id, saved_inputs(), len(saved_input_files), config, gen_config,
+                OllamaProvider(model_name=model), should_stop,
+                tracer=Tracer() if trace else None, trace_format=trace_format,
+                sampler=CpuSampler() if profile_cpu else None
+            ):
+                yield event
         finally:
+            _jobs.pop(job_id, None)
             # CLEANUP TEMP DIR
             try:
                 shutil.rmtree(request_temp_dir)
@@ -182,6 +502,219 @@ async def generate_doc(
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+@app.post("/v1/plan")
+async def plan_docs(
+    files: List[UploadFile] = File(...),
+    instruction: Optional[str] = Form(None),
+    model: str = Form("llama3.1"),
+    config: Optional[str] = Form(None)
+):
+    """
+    Dry run of /v1/docgen: splits inputs and sizes every call without generating.
+    Reports per file the strategy, windows, calls, prompt/output tokens and predicted time
+    (from measured tokens/sec of the model on this server's Ollama backend).
+    Generation options arrive as a JSON GenerationConfig in `config`.
+    """
+    try:
+        gen_config = GenerationConfig.model_validate(json.loads(config)) if config else GenerationConfig()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+
+    instruction_config = InstructionConfig(inline_instruction=instruction)
+    provider = OllamaProvider(model_name=model)
+    texts = {}
+    for file in files:
+        try:
+            texts[file.filename] = (await file.read()).decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail=f"{file.filename} is not UTF-8 text")
+
+    async def names():
+        for name in texts:
+            yield name
+
+    # Predictions include calls measured by the other workers
+    await asyncio.to_thread(shared_throughput_store().refresh)
+    # Grouped like /v1/docgen, so pack=true plans packed calls
+    plans = {}
+    async for unit in iter_units(names(), instruction_config, provider, gen_config, get_checkpoint_store(), texts):
+        for file_plan in await plan_unit(instruction_config, unit, provider, gen_config, get_checkpoint_store(), texts):
+            plans[file_plan.input_file] = file_plan
+    return batch_plan([plans[name] for name in texts]).model_dump()
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response for endpoints that keep reading the request body while responding.
+    The stock response listens for disconnect on `receive`, which would swallow body chunks;
+    here the endpoint detects disconnects itself.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+def _ingest_root() -> Path:
+    # Directory manifests may only point inside this root
+    return Path(os.getenv("CLARION_INGEST_ROOT", ".")).resolve()
+
+@app.post("/v1/docgen/bulk")
+async def generate_doc_bulk(
+    request: Request,
+    model: str = Query("llama3.1"),
+    instruction: Optional[str] = Query(None),
+    include: List[str] = Query(default=[]),
+    max_entry_bytes: int = Query(DEFAULT_MAX_ENTRY_BYTES),
+    config: Optional[str] = Query(None),
+    trace: bool = Query(False),
+    trace_format: str = Query("chrome"),
+    profile_cpu: bool = Query(False)
+):
+    """
+    Bulk generation from a single request body: a tar (optionally compressed) or zip archive,
+    or a JSON directory manifest {"directory": "...", "include": ["*.md"]}.
+    Tar entries are extracted while the upload is still arriving and processed as soon as each
+    one is complete. Generation options arrive as a JSON GenerationConfig in `config`.
+    """
+    try:
+        gen_config = GenerationConfig.model_validate(json.loads(config)) if config else GenerationConfig()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+    if trace_format not in TRACE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"trace_format must be one of {', '.join(TRACE_FORMATS)}")
+
+    content_type = request.headers.get("content-type", "application/x-tar").split(";")[0].strip().lower()
+    patterns = include or DEFAULT_INCLUDE
+    report = IngestReport()
+    request_temp_dir = tempfile.mkdtemp()
+    request_temp_path = Path(request_temp_dir)
+    # Set once the whole body was read; until then disconnects surface through the body stream
+    body_received = asyncio.Event()
+
+    async def body_chunks():
+        async for chunk in request.stream():
+            yield chunk
+        body_received.set()
+
+    if content_type == "application/json":
+        try:
+            manifest = json.loads(await request.body())
+            directory = (_ingest_root() / manifest["directory"]).resolve()
+            patterns = manifest.get("include") or patterns
+        except (ValueError, KeyError, TypeError) as e:
+            shutil.rmtree(request_temp_dir)
+            raise HTTPException(status_code=400, detail=f"Invalid manifest: {e}")
+        if not directory.is_relative_to(_ingest_root()) or not directory.is_dir():
+            shutil.rmtree(request_temp_dir)
+            raise HTTPException(status_code=400, detail=f"Directory not found under ingest root: {manifest['directory']}")
+        body_received.set()
+
+        async def inputs():
+            for path in iter_directory(directory, patterns, max_entry_bytes, report):
+                yield str(path)
+    elif content_type in ZIP_CONTENT_TYPES:
+        async def inputs():
+            # Zip keeps its index at the end: spool the upload first, then extract entry by entry
+            archive_path = request_temp_path / "upload.zip"
+            entries_dir = request_temp_path / "entries"
+            entries_dir.mkdir()
+            with open(archive_path, "wb") as f:
+                async for chunk in body_chunks():
+                    f.write(chunk)
+            for path in iter_zip(archive_path, entries_dir, patterns, max_entry_bytes, report):
+                yield str(path)
+    elif content_type in TAR_CONTENT_TYPES:
+        async def inputs():
+            async for path in stream_tar(body_chunks(), request_temp_path, patterns, max_entry_bytes, report):
+                yield str(path)
+    else:
+        shutil.rmtree(request_temp_dir)
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+
+    job_id = uuid.uuid4().hex
+    cancel_event = asyncio.Event()
+    _jobs[job_id] = cancel_event
+
+    async def should_stop() -> bool:
+        return (
+            cancel_event.is_set() or await asyncio.to_thread(get_shared_state().cancel_requested, job_id)
+            or (body_received.is_set() and await request.is_disconnected())
+        )
+
+    instruction_config = InstructionConfig(inline_instruction=instruction)
+
+    async def event_generator():
+        try:
+            async for event in _job_events(
+                job_id, inputs(), None, instruction_config, gen_config,
+                OllamaProvider(model_name=model), should_stop, report,
+                tracer=Tracer() if trace else None, trace_format=trace_format,
+                sampler=CpuSampler() if profile_cpu else None
+            ):
+                yield event
+        except Exception as e:
+            # Broken or truncated archive, or the client went away mid-upload
+            print(f"Bulk job {job_id} failed: {e}")
+            yield f"event: error\ndata: Failed to read input: {str(e)}\n\n"
+        finally:
+            _jobs.pop(job_id, None)
+            try:
+                shutil.rmtree(request_temp_dir)
+            except Exception as e:
+                print(f"Failed to cleanup temp dir {request_temp_dir}: {e}")
+
+    return _DuplexStreamingResponse(event_generator(), media_type="text/event-stream")
+
+@app.post("/v1/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Cancels a running /v1/docgen or /v1/docgen/bulk job, including its in-flight LLM request.
+    Jobs running in another worker stop at their next cancellation check.
+    """
+    cancel_event = _jobs.get(job_id)
+    if cancel_event is not None:
+        cancel_event.set()
+    elif not await asyncio.to_thread(get_shared_state().request_cancel, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "cancelling", "job_id": job_id}
+
+@app.get("/v1/jobs")
+async def list_jobs(limit: int = Query(50, ge=1, le=500)):
+    """
+    Recent jobs of all workers, newest first.
+    """
+    return {"jobs": await asyncio.to_thread(get_shared_state().list_jobs, limit)}
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a job in any worker: running, completed, cancelled, failed or lost (its worker exited).
+    """
+    job = await asyncio.to_thread(get_shared_state().get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _trace_file(job_id: str, suffixes: List[str]) -> Path:
+    # Job ids are uuid4 hex; anything else cannot name a trace file
+    if re.fullmatch(r"[0-9a-f]{32}", job_id):
+        for suffix in suffixes:
+            path = TRACE_DIR / f"{job_id}{suffix}"
+            if path.exists():
+                return path
+    raise HTTPException(status_code=404, detail="Trace not found")
+
+@app.get("/v1/jobs/{job_id}/trace")
+async def get_trace(job_id: str):
+    """
+    Trace of a job run with trace=true (Chrome trace-event or OTLP/JSON, as requested).
+    """
+    return FileResponse(_trace_file(job_id, [".json", ".otel.json"]), media_type="application/json")
+
+@app.get("/v1/jobs/{job_id}/cpu_profile")
+async def get_cpu_profile(job_id: str):
+    """
+    Sampled Python stacks of a job run with profile_cpu=true, in collapsed (flamegraph) format.
+    """
+    return FileResponse(_trace_file(job_id, [".folded"]), media_type="text/plain")
+
 @app.get("/v1/models")
 async def list_models():
     provider = OllamaProvider()
@@ -192,28 +725,34 @@ async def list_models():
 def health():
     return {"status": "ok"}
 
+@app.get("/v1/ready")
+async def ready():
+    """
+    Readiness: 200 once Ollama is reachable and every warm model (CLARION_WARM_MODELS) is loaded,
+    503 otherwise. Reports each model's load state, measured load time and keep-alive expiry.
+    /v1/health only reports that the server process is up.
+    """
+    warmer = get_model_warmer()
+    await warmer.refresh()
+    return JSONResponse(warmer.status(), status_code=200 if warmer.ready else 503)
+
+_metric_source = HostMetricSource()
+
 @app.get("/v1/metrics")
 async def get_metrics():
     """
-    Returns CPU, RAM, and GPU usage metrics.
+    Returns CPU, RAM, and GPU usage metrics, server counters shared by all workers, and this
+    worker's admission state (null when admission control is disabled).
     """
-    cpu_usage = psutil.cpu_percent()
-    ram_usage = psutil.virtual_memory().percent
-    
-    gpu_usage = None
-    if nvml_initialized:
-        try:
-            handle = pynvml.nvmlDeviceGetHandleByIndex(0)
-            info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            # Memory utilized / memory total
-            gpu_usage = (info.used / info.total) * 100
-        except Exception:
-            pass
-            
+    sample = _metric_source.sample()
+    controller = admission.active_controller()
     return {
-        "cpu": cpu_usage,
-        "ram": ram_usage,
-        "gpu": gpu_usage
+        "cpu": sample.cpu_percent,
+        "ram": sample.ram_percent,
+        "gpu": sample.vram_percent,
+        "swap_rate": sample.swap_rate,
+        "server": await asyncio.to_thread(get_shared_state().metrics),
+        "admission": controller.status() if controller else None
     }
 
 @app.get("/v1/outputs")
@@ -230,10 +769,23 @@ async def list_outputs():
     files.sort(key=lambda f: (output_dir / f).stat().st_mtime, reverse=True)
     return {"outputs": files}
 
+def _json_response(request: Request, payload: dict) -> Response:
+    """
+    JSON response, gzip-compressed if the client accepts it and the body is worth compressing.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    if len(body) >= COMPRESS_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            gzip.compress(body),
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+    return Response(body, media_type="application/json")
+
 @app.get("/v1/outputs/{filename}")
-async def get_output(filename: str):
+async def get_output(filename: str, request: Request):
     """
-    Get the content of a specific markdown document.
+    Get the content of a specific markdown document (or its JSON counterpart).
     """
     output_path = Path("outputs") / filename
     if not output_path.exists():
@@ -242,7 +794,9 @@ async def get_output(filename: str):
     try:
         with open(output_path, "r", encoding="utf-8") as f:
             content = f.read()
-        return {"filename": filename, "markdown": content}
+        if output_path.suffix == ".json":
+            return _json_response(request, {"filename": filename, "json": json.loads(content)})
+        return _json_response(request, {"filename": filename, "markdown": content})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import psutil
+
+from clarion.tracing import span
+
+DEFAULT_STATE_DB = ".clarion/state.db"
+# How often a request waiting for an Ollama slot checks again
+SLOT_POLL_INTERVAL = 0.05
+# Finished jobs kept in the index
+MAX_FINISHED_JOBS = 500
+# Seconds a statement waits for another connection's write lock
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, started_at REAL);
+CREATE TABLE IF NOT EXISTS slots (id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, model TEXT, acquired_at REAL);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY, pid INTEGER, status TEXT, files INTEGER,
+    created_at REAL, updated_at REAL, cancel_requested INTEGER DEFAULT 0, summary TEXT
+);
+CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, updated_at REAL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL);
+CREATE TABLE IF NOT EXISTS throughput (key TEXT PRIMARY KEY, stats TEXT, updated_at REAL);
+"""
+
+
+class SharedState:
+    """
+    Server state shared by every worker process on this host, kept in one SQLite database in
+    WAL mode (concurrent readers, one writer at a time, no server process):
+
+    - a host-wide budget of concurrent Ollama calls (ollama_concurrency, 0 = unlimited)
+    - the job index, so any worker can report on or cancel a job running in another
+    - a small key/value cache (model metadata)
+    - measured throughput per backend and model, behind /v1/plan predictions
+    - counters behind /v1/metrics
+
+    Rows owned by processes that are no longer alive are cleaned up lazily.
+
+    Methods are blocking (a writer can wait on another worker's lock for up to BUSY_TIMEOUT
+    seconds): async code calls them through asyncio.to_thread.
+    """
+    def __init__(self, path: Optional[str] = None, ollama_concurrency: Optional[int] = None):
+        self.path = Path(path or os.getenv("CLARION_STATE_DB", DEFAULT_STATE_DB))
+        if ollama_concurrency is None:
+            ollama_concurrency = int(os.getenv("CLARION_OLLAMA_CONCURRENCY", "0"))
+        self.ollama_concurrency = ollama_concurrency
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and process: SQLite connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self._conn().execute(sql, params)
+
+    # --- Workers ---
+
+    def register_worker(self):
+        self._prune_dead()
+        self._write("INSERT OR REPLACE INTO workers (pid, started_at) VALUES (?, ?)", (os.getpid(), time.time()))
+
+    def unregister_worker(self):
+        pid = os.getpid()
+        self._write("DELETE FROM slots WHERE pid = ?", (pid,))
+        self._write("DELETE FROM workers WHERE pid = ?", (pid,))
+
+    def _prune_dead(self):
+        conn = self._conn()
+        pids = {row[0] for row in conn.execute("SELECT pid FROM workers UNION SELECT pid FROM slots")}
+        dead = [pid for pid in pids if not psutil.pid_exists(pid)]
+        for pid in dead:
+            conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+            conn.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+            conn.execute(
+                "UPDATE jobs SET status = 'lost', updated_at = ? WHERE pid = ? AND status = 'running'",
+                (time.time(), pid)
+            )
+
+    # --- Ollama concurrency budget ---
+
+    def try_acquire_slot(self, model: str) -> Optional[int]:
+        """
+        Takes one of the host's Ollama call slots if one is free; returns its id, or None.
+        """
+        conn = self._conn()
+        # Waiting callers poll: a plain read sees a full budget without taking the write lock
+        if conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0] >= self.ollama_concurrency:
+            return None
+        # IMMEDIATE takes the write lock up front, so count-then-insert cannot race another worker
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            busy = conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+            if busy >= self.ollama_concurrency:
+                conn.execute("ROLLBACK")
+                return None
+            cursor = conn.execute(
+                "INSERT INTO slots (pid, model, acquired_at) VALUES (?, ?, ?)",
+                (os.getpid(), model, time.time())
+            )
+            conn.execute("COMMIT")
+            return cursor.lastrowid
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release_slot(self, slot_id: int):
+        self._write("DELETE FROM slots WHERE id = ?", (slot_id,))
+
+    async def _acquire_slot(self, model: str) -> Optional[int]:
+        acquire = asyncio.ensure_future(asyncio.to_thread(self.try_acquire_slot, model))
+        try:
+            return await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # The thread runs to completion anyway; give back a slot it took for a caller that left
+            def give_back(done: asyncio.Future):
+                if not done.cancelled() and done.exception() is None and done.result() is not None:
+                    asyncio.get_running_loop().run_in_executor(None, self.release_slot, done.result())
+            acquire.add_done_callback(give_back)
+            raise
+
+    @asynccontextmanager
+    async def ollama_slot(self, model: str) -> AsyncIterator[None]:
+        """
+        Holds one Ollama call slot for the duration of the block, waiting for a free one if needed.
+        """
+        await asyncio.to_thread(self.incr, "llm_calls")
+        if self.ollama_concurrency <= 0:
+            yield
+            return
+        slot_id = await self._acquire_slot(model)
+        if slot_id is None:
+            with span("ollama.slot_wait", model=model):
+                checks = 0
+                while slot_id is None:
+                    await asyncio.sleep(SLOT_POLL_INTERVAL)
+                    checks += 1
+                    if checks % 100 == 0:
+                        # A worker that died mid-call never releases its slots
+                        await asyncio.to_thread(self._prune_dead)
+                    slot_id = await self._acquire_slot(model)
+        try:
+            yield
+        finally:
+            # Shielded: the slot is released even if the waiting task is cancelled again
+            await asyncio.shield(asyncio.to_thread(self.release_slot, slot_id))
+
+    # --- Jobs ---
+
+    def start_job(self, job_id: str, files: Optional[int]):
+        now = time.time()
+        self._write(
+            "INSERT OR REPLACE INTO jobs (job_id, pid, status, files, created_at, updated_at) VALUES (?, ?, 'running', ?, ?, ?)",
+            (job_id, os.getpid(), files, now, now)
+        )
+        self.incr("jobs_started")
+
+    def finish_job(self, job_id: str, status: str, summary: Optional[dict] = None):
+        self._write(
+            "UPDATE jobs SET status = ?, updated_at = ?, summary = ? WHERE job_id = ?",
+            (status, time.time(), json.dumps(summary) if summary is not None else None, job_id)
+        )
+        self.incr(f"jobs_{status}")
+        self._write(
+            "DELETE FROM jobs WHERE status != 'running' AND job_id NOT IN "
+            "(SELECT job_id FROM jobs WHERE status != 'running' ORDER BY updated_at DESC LIMIT ?)",
+            (MAX_FINISHED_JOBS,)
+        )
+
+    def request_cancel(self, job_id: str) -> bool:
+        """
+        Flags a running job (in any worker) for cancellation; False if no such job is running.
+        """
+        cursor = self._write(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE job_id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+        return cursor.rowcount > 0
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._conn().execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT job_id, pid, status, files, created_at, updated_at, cancel_requested, summary FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        return self._job_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[dict]:
+        rows = self._conn().execute(
+            "SELECT job_id, pid, status, files, created_at, updated_at, cancel_requested, summary FROM jobs "
+            "ORDER BY created_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [self._job_dict(row) for row in rows]
+
+    @staticmethod
+    def _job_dict(row: tuple) -> dict:
+        job_id, pid, status, files, created_at, updated_at, cancel_requested, summary = row
+        return {
+            "job_id": job_id,
+            "worker_pid": pid,
+            "status": status,
+            "files": files,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "cancel_requested": bool(cancel_requested),
+            "summary": json.loads(summary) if summary else None
+        }
+
+    # --- Cache ---
+
+    def get_cached(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_cached(self, key: str, value: str):
+        self._write("INSERT OR REPLACE INTO cache (key, value, updated_at) VALUES (?, ?, ?)", (key, value, time.time()))
+
+    # --- Throughput history ---
+
+    def throughput_stats(self) -> Dict[str, dict]:
+        return {key: json.loads(stats) for key, stats in self._conn().execute("SELECT key, stats FROM throughput")}
+
+    def update_throughput(self, key: str, update: Callable[[dict], None]):
+        """
+        Read-modify-write of one backend and model's averages; update() changes the entry in place.
+        """
+        conn = self._conn()
+        # IMMEDIATE: two workers saving the same model cannot both read the old averages
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT stats FROM throughput WHERE key = ?", (key,)).fetchone()
+            entry = json.loads(row[0]) if row else {"calls": 0}
+            update(entry)
+            conn.execute(
+                "INSERT OR REPLACE INTO throughput (key, stats, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry), time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def seed_throughput(self, stats: Dict[str, dict]):
+        """
+        Adds entries for backends and models without history yet (from a history file).
+        """
+        now = time.time()
+        for key, entry in stats.items():
+            self._write(
+                "INSERT OR IGNORE INTO throughput (key, stats, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry), now)
+            )
+
+    # --- Metrics ---
+
+    def incr(self, name: str, amount: float = 1):
+        self._write(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def metrics(self) -> dict:
+        """
+        One view across all workers: live workers, running jobs, busy Ollama slots and counters.
+        """
+        self._prune_dead()
+        conn = self._conn()
+        return {
+            "workers": conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0],
+            "running_jobs": conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0],
+            "ollama_slots": {
+                "busy": conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0],
+                "limit": self.ollama_concurrency or None
+            },
+            "counters": {name: value for name, value in conn.execute("SELECT name, value FROM counters")}
+        }
+
+
+# State of this process's server, if it runs one; the CLI leaves it unset
+_active_state: Optional[SharedState] = None
+
+
+def activate(state: Optional[SharedState]):
+    global _active_state
+    _active_state = state
+
+
+def active_state() -> Optional[SharedState]:
+    return _active_state
+
+
+@asynccontextmanager
+async def ollama_slot(model: str) -> AsyncIterator[None]:
+    """
+    Host-wide Ollama concurrency limit when shared state is active; a no-op otherwise.
+    """
+    if _active_state is None:
+        yield
+        return
+    async with _active_state.ollama_slot(model):
+        yield
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+# MinHash signature length, split into BANDS bands for locality-sensitive hashing. Two windows
+# become candidates when one band matches; with 16 bands of 4 rows that is likely from about
+# 0.5 estimated similarity up, and the threshold is then checked on the full signature.
+NUM_PERM = 64
+BANDS = 16
+# Words per shingle; shorter shingles overrate texts that merely share vocabulary
+SHINGLE_WORDS = 5
+
+_PRIME = (1 << 61) - 1
+# Fixed permutation parameters, so signatures stay comparable across runs and processes
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % (_PRIME - 1) + 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % _PRIME)
+    for i in range(NUM_PERM)
+]
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str) -> Set[int]:
+    words = _WORD.findall(text.casefold())
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return {int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "big") for g in grams}
+
+
+def signature(text: str) -> List[int]:
+    """
+    MinHash signature of the text's word shingles; empty for text without words.
+    """
+    hashes = shingles(text)
+    if not hashes:
+        return []
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(a: List[int], b: List[int]) -> float:
+    """
+    Estimated Jaccard similarity of the shingle sets behind two signatures.
+    """
+    if not a or len(a) != len(b):
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _bands(sig: List[int]) -> List[str]:
+    rows = len(sig) // BANDS
+    return [f"{i}:" + ",".join(map(str, sig[i * rows:(i + 1) * rows])) for i in range(BANDS)]
+
+
+class SimilarityIndex:
+    """
+    LSH index of generated windows for one config hash, kept in an append-only JSONL file so
+    later runs and other processes find the windows of earlier ones. Entries appended by other
+    processes are picked up on the next query.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: List[dict] = []
+        self.buckets: Dict[str, List[int]] = {}
+        self._offset = 0
+
+    def _sync(self):
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Another process is still writing this line
+                    break
+                self._offset += len(line)
+                try:
+                    self._insert(json.loads(line))
+                except ValueError:
+                    continue
+
+    def _insert(self, entry: dict):
+        position = len(self.entries)
+        self.entries.append(entry)
+        for band in _bands(entry["sig"]):
+            self.buckets.setdefault(band, []).append(position)
+
+    def add(self, key: str, sig: List[int], word_budget: Optional[int], source: str, window: int):
+        if not sig:
+            return
+        entry = {"key": key, "sig": sig, "word_budget": word_budget, "source": source, "window": window}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One write per line with O_APPEND, so concurrent writers do not interleave lines
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+        # Reads the new entry back, with any other process's entries written before it
+        self._sync()
+
+    def query(self, sig: List[int], word_budget: Optional[int], threshold: float) -> List[Tuple[dict, float]]:
+        """
+        Indexed windows with the same word budget and at least `threshold` estimated similarity,
+        most similar first.
+        """
+        if not sig:
+            return []
+        self._sync()
+        candidates = {position for band in _bands(sig) for position in self.buckets.get(band, [])}
+        matches = []
+        for position in candidates:
+            entry = self.entries[position]
+            if entry.get("word_budget") != word_budget:
+                continue
+            score = similarity(sig, entry["sig"])
+            if score >= threshold:
+                matches.append((entry, score))
+        matches.sort(key=lambda m: -m[1])
+        return matches
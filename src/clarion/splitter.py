@@ -1,14 +1,15 @@
 import re
-from typing import List
+from typing import List, Tuple
 
 class MarkdownSplitter:
     """
     Splits Markdown text into chunks that respect semantic boundaries 
     (Headers, Paragraphs) to preserve context for LLM processing.
     """
-    def __init__(self, chunk_size: int = 4000, overlap: int = 200):
+    def __init__(self, chunk_size: int = 4000, overlap: int = 200, overlap_segments: int = 0):
         self.chunk_size = chunk_size
         self.overlap = overlap
+        self.overlap_segments = overlap_segments
 
     def split_text(self, text: str) -> List[str]:
         """
@@ -20,6 +21,34 @@ class MarkdownSplitter:
         """
         return self._recursive_split(text)
 
+    def split_with_overlap(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Splits text and pairs each chunk with the trailing segments (paragraphs)
+        of the previous chunk, for continuity.
+        Returns (overlap, chunk) tuples. The overlap is at most `overlap_segments`
+        segments and `overlap` characters; the first chunk has none.
+        """
+        chunks = self._recursive_split(text)
+        windows = []
+        previous = ""
+        for chunk in chunks:
+            windows.append((self._tail_segments(previous), chunk))
+            previous = chunk
+        return windows
+
+    def _tail_segments(self, text: str) -> str:
+        if not text or self.overlap_segments <= 0:
+            return ""
+        segments = [s for s in text.split("\n\n") if s.strip()]
+        tail: List[str] = []
+        size = 0
+        for segment in reversed(segments[-self.overlap_segments:]):
+            if size + len(segment) > self.overlap:
+                break
+            tail.insert(0, segment)
+            size += len(segment) + 2
+        return "\n\n".join(tail)
+
     def _recursive_split(self, text: str) -> List[str]:
         if len(text) <= self.chunk_size:
             return [text]
@@ -0,0 +1,106 @@
+import asyncio
+
+from clarion.admission import AdmissionController, Hysteresis, ResourceSample, SimulatedMetricSource
+
+
+def _controller(source: SimulatedMetricSource) -> AdmissionController:
+    # Every decision takes a new sample
+    return AdmissionController(source, sample_interval=0.0)
+
+
+def test_hysteresis_holds_between_thresholds():
+    flag = Hysteresis(high=90, low=80)
+    assert [flag.update(v) for v in (85, 90, 85, 81, 80, 85)] == [False, True, True, True, False, False]
+
+
+def test_vram_is_not_memory_pressure():
+    assert ResourceSample(ram_percent=40.0, vram_percent=99.0).memory_pressure == 40.0
+
+
+def test_hold_admits_one_window_when_idle_and_releases_below_low():
+    source = SimulatedMetricSource()
+    controller = _controller(source)
+    source.set(ram_percent=95.0)
+    assert controller.try_acquire("window")
+    assert not controller.try_acquire("window")
+    # Still held between the thresholds
+    source.set(ram_percent=88.0)
+    assert not controller.try_acquire("window")
+    source.set(ram_percent=84.0)
+    assert controller.try_acquire("window")
+    assert controller.active["window"] == 2
+
+
+def test_tight_caps_context_with_hysteresis():
+    source = SimulatedMetricSource()
+    controller = _controller(source)
+    source.set(ram_percent=82.0)
+    assert controller.cap_ctx(32768) == controller.tight_max_ctx
+    assert controller.cap_ctx(4096) == 4096
+    source.set(ram_percent=75.0)
+    assert controller.cap_ctx(32768) == controller.tight_max_ctx
+    source.set(ram_percent=65.0)
+    assert controller.cap_ctx(32768) == 32768
+
+
+def test_swapping_limits_concurrent_calls():
+    source = SimulatedMetricSource()
+    controller = _controller(source)
+    source.set(ram_percent=50.0, swap_rate=8 * 1024 * 1024)
+    assert controller.try_acquire("call")
+    assert not controller.try_acquire("call")
+    source.set(ram_percent=50.0, swap_rate=100 * 1024)
+    assert controller.try_acquire("call")
+
+
+def test_waiting_is_a_gauge_and_waits_total_a_count():
+    source = SimulatedMetricSource()
+    controller = _controller(source)
+    source.set(ram_percent=95.0)
+    controller.try_acquire("window")
+
+    async def main():
+        waiter = asyncio.create_task(controller.acquire("window"))
+        await asyncio.sleep(0.01)
+        assert controller.status()["waiting"]["window"] == 1
+        source.set(ram_percent=50.0)
+        await waiter
+
+    asyncio.run(main())
+    status = controller.status()
+    assert status["waiting"]["window"] == 0
+    assert status["waits_total"]["window"] == 1
+    assert status["active"]["window"] == 2
+
+
+def test_resident_models_are_not_vram_pressure():
+    # A GPU nearly full of the model server's own resident models
+    assert ResourceSample(ram_percent=40.0, vram_percent=96.0, vram_resident_percent=90.0).vram_pressure == 6.0
+    # Unknown without a GPU or while the resident models are unknown
+    assert ResourceSample(ram_percent=40.0, vram_percent=96.0).vram_pressure is None
+    assert ResourceSample(ram_percent=40.0, vram_resident_percent=90.0).vram_pressure is None
+
+
+def test_vram_outside_resident_models_holds_and_caps_with_its_own_thresholds():
+    source = SimulatedMetricSource()
+    controller = _controller(source)
+    source.set(ram_percent=50.0, vram_percent=98.0, vram_resident_percent=90.0)
+    assert controller.cap_ctx(32768) == 32768
+    # Another process takes a third of the GPU: contexts are capped, work still admitted
+    source.set(ram_percent=50.0, vram_percent=95.0, vram_resident_percent=60.0)
+    assert controller.cap_ctx(32768) == controller.tight_max_ctx
+    assert controller.try_acquire("window") and controller.try_acquire("window")
+    # Over half: new windows wait
+    source.set(ram_percent=50.0, vram_percent=95.0, vram_resident_percent=40.0)
+    assert not controller.try_acquire("window")
+    assert controller.status()["vram_hold"] and not controller.status()["ram_hold"]
+    # Between the VRAM thresholds the hold stays; below the low one it is released
+    source.set(ram_percent=50.0, vram_percent=95.0, vram_resident_percent=50.0)
+    assert not controller.try_acquire("window")
+    source.set(ram_percent=50.0, vram_percent=95.0, vram_resident_percent=60.0)
+    assert controller.try_acquire("window")
+    # Without a reading the VRAM state is kept
+    source.set(ram_percent=50.0)
+    assert controller.cap_ctx(32768) == controller.tight_max_ctx
+    source.set(ram_percent=50.0, vram_percent=95.0, vram_resident_percent=80.0)
+    assert controller.cap_ctx(32768) == 32768
@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from clarion.artifacts import merge_artifacts
+from clarion.providers import OllamaProvider
+from clarion.schemas import ArtifactDoc
+
+
+class ScriptedProvider(OllamaProvider):
+    """
+    Answers chat calls with the given responses in turn.
+    """
+    def __init__(self, responses):
+        super().__init__(model_name="fake", base_url="http://localhost:1")
+        self.responses = list(responses)
+
+    async def _chat(self, payload, policy):
+        return self.responses.pop(0)
+
+
+def test_invalid_items_are_dropped_not_fatal():
+    doc = ArtifactDoc.model_validate({
+        "content": "# Doc",
+        "claims": [{"claim": "A", "confidence": "High"}, {"claim": "B", "confidence": "certain"}, "C"],
+        "glossary": [{"term": "ELISA"}],
+        "action_items": "none"
+    })
+    assert [(c.claim, c.confidence) for c in doc.claims] == [("A", "high")]
+    assert doc.glossary == [] and doc.action_items == []
+    assert len(doc.artifact_warnings) == 3
+    assert "dropped 2 of 3 invalid claims item(s)" in doc.artifact_warnings
+
+
+def test_warnings_are_not_in_the_schema_sent_to_the_model():
+    assert "artifact_warnings" not in json.dumps(ArtifactDoc.model_json_schema())
+
+
+def test_merge_keeps_highest_confidence_and_longest_definition():
+    docs = [
+        ArtifactDoc(content="a", claims=[{"claim": "Caching helps.", "confidence": "low"}], glossary=[{"term": "TTL", "definition": "Lifetime."}]),
+        ArtifactDoc(content="b", claims=[{"claim": "caching helps", "confidence": "high"}], glossary=[{"term": "ttl", "definition": "Time an entry stays cached."}]),
+    ]
+    merged = merge_artifacts(docs, ["claims", "glossary"])
+    assert [(c.claim, c.confidence) for c in merged.claims] == [("Caching helps.", "high")]
+    assert [(t.term, t.definition) for t in merged.glossary] == [("TTL", "Time an entry stays cached.")]
+    assert merged.action_items == []
+
+
+def test_unparseable_response_records_lost_artifacts():
+    provider = ScriptedProvider(["# Just markdown", "# Still just markdown"])
+    doc = asyncio.run(provider.generate_json("prompt", ArtifactDoc))
+    assert doc.content == "# Still just markdown"
+    assert doc.artifact_warnings == ["response was not valid JSON; all artifacts lost"]
@@ -0,0 +1,48 @@
+from clarion.budget import (
+    ctx_bucket, fit_num_ctx, size_num_predict, cap_num_predict, budget_to_tokens,
+    window_word_budget, max_input_tokens, MIN_CTX_BUCKET, MIN_PREDICT, MIN_WINDOW_WORDS, CTX_MARGIN
+)
+from clarion.schemas import GenerationConfig
+
+
+def test_ctx_bucket_is_a_power_of_two_from_the_minimum():
+    assert ctx_bucket(1) == MIN_CTX_BUCKET
+    assert ctx_bucket(MIN_CTX_BUCKET) == MIN_CTX_BUCKET
+    assert ctx_bucket(MIN_CTX_BUCKET + 1) == 2 * MIN_CTX_BUCKET
+    assert ctx_bucket(20000) == 32768
+
+
+def test_calls_of_similar_size_share_a_context():
+    # Draft and review of one window, and windows of other sizes, must not each get their own num_ctx
+    sizes = {fit_num_ctx(prompt, predict, 131072) for prompt, predict in [(2500, 1800), (3100, 2100), (4700, 2400)]}
+    assert sizes == {8192}
+
+
+def test_fit_num_ctx_fits_and_respects_ceiling():
+    assert fit_num_ctx(5000, 2000, 131072) >= 5000 + 2000 + CTX_MARGIN
+    assert fit_num_ctx(50000, 8000, 32768) == 32768
+    # A ceiling that is not a power of two (max_ctx) is used as-is
+    assert fit_num_ctx(9000, 2000, 12000) == 12000
+
+
+def test_num_predict_follows_input_and_caps():
+    config = GenerationConfig(max_predict=4096)
+    assert size_num_predict(10, 1.0, config) == MIN_PREDICT
+    assert size_num_predict(100000, 1.0, config) == 4096
+    assert size_num_predict(1000, 0.5, GenerationConfig(auto_ctx=False, num_predict=777)) == 777
+    assert cap_num_predict(8000, 100) == budget_to_tokens(100)
+    assert cap_num_predict(8000, None) == 8000
+
+
+def test_window_word_budget_is_proportional_with_a_floor():
+    assert window_word_budget(None, 100, 1000) is None
+    assert window_word_budget(2000, 1000, 1000) == 2000
+    assert window_word_budget(2000, 500, 1000) == 1000
+    assert window_word_budget(2000, 1, 1000) == MIN_WINDOW_WORDS
+
+
+def test_max_input_tokens_leaves_room_for_output():
+    config = GenerationConfig()
+    room = max_input_tokens(8192, 1500, 1.0, config)
+    assert 1000 <= room < 8192 - 1500
+    assert max_input_tokens(8192, 1500, 1.0, GenerationConfig(auto_ctx=False)) == 8192 - 2000
@@ -0,0 +1,66 @@
+import asyncio
+
+from clarion.checkpoint import CheckpointStore, config_hash, hash_text, window_key
+from clarion.pipeline import run_pipeline
+from clarion.providers import LLMProvider
+from clarion.schemas import CallRecord, FlexDoc, GenerationConfig, InstructionConfig
+
+BODY = "# Notes\n\nThe service stores sessions in a replicated cache and expires them after an hour."
+
+
+class CountingProvider(LLMProvider):
+    model_name = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_json(self, prompt, schema, config=None, model=None, stage="draft", strict=False):
+        self.calls += 1
+        return schema(content=BODY)
+
+    async def get_context_length(self, model=None):
+        return 8192
+
+
+def test_window_key_covers_everything_in_the_prompt():
+    key = window_key("text", "previous", 100)
+    assert key == window_key("text", "previous", 100)
+    assert len({key, window_key("text!", "previous", 100), window_key("text", "other", 100), window_key("text", "previous", 200)}) == 4
+
+
+def test_config_hash_ignores_scheduling_settings():
+    base = config_hash("Summarize.", "m", GenerationConfig())
+    assert base == config_hash("Summarize.", "m", GenerationConfig(pack=True, draft_concurrency=4, reuse_similar=0.9))
+    assert base != config_hash("Summarize.", "m", GenerationConfig(temperature=0.9))
+    assert base != config_hash("Summarize.", "other", GenerationConfig())
+    assert base != config_hash("List actions.", "m", GenerationConfig())
+
+
+def test_load_needs_resume_and_an_unchanged_window(tmp_path):
+    doc, calls = FlexDoc(content="out"), [CallRecord(stage="draft", model="m", prompt_tokens=1, num_ctx=4096, num_predict=10)]
+    CheckpointStore(str(tmp_path)).save("input", "cfg", 0, "window", doc, calls, key="k")
+    assert CheckpointStore(str(tmp_path)).load("input", "cfg", 0, "window") is None
+    store = CheckpointStore(str(tmp_path), resume=True)
+    loaded, loaded_calls = store.load("input", "cfg", 0, "window")
+    assert loaded.content == "out" and loaded_calls[0].model == "m"
+    assert store.load("input", "cfg", 0, "changed window") is None
+    # An edited document finds unchanged windows by content address
+    assert store.load("edited", "cfg", 3, "window", key="k")[0].content == "out"
+
+
+def test_second_run_resumes_without_calls(tmp_path):
+    async def run(provider, resume):
+        return await run_pipeline(
+            InstructionConfig(), "a.md", provider, GenerationConfig(),
+            checkpoints=CheckpointStore(str(tmp_path), resume=resume), text=BODY
+        )
+
+    first = CountingProvider()
+    asyncio.run(run(first, resume=False))
+    assert first.calls > 0
+    second = CountingProvider()
+    result = asyncio.run(run(second, resume=True))
+    assert second.calls == 0
+    assert result.resumed_windows == [0]
+    assert result.final_doc.content == BODY
+    assert hash_text(BODY) in {p.name for p in tmp_path.iterdir()}
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from clarion.client import ClarionClient
+from clarion.providers import LLMProvider
+from clarion.schemas import DocResult
+
+BODY = "# Notes\n\nThe service stores sessions in a replicated cache."
+
+
+class FakeProvider(LLMProvider):
+    model_name = "fake"
+
+    async def generate_json(self, prompt, schema, config=None, model=None, stage="draft", strict=False):
+        return schema(content=BODY)
+
+    async def get_context_length(self, model=None):
+        return 8192
+
+
+def _client(tmp_path) -> ClarionClient:
+    client = ClarionClient(checkpoint_dir=str(tmp_path / "checkpoints"), resume=False)
+    client.provider = FakeProvider()
+    return client
+
+
+async def _collect(client, documents):
+    return [outcome async for outcome in client.amap(documents)]
+
+
+def test_amap_names_bare_texts_and_yields_every_document(tmp_path):
+    outcomes = asyncio.run(_collect(_client(tmp_path), [BODY, BODY, ("c.md", BODY)]))
+    assert sorted(name for name, _ in outcomes) == ["c.md", "doc-1", "doc-2"]
+    assert all(isinstance(result, DocResult) for _, result in outcomes)
+
+
+def test_amap_rejects_a_single_string(tmp_path):
+    with pytest.raises(TypeError):
+        asyncio.run(_collect(_client(tmp_path), BODY))
+
+
+def test_amap_rejects_duplicate_names_after_the_first_finished(tmp_path):
+    async def documents():
+        yield "a.md", BODY
+        await asyncio.sleep(0.2)
+        yield "a.md", BODY
+
+    with pytest.raises(ValueError):
+        asyncio.run(_collect(_client(tmp_path), documents()))
@@ -0,0 +1,77 @@
+from clarion.compaction import compact_text
+from clarion.schemas import GenerationConfig
+
+PARAGRAPH = "The gateway authenticates each device with a client certificate before the update."
+
+
+def _compact(text, **options):
+    return compact_text(text, GenerationConfig(compact=True, **options))
+
+
+def test_front_matter_comments_and_embedded_images_are_removed():
+    text = (
+        "---\ntitle: Notes\n---\n# Notes\n\nText <!-- internal --> here.\n\n"
+        "![diagram](data:image/png;base64,AAAA)\n\n<img alt=\"logo\" src=\"data:image/png;base64,BBBB\">\n"
+    )
+    out, report = _compact(text)
+    assert "title:" not in out and "internal" not in out and "base64" not in out
+    assert "[image: diagram]" in out and "[image: logo]" in out
+    assert report.removed == {"front_matter": 1, "html_comments": 1, "embedded_images": 2}
+    assert report.saved_tokens > 0
+
+
+def test_consecutive_repeats_are_dropped_but_not_short_ones_or_headings():
+    text = f"# Step\n\n{PARAGRAPH}\n\n{PARAGRAPH}\n\nYes.\n\nYes.\n\n# Step\n\nIntro:\n{PARAGRAPH}\n{PARAGRAPH}\n"
+    out, report = _compact(text)
+    assert out.count(PARAGRAPH) == 2
+    assert out.count("# Step") == 2 and out.count("Yes.") == 2
+    assert report.removed == {"duplicate_paragraphs": 1, "duplicate_lines": 1}
+
+
+def test_a_repeat_in_another_section_is_kept():
+    bullet = "- Returns 401 if the session token has already expired."
+    text = f"## A\n\n{bullet}\n\n## B\n\n- Lists the sessions.\n{bullet}\n"
+    out, report = _compact(text)
+    assert out.count(bullet) == 2
+    assert _compact(f"## A\n\n{bullet}\n\n## B\n\n{bullet}\n")[0].count(bullet) == 2
+    assert report.removed == {}
+
+
+def test_boilerplate_in_many_sections_keeps_its_first_copy():
+    footer = "Confidential: internal use only, do not distribute outside the team."
+    text = "".join(f"## Page {i}\n\nFindings for page {i}.\n{footer}\n\n{footer}\n\n" for i in range(4))
+    out, report = _compact(text)
+    assert out.count(footer) == 1
+    assert all(f"Findings for page {i}." in out for i in range(4))
+    assert report.removed == {"duplicate_lines": 4, "duplicate_paragraphs": 3}
+
+
+def test_code_blocks_are_kept_verbatim_unless_truncation_is_asked_for():
+    code = "```python\n" + "\n".join(f"x{i}  =  {i}" for i in range(20)) + "\n```"
+    out, _ = _compact(f"Intro  text.\n\n{code}\n\n{code}\n")
+    assert out.count(code) == 2
+    assert "Intro text." in out
+    out, report = _compact(code, compact_code_lines=4)
+    assert "x0  =  0" in out and "x19  =  19" in out and "x10" not in out
+    assert "(16 lines omitted)" in out and report.removed["code_lines"] == 16
+    assert out.rstrip().endswith("```")
+
+
+def test_indented_code_is_kept_verbatim():
+    code = "    result  =  compute(value)   # aligned\n\n    total  =  result  +  1"
+    line = "The result is computed once and then reused by every caller below."
+    out, _ = _compact(f"Example:\n\n{code}\n\n{line}\n\n{code}\n\n{line}\n")
+    assert out.count(code) == 2
+    # Indented lines that continue a paragraph are prose
+    out, _ = _compact("Some  text\n    continued  here.\n")
+    assert out == "Some text\n    continued here.\n"
+
+
+def test_tables_keep_header_and_first_rows():
+    table = "| a | b |\n|---|---|\n" + "\n".join(f"| {i} | {i * 2} |" for i in range(10))
+    out, report = _compact(table, compact_table_rows=3)
+    assert out.startswith("| a | b |\n|---|---|\n| 0 | 0 |")
+    assert "| 3 | 6 |" not in out and "(7 more rows omitted)" in out
+    assert report.removed == {"table_rows": 7}
+    # Without the option, table rows are never deduplicated or cut
+    assert _compact(table)[0].strip() == table
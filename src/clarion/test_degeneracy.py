@@ -0,0 +1,78 @@
+import json
+
+from clarion.degeneracy import (
+    DegeneracyDetector, close_json, penalized, CHECK_EVERY, OVERSIZE_MIN_CHARS, STALL_TOKENS
+)
+
+PROSE = (
+    "The gateway authenticates each device with a client certificate before the update starts. "
+    "Packages are signed by the build server and verified on the device against a pinned key. "
+    "A failed verification aborts the installation and reports the error to the fleet service. "
+    "Rollback uses the previous partition, which stays untouched until the new image has booted. "
+)
+LOOP = "A --> B: sends the signed package to the device. "
+
+
+def _feed(detector: DegeneracyDetector, text: str):
+    for word in text.split(" "):
+        reason = detector.feed(word + " ")
+        if reason:
+            return reason
+    return None
+
+
+def test_close_json_completes_dangling_keys_and_values():
+    cases = ['{"a"', '{"a" ', '{"a":', '{"a": 1, "b"', '{"a": 1,', '{"a": ["x", "y"', '{"a": {"b": "c']
+    for prefix in cases:
+        json.loads(close_json(prefix))
+    assert json.loads(close_json('{"a"')) == {"a": None}
+    assert json.loads(close_json('{"a": 1, "b"')) == {"a": 1, "b": None}
+
+
+def test_close_json_handles_escaped_quotes():
+    assert json.loads(close_json('{"a": "say \\"hi')) == {"a": 'say "hi'}
+    # A cut right after a backslash drops the incomplete escape
+    assert json.loads(close_json('{"a": "x\\')) == {"a": "x"}
+    # Braces inside strings are not structure
+    assert json.loads(close_json('{"a": "{[\\"", "b"')) == {"a": '{["', "b": None}
+
+
+def test_templated_but_varying_lines_are_not_repetition():
+    detector = DegeneracyDetector(prompt_chars=100000)
+    assert _feed(detector, " ".join(f"Step {i} checks register {i * 7}." for i in range(300))) is None
+
+
+def test_repetition_stops_and_keeps_one_copy_of_the_loop():
+    detector = DegeneracyDetector(prompt_chars=10000, num_predict=4096)
+    output = '{"content": "' + PROSE + LOOP * 40
+    reason = _feed(detector, output)
+    assert reason == "repetition"
+    stop = detector.stop(reason)
+    content = json.loads(stop.prefix)["content"]
+    assert content.startswith(PROSE.strip())
+    assert content.count("sends the signed package") == 1
+    assert stop.tokens % CHECK_EVERY == 0
+    assert stop.saved_tokens == 4096 - stop.tokens
+
+
+def test_whitespace_stall():
+    detector = DegeneracyDetector(prompt_chars=1000)
+    detector.feed('{"content": "x"')
+    reasons = [detector.feed("\n") for _ in range(STALL_TOKENS)]
+    assert reasons[-1] == "stall" and not any(reasons[:-1])
+    assert json.loads(detector.stop("stall").prefix) == {"content": "x"}
+
+
+def test_oversize_relative_to_prompt_with_a_floor():
+    detector = DegeneracyDetector(prompt_chars=100)
+    assert detector.max_chars == OVERSIZE_MIN_CHARS
+    chunk = "x" * 1000
+    reasons = [detector.feed(chunk) for _ in range(OVERSIZE_MIN_CHARS // 1000 + 1)]
+    assert reasons[-1] == "oversize" and not any(reasons[:-1])
+
+
+def test_penalized_strengthens_repetition_options():
+    options = penalized({"temperature": 0.2, "repeat_penalty": 1.3})
+    assert options["temperature"] == 0.2
+    assert options["repeat_penalty"] > 1.3
+    assert options["repeat_last_n"] >= 512
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import tarfile
+import zipfile
+
+from clarion.ingest import (
+    IngestReport, entry_allowed, safe_name, iter_archive, iter_directory, iter_tar, iter_zip, stream_tar
+)
+
+ENTRIES = {
+    "docs/a.md": b"# A\n",
+    "../escape.md": b"# up\n",
+    "/abs/b.md": b"# B\n",
+    "other/a.md": b"# other A\n",
+    "notes.txt": b"not markdown\n",
+    "big.md": b"x" * 200,
+}
+
+
+def _tar_bytes(entries: dict, mode: str = "w:gz") -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tar:
+        for name, data in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _zip_file(path, entries: dict):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+
+
+def _check_extracted(paths, dest, report: IngestReport):
+    assert all(p.parent == dest for p in paths)
+    assert {p.name for p in paths} == {"docs__a.md", "escape.md", "abs__b.md", "other__a.md"}
+    assert (dest / "escape.md").read_bytes() == b"# up\n"
+    assert len(list(dest.iterdir())) == len(paths)
+    assert dict(report.skipped) == {"notes.txt": "filtered", "big.md": "larger than 100 bytes"}
+    assert len(report.accepted) == 4
+
+
+def test_safe_name_stays_inside_and_is_unique():
+    seen: set = set()
+    assert safe_name("../../etc/passwd", seen) == "etc__passwd"
+    assert safe_name("/etc/passwd", seen) == "etc__passwd_1"
+    assert safe_name("..\\..\\win.md", seen) == "win.md"
+    assert safe_name("dir/win.md", seen) == "dir__win.md"
+    assert safe_name("win.md", seen) == "win_1.md"
+    assert safe_name("a b?.md", seen) == "a_b_.md"
+    assert safe_name("..", seen) == "entry"
+
+
+def test_entry_allowed_matches_path_or_base_name():
+    assert entry_allowed("docs/deep/a.md", ["*.md"])
+    assert entry_allowed("docs/a.txt", ["docs/*"])
+    assert not entry_allowed("docs/a.txt", ["*.md"])
+    assert entry_allowed("a.rst", ["*.md", "*.rst"])
+
+
+def test_tar_extraction_filters_and_sanitises(tmp_path):
+    dest = tmp_path / "out"
+    dest.mkdir()
+    report = IngestReport()
+    paths = list(iter_tar(io.BytesIO(_tar_bytes(ENTRIES)), dest, ["*.md"], 100, report))
+    _check_extracted(paths, dest, report)
+    assert not (tmp_path / "escape.md").exists()
+
+
+def test_zip_extraction_filters_and_sanitises(tmp_path):
+    archive = tmp_path / "in.zip"
+    _zip_file(archive, ENTRIES)
+    dest = tmp_path / "out"
+    dest.mkdir()
+    report = IngestReport()
+    paths = list(iter_zip(archive, dest, ["*.md"], 100, report))
+    _check_extracted(paths, dest, report)
+    assert not (tmp_path / "escape.md").exists()
+
+
+def test_iter_archive_detects_the_format(tmp_path):
+    tar_path = tmp_path / "in.tar.bz2"
+    tar_path.write_bytes(_tar_bytes({"a.md": b"a"}, mode="w:bz2"))
+    zip_path = tmp_path / "in.bin"
+    _zip_file(zip_path, {"b.md": b"b"})
+    dest = tmp_path / "out"
+    dest.mkdir()
+    report = IngestReport()
+    names = [p.name for p in iter_archive(tar_path, dest, ["*.md"], 100, report)]
+    names += [p.name for p in iter_archive(zip_path, dest, ["*.md"], 100, report)]
+    assert names == ["a.md", "b.md"]
+
+
+def test_directory_is_used_in_place(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.md").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    (tmp_path / "c.md").write_text("c" * 200)
+    report = IngestReport()
+    assert list(iter_directory(tmp_path, ["*.md"], 100, report)) == [tmp_path / "sub" / "a.md"]
+    assert report.accepted == ["sub/a.md"]
+    assert dict(report.skipped) == {"b.txt": "filtered", "c.md": "larger than 100 bytes"}
+
+
+def test_stream_tar_extracts_while_chunks_arrive(tmp_path):
+    data = _tar_bytes({f"doc{i}.md": f"# {i}\n".encode() * 50 for i in range(5)}, mode="w")
+    dest = tmp_path / "out"
+    dest.mkdir()
+    report = IngestReport()
+
+    async def chunks():
+        for start in range(0, len(data), 1000):
+            yield data[start:start + 1000]
+            await asyncio.sleep(0)
+
+    async def main():
+        return [p.name async for p in stream_tar(chunks(), dest, ["*.md"], 10000, report)]
+
+    assert asyncio.run(main()) == [f"doc{i}.md" for i in range(5)]
+    assert (dest / "doc3.md").read_bytes() == b"# 3\n" * 50
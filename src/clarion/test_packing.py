@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+
+from clarion.packing import PackingPipeline, plan_unit, run_unit
+from clarion.providers import LLMProvider
+from clarion.schemas import DocResult, GenerationConfig, InstructionConfig, PackedDocs
+
+BODY = "# Notes\n\nThe service stores sessions in a replicated cache and expires them after an hour."
+
+
+class FakeProvider(LLMProvider):
+    """
+    Answers single documents with a fixed body; packed calls time out unless pack_ok is set.
+    """
+    model_name = "fake"
+
+    def __init__(self, pack_ok: bool = False):
+        self.pack_ok = pack_ok
+        self.schemas = []
+
+    async def generate_json(self, prompt, schema, config=None, model=None, stage="draft", strict=False):
+        self.schemas.append(schema)
+        if schema is PackedDocs:
+            if not self.pack_ok:
+                raise httpx.ReadTimeout("timed out")
+            ids = [line.split()[2] for line in prompt.splitlines() if line.startswith("=== DOCUMENT ") or line.startswith("=== DRAFT ")]
+            return PackedDocs(documents=[{"id": i, "content": BODY} for i in ids])
+        return schema(content=BODY)
+
+    async def get_context_length(self, model=None):
+        return 8192
+
+
+async def _units(texts, config):
+    async def names():
+        for name in texts:
+            yield name
+    pipeline = PackingPipeline(FakeProvider(), None)
+    return [unit async for unit in pipeline.group(names(), InstructionConfig(), config, texts)]
+
+
+def test_group_packs_small_documents_up_to_max_docs():
+    texts = {f"{i}.md": BODY for i in range(5)}
+    units = asyncio.run(_units(texts, GenerationConfig(pack=True, pack_max_docs=2)))
+    assert sorted(len(u) for u in units) == [1, 2, 2]
+    assert sorted(name for u in units for name in u) == sorted(texts)
+
+
+def test_group_keeps_large_documents_alone():
+    texts = {"small.md": BODY, "large.md": "word " * 20000, "small2.md": BODY}
+    units = asyncio.run(_units(texts, GenerationConfig(pack=True)))
+    assert ["large.md"] in units
+    assert ["small.md", "small2.md"] in units
+
+
+def test_failed_packed_call_falls_back_to_individual_runs():
+    texts = {"a.md": BODY, "b.md": BODY}
+    provider = FakeProvider()
+    outcomes = asyncio.run(run_unit(InstructionConfig(), ["a.md", "b.md"], provider, GenerationConfig(pack=True), texts=texts))
+    assert [name for name, _ in outcomes] == ["a.md", "b.md"]
+    assert all(isinstance(result, DocResult) for _, result in outcomes)
+    assert PackedDocs in provider.schemas
+
+
+def test_unreadable_member_fails_alone():
+    texts = {"a.md": BODY, "b.md": BODY}
+    outcomes = asyncio.run(run_unit(
+        InstructionConfig(), ["a.md", "missing.md", "b.md"], FakeProvider(pack_ok=True), GenerationConfig(pack=True), texts=texts
+    ))
+    assert [name for name, _ in outcomes] == ["a.md", "missing.md", "b.md"]
+    assert isinstance(outcomes[1][1], KeyError)
+    assert isinstance(outcomes[0][1], DocResult) and outcomes[0][1].packed_with == ["b.md"]
+
+
+def test_plan_of_a_pack_counts_its_shared_calls_once():
+    texts = {"a.md": BODY, "b.md": BODY, "c.md": BODY}
+    plans = asyncio.run(plan_unit(InstructionConfig(), list(texts), FakeProvider(), GenerationConfig(pack=True), texts=texts))
+    assert [p.input_file for p in plans] == list(texts)
+    assert all(p.strategy == "packed" for p in plans)
+    assert [c.stage for c in plans[0].calls] == ["draft", "review"]
+    assert plans[1].calls == [] and plans[2].call_count == 0
+    assert plans[0].packed_with == ["b.md", "c.md"]
+    single = asyncio.run(plan_unit(InstructionConfig(), ["a.md"], FakeProvider(), GenerationConfig(), texts=texts))
+    # Three documents in one pack cost less than three separate runs
+    assert plans[0].call_count < 3 * single[0].call_count
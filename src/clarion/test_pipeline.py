@@ -0,0 +1,93 @@
+import asyncio
+import re
+
+import pytest
+
+from clarion.pipeline import run_pipeline
+from clarion.providers import LLMProvider
+from clarion.schemas import GenerationConfig, InstructionConfig
+
+# Twelve sections of ~480 words, split into three windows at an 8192-token context
+TEXT = "\n\n".join(
+    f"## Section {i}\n\n" + f"Marker W{i:02d} describes the component in detail. " * 60 for i in range(12)
+)
+
+
+class StageProvider(LLMProvider):
+    """
+    Answers every call after a per-stage delay and records when each stage starts and ends.
+    """
+    model_name = "fake"
+
+    def __init__(self, delays: dict, fail_stage: str = None):
+        self.delays = delays
+        self.fail_stage = fail_stage
+        self.events = []
+        self.active = {"draft": 0, "review": 0}
+        self.peak = {"draft": 0, "review": 0}
+
+    async def generate_json(self, prompt, schema, config=None, model=None, stage="draft", strict=False):
+        # The last marker in the prompt belongs to this window (earlier ones are overlap)
+        marker = sorted(set(re.findall(r"W\d\d", prompt)))[-1]
+        self.events.append(("start", stage, marker))
+        self.active[stage] += 1
+        self.peak[stage] = max(self.peak[stage], self.active[stage])
+        try:
+            await asyncio.sleep(self.delays[stage])
+            if stage == self.fail_stage:
+                raise RuntimeError(f"{stage} failed")
+        finally:
+            self.active[stage] -= 1
+        self.events.append(("end", stage, marker))
+        return schema(content=f"# Part {marker}\n\nNotes on {marker}.")
+
+    async def get_context_length(self, model=None):
+        return 8192
+
+
+def _run(provider, config, status_callback=None):
+    return asyncio.run(run_pipeline(
+        InstructionConfig(), "a.md", provider, config, status_callback=status_callback, text=TEXT
+    ))
+
+
+def test_review_overlaps_later_drafts_and_keeps_window_order():
+    provider = StageProvider({"draft": 0.02, "review": 0.05})
+    result = _run(provider, GenerationConfig(review_concurrency=3, stage_queue_size=4))
+    markers = re.findall(r"# Part (W\d\d)", result.final_doc.content)
+    assert len(markers) > 2
+    assert markers == sorted(markers)
+    # The first review starts before the last draft is done
+    first_review = provider.events.index(next(e for e in provider.events if e[1] == "review"))
+    last_draft_end = max(i for i, e in enumerate(provider.events) if e[:2] == ("end", "draft"))
+    assert first_review < last_draft_end
+    assert provider.peak["draft"] == 1 and provider.peak["review"] > 1
+    assert [c.window for c in result.calls if c.stage == "draft"] == list(range(len(markers)))
+
+
+def test_full_queue_holds_back_drafting():
+    provider = StageProvider({"draft": 0.0, "review": 0.05})
+    queued = []
+
+    def status(msg):
+        found = re.search(r"queue (\d+)/(\d+)", msg)
+        if found:
+            queued.append(int(found.group(1)))
+
+    _run(provider, GenerationConfig(stage_queue_size=1), status)
+    assert queued and max(queued) <= 1
+    # With one review worker and one queued draft, drafting stays at most two windows ahead
+    started = 0
+    for kind, stage, _ in provider.events:
+        if kind == "start" and stage == "draft":
+            started += 1
+        elif kind == "end" and stage == "review":
+            started -= 1
+        assert started <= 3
+
+
+def test_stage_failure_surfaces_as_is():
+    provider = StageProvider({"draft": 0.01, "review": 0.01}, fail_stage="review")
+    with pytest.raises(RuntimeError, match="review failed"):
+        _run(provider, GenerationConfig(draft_concurrency=2))
+    assert provider.active == {"draft": 0, "review": 0}
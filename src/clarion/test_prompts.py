@@ -34,6 +34,25 @@ try:
         raise Exception("JSON rules missing in repair")
     print("OK")
 
+    print("Testing packed_generation.j2...")
+    pg = render_prompt(
+        "packed_generation.j2", instruction="TEST", system_guidelines="", word_budget=100,
+        documents=[{"id": "1", "text": "FIRST"}, {"id": "2", "text": "SECOND"}]
+    )
+    if "=== DOCUMENT 1 ===" not in pg or "=== DOCUMENT 2 ===" not in pg:
+        raise Exception("Document headers missing in packed_generation")
+    if "100 words" not in pg:
+        raise Exception("Word budget missing in packed_generation")
+    print("OK")
+
+    print("Testing packed_review.j2...")
+    pr = render_prompt("packed_review.j2", documents=[{"id": "1", "text": "FIRST"}, {"id": "2", "text": "SECOND"}])
+    if "FIRST" not in pr or "SECOND" not in pr:
+        raise Exception("Drafts missing in packed_review")
+    if "MERMAID DIAGRAM RULES" not in pr:
+        raise Exception("Mermaid rules missing in packed_review")
+    print("OK")
+
     print("ALL TESTS PASSED")
 
 except Exception as e:
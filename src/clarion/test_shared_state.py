@@ -0,0 +1,72 @@
+import asyncio
+
+from clarion.shared_state import SharedState
+
+
+def _busy(state: SharedState) -> int:
+    return state.metrics()["ollama_slots"]["busy"]
+
+
+def test_slot_budget_is_enforced_and_released(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"), ollama_concurrency=1)
+    first = state.try_acquire_slot("m")
+    assert first is not None
+    assert state.try_acquire_slot("m") is None
+    state.release_slot(first)
+    assert state.try_acquire_slot("m") is not None
+
+
+def test_waiting_callers_take_turns(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"), ollama_concurrency=1)
+    inside = []
+    peak = []
+
+    async def call():
+        async with state.ollama_slot("m"):
+            inside.append(1)
+            peak.append(len(inside))
+            await asyncio.sleep(0.1)
+            inside.pop()
+
+    async def main():
+        await asyncio.gather(call(), call())
+
+    asyncio.run(main())
+    assert peak == [1, 1]
+    assert _busy(state) == 0
+    assert state.metrics()["counters"]["llm_calls"] == 2
+
+
+def test_cancelled_waiter_leaves_no_slot_behind(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"), ollama_concurrency=1)
+
+    async def main():
+        held = state.try_acquire_slot("m")
+
+        async def wait():
+            async with state.ollama_slot("m"):
+                pass
+
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.2)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        state.release_slot(held)
+        # Let a give-back scheduled by the cancelled waiter run
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert _busy(state) == 0
+
+
+def test_jobs_and_cancel_requests(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"))
+    state.start_job("j1", 2)
+    assert not state.cancel_requested("j1")
+    assert state.request_cancel("j1")
+    assert state.cancel_requested("j1")
+    state.finish_job("j1", "cancelled", {"files": 1})
+    assert not state.request_cancel("j1")
+    job = state.get_job("j1")
+    assert job["status"] == "cancelled" and job["summary"] == {"files": 1}
+    assert [j["job_id"] for j in state.list_jobs()] == ["j1"]
@@ -0,0 +1,87 @@
+import asyncio
+
+from clarion.checkpoint import CheckpointStore
+from clarion.pipeline import run_pipeline
+from clarion.providers import LLMProvider
+from clarion.schemas import GenerationConfig, InstructionConfig
+from clarion.similarity import NUM_PERM, SimilarityIndex, shingles, signature, similarity
+
+WORDS = [f"w{i}" for i in range(400)]
+TEXT = " ".join(WORDS)
+
+
+def _edited(changes: int) -> str:
+    # Replace `changes` evenly spaced words
+    words = list(WORDS)
+    for i in range(changes):
+        words[i * len(words) // changes] = f"edit{i}"
+    return " ".join(words)
+
+
+def _jaccard(a: str, b: str) -> float:
+    x, y = shingles(a), shingles(b)
+    return len(x & y) / len(x | y)
+
+
+def test_signatures_are_stable_and_case_insensitive():
+    assert len(signature(TEXT)) == NUM_PERM
+    assert signature(TEXT) == signature(TEXT.upper())
+    assert signature("") == [] and similarity([], []) == 0.0
+
+
+def test_estimate_tracks_jaccard_similarity():
+    for changes in (2, 10, 40):
+        other = _edited(changes)
+        assert abs(similarity(signature(TEXT), signature(other)) - _jaccard(TEXT, other)) < 0.15
+    assert similarity(signature(TEXT), signature(" ".join(f"x{i}" for i in range(400)))) < 0.1
+
+
+def test_query_applies_threshold_and_word_budget(tmp_path):
+    index = SimilarityIndex(tmp_path / "cfg.jsonl")
+    index.add("k1", signature(TEXT), 500, "a.md", 0)
+    near, far = signature(_edited(2)), signature(_edited(60))
+    [(entry, score)] = index.query(near, 500, 0.9)
+    assert entry["key"] == "k1" and entry["source"] == "a.md" and score >= 0.9
+    assert index.query(far, 500, 0.9) == []
+    # A different word budget asks for a different output
+    assert index.query(near, 800, 0.9) == []
+
+
+def test_entries_of_other_processes_are_picked_up(tmp_path):
+    reader = SimilarityIndex(tmp_path / "cfg.jsonl")
+    assert reader.query(signature(TEXT), None, 0.9) == []
+    SimilarityIndex(tmp_path / "cfg.jsonl").add("k1", signature(TEXT), None, "a.md", 0)
+    assert [entry["key"] for entry, _ in reader.query(signature(TEXT), None, 0.9)] == ["k1"]
+    # A line still being written is skipped until it is complete
+    with open(tmp_path / "cfg.jsonl", "a") as f:
+        f.write('{"key": "partial"')
+    assert len(reader.query(signature(TEXT), None, 0.9)) == 1
+
+
+class CountingProvider(LLMProvider):
+    model_name = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_json(self, prompt, schema, config=None, model=None, stage="draft", strict=False):
+        self.calls += 1
+        return schema(content="# Summary\n\nGenerated once.")
+
+    async def get_context_length(self, model=None):
+        return 8192
+
+
+def test_near_duplicate_document_reuses_the_earlier_output(tmp_path):
+    provider = CountingProvider()
+    config = GenerationConfig(reuse_similar=0.9)
+
+    async def run(name, text):
+        return await run_pipeline(InstructionConfig(), name, provider, config, checkpoints=CheckpointStore(str(tmp_path)), text=text)
+
+    asyncio.run(run("a.md", TEXT))
+    calls = provider.calls
+    result = asyncio.run(run("b.md", _edited(2)))
+    assert provider.calls == calls
+    assert [(r.window, r.source) for r in result.reused_windows] == [(0, "a.md")]
+    assert result.final_doc.content.startswith("# Summary")
@@ -0,0 +1,80 @@
+import json
+
+from clarion.shared_state import SharedState, activate
+from clarion.throughput import ThroughputStore, DEFAULT_EVAL_TPS, shared_throughput_store
+
+# 100 tokens generated in 2s, 1000 prompt tokens in 1s, 0.5s of overhead
+RESPONSE = {"eval_count": 100, "eval_duration": 2_000_000_000, "prompt_eval_count": 1000, "prompt_eval_duration": 1_000_000_000}
+WALL_NS = 3_500_000_000
+
+
+def test_saves_are_batched_until_flush(tmp_path):
+    path = tmp_path / "throughput.json"
+    store = ThroughputStore(str(path))
+    store.record("b", "m", RESPONSE, WALL_NS)
+    store.record("b", "m", RESPONSE, WALL_NS)
+    assert not path.exists()
+    assert store.get("b", "m")["calls"] == 2
+    store.flush()
+    saved = json.loads(path.read_text())
+    assert saved["b|m"]["calls"] == 2 and saved["b|m"]["eval_tps"] == 50.0
+    assert [p.name for p in tmp_path.iterdir()] == ["throughput.json"]
+
+
+def test_processes_sharing_the_file_keep_each_others_history(tmp_path):
+    path = str(tmp_path / "throughput.json")
+    first, second = ThroughputStore(path), ThroughputStore(path)
+    first.record("b", "m", RESPONSE, WALL_NS)
+    second.record("b", "m", dict(RESPONSE, eval_count=50), WALL_NS)
+    second.record("b", "other", RESPONSE, WALL_NS)
+    first.flush()
+    second.flush()
+    merged = ThroughputStore(path)
+    assert merged.get("b", "m")["calls"] == 2
+    assert merged.get("b", "other")["calls"] == 1
+    # The second writer's sample is applied on top of the first's, not instead of it
+    assert 25.0 < merged.get("b", "m")["eval_tps"] < 50.0
+    first.refresh()
+    assert first.get("b", "other") is not None
+
+
+def test_predict_uses_history_or_defaults(tmp_path):
+    store = ThroughputStore(str(tmp_path / "throughput.json"))
+    seconds, source = store.predict("b", "m", 0, 100)
+    assert source == "default" and seconds > 100 / DEFAULT_EVAL_TPS
+    store.record("b", "m", RESPONSE, WALL_NS)
+    seconds, source = store.predict("b", "m", 1000, 100)
+    assert source == "history" and abs(seconds - 3.5) < 1e-6
+
+
+def test_history_is_shared_through_the_state_database(tmp_path):
+    path = tmp_path / "throughput.json"
+    earlier = ThroughputStore(str(path))
+    earlier.record("b", "old", RESPONSE, WALL_NS)
+    earlier.flush()
+
+    state = SharedState(str(tmp_path / "state.db"))
+    first, second = ThroughputStore(str(path), state=state), ThroughputStore(str(path), state=state)
+    first.record("b", "m", RESPONSE, WALL_NS)
+    second.record("b", "m", RESPONSE, WALL_NS)
+    first.flush()
+    second.flush()
+    assert second.get("b", "m")["calls"] == 2
+    first.refresh()
+    assert first.get("b", "m")["calls"] == 2
+    # Seeded from the file once; the file is not written in shared mode
+    assert first.get("b", "old")["calls"] == 1
+    assert json.loads(path.read_text()).keys() == {"b|old"}
+
+
+def test_the_process_store_follows_the_active_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLARION_THROUGHPUT_FILE", str(tmp_path / "throughput.json"))
+    state = SharedState(str(tmp_path / "state.db"))
+    assert shared_throughput_store().state is None
+    activate(state)
+    try:
+        store = shared_throughput_store()
+        assert store.state is state and shared_throughput_store() is store
+    finally:
+        activate(None)
+    assert shared_throughput_store().state is None
@@ -0,0 +1,206 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from clarion.shared_state import SharedState, active_state
+
+DEFAULT_THROUGHPUT_FILE = ".clarion/throughput.json"
+# Used for models without history on a backend (a mid-range GPU running an 8B model)
+DEFAULT_PROMPT_TPS = 400.0
+DEFAULT_EVAL_TPS = 25.0
+DEFAULT_OVERHEAD_S = 0.5
+# Weight of the newest call in the moving averages
+EWMA_ALPHA = 0.2
+# Seconds between saves of the history; calls completed in between are saved together
+SAVE_INTERVAL = 5.0
+
+
+def _apply(entry: dict, sample: dict):
+    for name, value in sample.items():
+        old = entry.get(name)
+        entry[name] = value if old is None else old + EWMA_ALPHA * (value - old)
+    entry["calls"] = entry.get("calls", 0) + 1
+
+
+class ThroughputStore:
+    """
+    Measured Ollama throughput per backend and model, persisted across runs:
+    prompt-eval and generation tokens/sec plus fixed per-call overhead (queueing, load, transfer).
+    Values are exponentially weighted moving averages over completed calls.
+
+    History lives in a JSON file, or with shared state in its database, so all server workers
+    predict from the same averages (models the database has no history for take the file's). Saves are batched (at
+    most one per SAVE_INTERVAL, plus flush()). Each save replays the samples recorded since the
+    last one onto the currently saved averages, so processes keep each other's history.
+    record(), refresh() and flush() do I/O: async code calls them through asyncio.to_thread.
+    With shared state, history is read on refresh().
+    """
+    def __init__(self, path: Optional[str] = None, state: Optional[SharedState] = None):
+        self.path = Path(path or os.getenv("CLARION_THROUGHPUT_FILE", DEFAULT_THROUGHPUT_FILE))
+        self.state = state
+        self._lock = threading.Lock()
+        self._stats: Dict[str, dict] = self._load() if state is None else {}
+        self._seeded = False
+        # Samples not saved yet, per key
+        self._pending: Dict[str, List[dict]] = {}
+        self._last_save = time.monotonic()
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable throughput history {self.path}: {e}")
+            return {}
+
+    @staticmethod
+    def _key(backend: str, model: str) -> str:
+        return f"{backend}|{model}"
+
+    def get(self, backend: str, model: str) -> Optional[dict]:
+        return self._stats.get(self._key(backend, model))
+
+    def record(self, backend: str, model: str, data: dict, wall_ns: int):
+        """
+        Updates the averages from one /api/chat response (durations in ns); saves when due.
+        """
+        prompt_ns = data.get("prompt_eval_duration") or 0
+        eval_ns = data.get("eval_duration") or 0
+        if not eval_ns:
+            return
+        sample = {
+            "eval_tps": data.get("eval_count", 0) / (eval_ns / 1e9),
+            "overhead_s": max(0, wall_ns - prompt_ns - eval_ns) / 1e9,
+        }
+        # Fully cached prompts report no prompt eval time
+        if prompt_ns and data.get("prompt_eval_count"):
+            sample["prompt_tps"] = data["prompt_eval_count"] / (prompt_ns / 1e9)
+
+        key = self._key(backend, model)
+        with self._lock:
+            _apply(self._stats.setdefault(key, {"calls": 0}), sample)
+            self._pending.setdefault(key, []).append(sample)
+            if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """
+        Saves samples recorded since the last save.
+        """
+        with self._lock:
+            if self._pending:
+                self._save()
+
+    def refresh(self):
+        """
+        Picks up history saved by other processes since this one last read or saved it.
+        """
+        with self._lock:
+            self._stats = self._merged(self._saved())
+
+    def _saved(self) -> Dict[str, dict]:
+        if self.state is None:
+            return self._load()
+        self._seed()
+        return self.state.throughput_stats()
+
+    def _seed(self):
+        # Models without shared history yet start from the history file of earlier runs
+        if not self._seeded:
+            self._seeded = True
+            if self.path.exists():
+                self.state.seed_throughput(self._load())
+
+    def _merged(self, stats: Dict[str, dict]) -> Dict[str, dict]:
+        for key, samples in self._pending.items():
+            entry = stats.setdefault(key, {"calls": 0})
+            for sample in samples:
+                _apply(entry, sample)
+        return stats
+
+    def _save(self):
+        self._last_save = time.monotonic()
+        if self.state is not None:
+            self._save_shared()
+            return
+        stats = self._merged(self._load())
+        tmp_name = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # A temporary file of this process's own, so concurrent savers never write to the same one
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.path.parent, prefix=self.path.name + ".", suffix=".tmp", delete=False
+            ) as f:
+                tmp_name = f.name
+                json.dump(stats, f, indent=2)
+            os.replace(tmp_name, self.path)
+        except OSError as e:
+            print(f"Failed to save throughput history: {e}")
+            if tmp_name and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            # Kept pending for the next save
+            return
+        self._stats = stats
+        self._pending = {}
+
+    def _save_shared(self):
+        try:
+            self._seed()
+            for key in list(self._pending):
+                samples = self._pending[key]
+
+                def update(entry: dict):
+                    for sample in samples:
+                        _apply(entry, sample)
+
+                self.state.update_throughput(key, update)
+                # Saved: never replayed twice, even if a later key fails
+                del self._pending[key]
+            self._stats = self._merged(self._saved())
+        except sqlite3.Error as e:
+            print(f"Failed to save throughput history: {e}")
+
+    def predict(self, backend: str, model: str, prompt_tokens: int, output_tokens: int) -> Tuple[float, str]:
+        """
+        Predicted wall-clock seconds for one call, and whether it is based on "history" or "default" rates.
+        """
+        entry = self.get(backend, model)
+        source = "history" if entry else "default"
+        entry = entry or {}
+        prompt_tps = entry.get("prompt_tps") or DEFAULT_PROMPT_TPS
+        eval_tps = entry.get("eval_tps") or DEFAULT_EVAL_TPS
+        overhead = entry.get("overhead_s", DEFAULT_OVERHEAD_S)
+        return prompt_tokens / prompt_tps + output_tokens / eval_tps + overhead, source
+
+
+_shared_store: Optional[ThroughputStore] = None
+_shared_lock = threading.Lock()
+
+
+def shared_throughput_store() -> ThroughputStore:
+    """
+    This process's store: in the shared state database while it is active (server), in the
+    history file otherwise.
+    """
+    global _shared_store
+    state = active_state()
+    with _shared_lock:
+        if _shared_store is None or _shared_store.state is not state:
+            if _shared_store is not None:
+                _shared_store.flush()
+            _shared_store = ThroughputStore(state=state)
+        return _shared_store
+
+
+@atexit.register
+def _flush_shared_store():
+    if _shared_store is not None:
+        _shared_store.flush()
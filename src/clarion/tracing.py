@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_FORMATS = ("chrome", "otel")
+# Default interval between stack samples of the CPU profiler
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Leaf frames of threads that are blocked rather than running Python code
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+_current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("clarion_tracer", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("clarion_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "lane", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any], lane: int, start_ns: Optional[int] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = self.start_ns
+        self.attributes = attributes
+        self.lane = lane
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collects nested spans for one run. Spans nest through context variables, so work started
+    in child asyncio tasks is attributed to the span that was open when the task was created.
+    """
+    def __init__(self, service_name: str = "clarion"):
+        self.service_name = service_name
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self._lanes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _lane(self) -> int:
+        # Chrome trace events must nest per thread id: give each asyncio task (or thread) its own lane
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        name = task.get_name() if task else threading.current_thread().name
+        with self._lock:
+            return self._lanes.setdefault(name, len(self._lanes) + 1)
+
+    def record(self, name: str, start_ns: int, end_ns: int, **attributes) -> Span:
+        """
+        Adds a finished span with explicit timestamps (e.g. phases reported by Ollama),
+        as a child of the current span.
+        """
+        parent = _current_span.get()
+        s = Span(name, parent.span_id if parent else None, attributes, self._lane(), start_ns)
+        s.end_ns = end_ns
+        self._add(s)
+        return s
+
+    def _add(self, s: Span):
+        with self._lock:
+            self.spans.append(s)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Total wall time and count per span name, slowest first.
+        """
+        totals: Dict[str, Dict[str, float]] = {}
+        for s in self.spans:
+            entry = totals.setdefault(s.name, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += s.duration_ms
+        return dict(sorted(totals.items(), key=lambda kv: kv[1]["total_ms"], reverse=True))
+
+    def to_chrome(self) -> dict:
+        """
+        Chrome trace-event format (chrome://tracing, Perfetto, speedscope).
+        """
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": lane, "args": {"name": name}}
+            for name, lane in self._lanes.items()
+        ]
+        for s in sorted(self.spans, key=lambda s: s.start_ns):
+            args = dict(s.attributes)
+            if s.error:
+                args["error"] = s.error
+            events.append({
+                "name": s.name,
+                "cat": self.service_name,
+                "ph": "X",
+                "ts": s.start_ns / 1000,
+                "dur": (s.end_ns - s.start_ns) / 1000,
+                "pid": pid,
+                "tid": s.lane,
+                "args": args
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_otel(self) -> dict:
+        """
+        OpenTelemetry OTLP/JSON (ExportTraceServiceRequest), accepted by collectors' /v1/traces.
+        """
+        spans = []
+        for s in self.spans:
+            span = {
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [_otel_attribute(k, v) for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1}
+            }
+            if s.parent_id:
+                span["parentSpanId"] = s.parent_id
+            spans.append(span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otel_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "clarion.tracing"}, "spans": spans}]
+            }]
+        }
+
+    def write(self, path: Path, fmt: str = "chrome"):
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format '{fmt}', expected one of {', '.join(TRACE_FORMATS)}")
+        data = self.to_otel() if fmt == "otel" else self.to_chrome()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+def _otel_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current_tracer.get()
+
+
+@contextmanager
+def use_tracer(tracer: Optional[Tracer]) -> Iterator[Optional[Tracer]]:
+    """
+    Makes tracer the active one for this context (and tasks created from it). None leaves the current one.
+    """
+    if tracer is None:
+        yield _current_tracer.get()
+        return
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Records a span around the block when a tracer is active; a no-op otherwise.
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield _NULL_SPAN
+        return
+    parent = _current_span.get()
+    s = Span(name, parent.span_id if parent else None, attributes, tracer._lane())
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+        tracer._add(s)
+
+
+class CpuSampler:
+    """
+    Sampling profiler for the Python side: snapshots every thread's stack at a fixed interval
+    and counts identical stacks. Threads blocked in select/wait are not counted, so the result
+    approximates where Python spends CPU. Samples the whole process, including concurrent jobs.
+    """
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="clarion-cpu-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def write_folded(self, path: Path):
+        """
+        Collapsed stacks ("frame;frame;frame count"), as read by flamegraph.pl and speedscope.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from clarion.providers import OllamaProvider
+from clarion.admission import active_controller
+from clarion.budget import DEFAULT_WARM_CTX
+
+# How often resident models are checked and reloaded if Ollama unloaded them
+DEFAULT_CHECK_INTERVAL = 60.0
+
+
+def _canonical(model: str) -> str:
+    # Ollama reports loaded models with their tag
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelState:
+    """
+    Load state of one warm model: cold, loading, ready or failed.
+    """
+    def __init__(self, model: str):
+        self.model = model
+        self.status = "cold"
+        self.load_seconds: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.expires_at: Optional[str] = None
+        self.loads = 0
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+            "expires_at": self.expires_at,
+            "loads": self.loads,
+            "error": self.error
+        }
+
+
+class ModelWarmer:
+    """
+    Loads the configured models when the server starts and keeps them resident: every
+    check_interval it asks Ollama which models are loaded and reloads any it unloaded
+    (idle timeout, eviction by another model). Reloads are skipped while admission control
+    is holding back work for lack of memory, so warming never competes with running jobs.
+    How long each load lasts is Ollama's keep_alive (CLARION_KEEP_ALIVE). Models are loaded at
+    num_ctx, which should be the context bucket jobs use (see budget.ctx_bucket): a call at
+    another size reloads the model.
+    """
+    def __init__(
+        self,
+        models: List[str],
+        provider: Optional[OllamaProvider] = None,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+        num_ctx: int = DEFAULT_WARM_CTX
+    ):
+        self.provider = provider or OllamaProvider()
+        self.check_interval = check_interval
+        self.num_ctx = num_ctx
+        self.states: Dict[str, ModelState] = {model: ModelState(model) for model in dict.fromkeys(models)}
+        self.reachable: Optional[bool] = None
+
+    @classmethod
+    def from_env(cls) -> "ModelWarmer":
+        """
+        Models from CLARION_WARM_MODELS (comma-separated), interval from CLARION_WARM_INTERVAL,
+        context from CLARION_WARM_CTX.
+        """
+        models = [m.strip() for m in os.getenv("CLARION_WARM_MODELS", "").split(",") if m.strip()]
+        return cls(
+            models,
+            check_interval=float(os.getenv("CLARION_WARM_INTERVAL", DEFAULT_CHECK_INTERVAL)),
+            num_ctx=int(os.getenv("CLARION_WARM_CTX", DEFAULT_WARM_CTX))
+        )
+
+    async def warm(self, model: str):
+        state = self.states[model]
+        state.status = "loading"
+        try:
+            state.load_seconds = await self.provider.load_model(model, self.num_ctx)
+        except Exception as e:
+            state.status = "failed"
+            state.error = str(e)
+            print(f"Failed to load {model}: {e}")
+            return
+        state.status = "ready"
+        state.loaded_at = time.time()
+        state.loads += 1
+        state.error = None
+        print(f"Model {model} loaded in {state.load_seconds:.1f}s")
+
+    async def refresh(self) -> Optional[Dict[str, dict]]:
+        """
+        Updates load states from Ollama's list of loaded models; returns that list.
+        """
+        loaded = await self.provider.loaded_models()
+        self.reachable = loaded is not None
+        if loaded is None:
+            return None
+        for model, state in self.states.items():
+            info = loaded.get(_canonical(model))
+            if info is not None:
+                state.status = "ready"
+                state.expires_at = info.get("expires_at")
+            elif state.status == "ready":
+                state.status = "cold"
+                state.expires_at = None
+        return loaded
+
+    async def run(self):
+        """
+        Warms every model once, then keeps them resident until cancelled.
+        """
+        for model in self.states:
+            await self.warm(model)
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if await self.refresh() is None:
+                continue
+            controller = active_controller()
+            if controller is not None and controller.holding:
+                continue
+            for model, state in self.states.items():
+                if state.status in ("cold", "failed"):
+                    await self.warm(model)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.reachable) and all(s.status == "ready" for s in self.states.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ollama_reachable": self.reachable,
+            "num_ctx": self.num_ctx,
+            "models": {model: state.to_dict() for model, state in self.states.items()}
+        }
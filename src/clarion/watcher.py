@@ -0,0 +1,89 @@
+import asyncio
+import fnmatch
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Set, Tuple
+
+try:
+    import watchfiles
+    watchfiles_available = True
+except ImportError:
+    watchfiles_available = False
+
+
+class DirectoryWatcher:
+    """
+    Watches a directory for created or modified files matching the given patterns.
+    Uses OS change notification (watchfiles) when available, otherwise polls mtimes.
+    Bursts of saves are debounced and repeated edits to the same file coalesced, so each
+    yielded batch holds every file that changed at most once.
+    """
+    def __init__(
+        self,
+        root: Path,
+        patterns: List[str],
+        debounce: float = 1.0,
+        poll_interval: float = 1.0,
+        force_polling: bool = False
+    ):
+        self.root = root
+        self.patterns = patterns
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_notify = watchfiles_available and not force_polling
+
+    def matches(self, path: Path) -> bool:
+        return path.is_file() and any(fnmatch.fnmatch(path.name, p) for p in self.patterns)
+
+    def scan(self) -> List[Path]:
+        """
+        All matching files currently in the directory (absolute paths).
+        """
+        return sorted(p.resolve() for p in self.root.rglob("*") if self.matches(p))
+
+    async def changes(self) -> AsyncIterator[Set[Path]]:
+        if self.use_notify:
+            async for batch in self._notify_changes():
+                yield batch
+        else:
+            async for batch in self._poll_changes():
+                yield batch
+
+    async def _notify_changes(self) -> AsyncIterator[Set[Path]]:
+        # watchfiles yields once no new event arrived for `step` ms; `debounce` caps how long
+        # a continuous stream of events is grouped
+        quiet_ms = int(self.debounce * 1000)
+        async for raw in watchfiles.awatch(self.root, step=quiet_ms, debounce=max(1600, quiet_ms * 4)):
+            batch = {
+                Path(path).resolve() for change, path in raw
+                if change != watchfiles.Change.deleted and self.matches(Path(path))
+            }
+            if batch:
+                yield batch
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for path in self.scan():
+            try:
+                stat = path.stat()
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                # Deleted between scan and stat
+                pass
+        return snapshot
+
+    async def _poll_changes(self) -> AsyncIterator[Set[Path]]:
+        previous = self._snapshot()
+        pending: Set[Path] = set()
+        last_change = 0.0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = self._snapshot()
+            changed = {p for p, sig in current.items() if previous.get(p) != sig}
+            previous = current
+            if changed:
+                pending |= changed
+                last_change = time.monotonic()
+            elif pending and time.monotonic() - last_change >= self.debounce:
+                yield {p for p in pending if p.exists()}
+                pending = set()